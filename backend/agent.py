@@ -1,8 +1,11 @@
 import json
 import os
 import asyncio
-from datetime import datetime
-from typing import TypedDict, List, Optional
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import TypedDict, Dict, List, Optional, Tuple
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types
@@ -11,14 +14,47 @@ from langgraph.graph import StateGraph, END
 from langchain_core.callbacks.manager import adispatch_custom_event
 from langchain_core.runnables import RunnableConfig
 
+import async_database
 import database
+import memory_index
 import tools
 import prompts
 
 load_dotenv()
 
-client = genai.Client(api_key=os.getenv("GOOGLE_API_KEY"))
+# GEMINI_BASE_URL points the client at another endpoint (a proxy, or the
+# stub in scripts/check_context_cache.py).
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+client = genai.Client(
+    api_key=os.getenv("GOOGLE_API_KEY"),
+    http_options=types.HttpOptions(base_url=GEMINI_BASE_URL) if GEMINI_BASE_URL else None,
+)
 MODEL_NAME = os.getenv("GEMINI_MODEL", "gemini-3-flash-preview")
+# With recall on, only this many recent messages are sent as conversation;
+# older context arrives as recalled memory in the system prompt.
+RECENT_WINDOW = int(os.getenv("RECENT_WINDOW", "12"))
+# The history sent with each call is cut to this many estimated tokens,
+# newest first; older messages reach the model through the summary (and
+# recall). Summarization starts once the unsummarized buffer is
+# SUMMARY_CHUNK_TOKENS over the budget, and folds in the overflow.
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "8000"))
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "4000"))
+# Stored tool outputs longer than this are clipped when replayed as history
+# (the model saw them in full on the turn they were produced).
+HISTORY_TOOL_OUTPUT_TOKENS = int(os.getenv("HISTORY_TOOL_OUTPUT_TOKENS", "1500"))
+# Summarizer: concurrent conversations, and the bounds of its adaptive chunk
+# size (estimated input tokens per summarization call).
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "2"))
+SUMMARY_MAX_CHUNK_TOKENS = int(os.getenv("SUMMARY_MAX_CHUNK_TOKENS", "16000"))
+SUMMARY_MIN_CHUNK_TOKENS = int(os.getenv("SUMMARY_MIN_CHUNK_TOKENS", "1000"))
+# Conversations whose parsed transcript stays in memory between turns.
+TRANSCRIPT_CACHE_SIZE = int(os.getenv("TRANSCRIPT_CACHE_SIZE", "64"))
+TRANSCRIPT_CACHE_ENABLED = database.READ_CACHE_ENABLED and os.getenv("TRANSCRIPT_CACHE_ENABLED", "1") != "0"
+# Trailing cached messages read again each turn. Postgres hands out ids
+# before commit, so a message can become visible after one with a higher
+# id; one that lands inside this window forces a rebuild instead of being
+# skipped.
+TRANSCRIPT_OVERLAP = int(os.getenv("TRANSCRIPT_OVERLAP", "20"))
 
 TOOL_FUNCTIONS = {
     "create_task": tools.create_task,
@@ -41,32 +77,199 @@ TOOL_FUNCTIONS = {
     "get_profile": tools.get_profile,
     "save_reflection": tools.save_reflection,
     "get_recent_reflections": tools.get_recent_reflections,
+    "search_memory": tools.search_memory,
     "schedule_wake_up": tools.schedule_wake_up,
 }
 
 TOOL_CALLABLES = list(TOOL_FUNCTIONS.values())
 
+# Provider-side context caching of the static prompt and tool declarations.
+CONTEXT_CACHE_ENABLED = os.getenv("CONTEXT_CACHE_ENABLED", "1") != "0"
+CONTEXT_CACHE_TTL = int(os.getenv("CONTEXT_CACHE_TTL", "3600"))
+# A cache with less than this many seconds left is extended before use.
+CONTEXT_CACHE_REFRESH_MARGIN = int(os.getenv("CONTEXT_CACHE_REFRESH_MARGIN", "300"))
+# After a failed create, calls go uncached this long before trying again.
+CONTEXT_CACHE_RETRY_AFTER = int(os.getenv("CONTEXT_CACHE_RETRY_AFTER", "600"))
+
+
+# ---------------------------------------------------------------------------
+# Context cache
+# ---------------------------------------------------------------------------
+
+class ContextCache:
+    """
+    Gemini context caches holding prompts.get_static_prompt(mode) and the
+    tool declarations, one per (model, mode). Requests that reference one
+    send only the per-turn state and the conversation; the static prefix is
+    neither re-sent nor re-billed at the full input rate.
+
+    A cache is extended when less than `refresh_margin` seconds remain and
+    re-created if that fails. When one can't be created at all (prompt under
+    the model's minimum, quota, an endpoint without caching) get() returns
+    None and the caller sends everything inline, as without caching.
+    """
+
+    def __init__(self, client: genai.Client, enabled: bool = CONTEXT_CACHE_ENABLED,
+                 ttl: int = CONTEXT_CACHE_TTL, refresh_margin: int = CONTEXT_CACHE_REFRESH_MARGIN,
+                 retry_after: int = CONTEXT_CACHE_RETRY_AFTER):
+        self.client = client
+        self.enabled = enabled
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.retry_after = retry_after
+        # (model, mode) -> (cache name, monotonic expiry)
+        self._caches: Dict[Tuple[str, Optional[str]], Tuple[str, float]] = {}
+        self._retry_at: Dict[Tuple[str, Optional[str]], float] = {}
+        self._locks: Dict[Tuple[str, Optional[str]], asyncio.Lock] = {}
+        self._tools: Optional[List[types.Tool]] = None
+        self.stats = {"hits": 0, "created": 0, "refreshed": 0, "failures": 0, "fallbacks": 0,
+                      "invalidated": 0, "cached_tokens": 0}
+
+    def _tool_declarations(self) -> List[types.Tool]:
+        # Caches take declarations, not the callables generate_content accepts.
+        if self._tools is None:
+            self._tools = [types.Tool(function_declarations=[
+                types.FunctionDeclaration.from_callable(client=self.client, callable=fn)
+                for fn in TOOL_CALLABLES
+            ])]
+        return self._tools
+
+    def _expires_at(self, cached: types.CachedContent) -> float:
+        """Monotonic deadline from the server's expire_time (our TTL if it sent none)."""
+        remaining = self.ttl
+        if cached.expire_time:
+            remaining = (cached.expire_time - datetime.now(timezone.utc)).total_seconds()
+        return time.monotonic() + remaining
+
+    async def _create(self, model: str, mode: Optional[str]) -> types.CachedContent:
+        return await self.client.aio.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                display_name=f"nachos-{mode or 'default'}",
+                system_instruction=prompts.get_static_prompt(mode),
+                tools=self._tool_declarations(),
+                ttl=f"{self.ttl}s",
+            ),
+        )
+
+    async def _refresh(self, name: str) -> types.CachedContent:
+        return await self.client.aio.caches.update(
+            name=name, config=types.UpdateCachedContentConfig(ttl=f"{self.ttl}s"),
+        )
+
+    async def get(self, model: str, mode: Optional[str]) -> Optional[str]:
+        """Name of a live cache for (model, mode), or None to send the prompt inline."""
+        if not self.enabled:
+            return None
+        key = (model, mode)
+        entry = self._caches.get(key)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        if entry and (entry[1] - time.monotonic() > self.refresh_margin
+                      or (lock.locked() and entry[1] > time.monotonic())):
+            # Fresh, or still valid while another call is extending it.
+            self.stats["hits"] += 1
+            return entry[0]
+
+        async with lock:
+            now = time.monotonic()
+            entry = self._caches.get(key)
+            if entry and entry[1] - now > self.refresh_margin:
+                self.stats["hits"] += 1
+                return entry[0]
+            if now < self._retry_at.get(key, 0):
+                self.stats["fallbacks"] += 1
+                return None
+
+            cached = None
+            if entry and entry[1] > now:
+                try:
+                    cached = await self._refresh(entry[0])
+                    self.stats["refreshed"] += 1
+                except Exception as e:
+                    print(f"Context cache refresh failed for {model}/{mode or 'default'}: {e}")
+            if cached is None:
+                try:
+                    cached = await self._create(model, mode)
+                    self.stats["created"] += 1
+                except Exception as e:
+                    print(f"Context cache unavailable for {model}/{mode or 'default'}, sending prompts inline: {e}")
+                    self._caches.pop(key, None)
+                    self._retry_at[key] = now + self.retry_after
+                    self.stats["failures"] += 1
+                    self.stats["fallbacks"] += 1
+                    return None
+            self._caches[key] = (cached.name or entry[0], self._expires_at(cached))
+            return self._caches[key][0]
+
+    def invalidate(self, model: str, mode: Optional[str], name: str):
+        """Forget `name` after the API refused it (expired or deleted server-side)."""
+        entry = self._caches.get((model, mode))
+        if entry and entry[0] == name:
+            del self._caches[(model, mode)]
+            self.stats["invalidated"] += 1
+
+    def get_stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "caches": {
+                f"{model}/{mode or 'default'}": {"name": name, "expires_in": round(expires - now)}
+                for (model, mode), (name, expires) in self._caches.items()
+            },
+        }
+
+
+context_cache = ContextCache(client)
+
 
 # ---------------------------------------------------------------------------
 # History reconstruction
 # ---------------------------------------------------------------------------
 
-def load_history_from_db(buffer_dicts: list) -> List[types.Content]:
+def message_text(msg: dict) -> str:
+    """Message content as the model sees it: user messages lead with their send time."""
+    if msg['role'] == 'user' and msg.get('sent_at') and msg['content']:
+        return f"[{msg['sent_at']}] {msg['content']}"
+    return msg['content']
+
+
+def message_tokens(msg: dict) -> int:
+    """Estimated tokens `msg` costs when replayed as history."""
+    tokens = msg.get('token_count') or database.estimate_tokens(msg['content'], msg['tool_calls'], msg.get('sent_at'))
+    if msg['role'] == 'tool':
+        tokens = min(tokens, HISTORY_TOOL_OUTPUT_TOKENS + database.MESSAGE_TOKEN_OVERHEAD)
+    return tokens
+
+
+def clip_tool_output(text: str, max_tokens: int = HISTORY_TOOL_OUTPUT_TOKENS) -> str:
+    limit = max_tokens * database.TOKEN_CHARS
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}\n[... {len(text) - limit} more characters of this earlier tool output omitted]"
+
+
+def history_groups(buffer_dicts: list, start: int = 0) -> List[Tuple[int, List[types.Content]]]:
     """
-    Convert DB message rows into Gemini Content objects.
+    Convert DB message rows (from index `start`) into Gemini Content objects.
     Properly pairs assistant function_calls with subsequent tool function_responses
     so the Gemini API sees a valid conversation structure.
+
+    Returns one (row index, Contents) group per user message or assistant
+    turn (with its tool outputs), so a cached transcript can reuse groups.
     """
-    contents: List[types.Content] = []
-    i = 0
+    groups: List[Tuple[int, List[types.Content]]] = []
+    i = start
 
     while i < len(buffer_dicts):
         msg = buffer_dicts[i]
+        first = i
+        contents: List[types.Content] = []
 
         if msg['role'] == 'user':
             if msg['content']:
                 contents.append(types.Content(
-                    role='user', parts=[types.Part(text=msg['content'])]
+                    role='user', parts=[types.Part(text=message_text(msg))]
                 ))
             i += 1
 
@@ -108,7 +311,7 @@ def load_history_from_db(buffer_dicts: list) -> List[types.Content]:
                     response_parts.append(types.Part(
                         function_response=types.FunctionResponse(
                             name=tool_call_names[name_idx],
-                            response={"result": buffer_dicts[i]['content'] or ""}
+                            response={"result": clip_tool_output(buffer_dicts[i]['content'] or "")}
                         )
                     ))
                     name_idx += 1
@@ -123,7 +326,190 @@ def load_history_from_db(buffer_dicts: list) -> List[types.Content]:
         else:
             i += 1
 
-    return contents
+        groups.append((first, contents))
+
+    return groups
+
+
+def load_history_from_db(buffer_dicts: list) -> List[types.Content]:
+    """Convert DB message rows into Gemini Content objects (see history_groups)."""
+    return [content for _, contents in history_groups(buffer_dicts) for content in contents]
+
+
+def recent_window(buffer_dicts: list, size: int = RECENT_WINDOW) -> list:
+    """
+    The last `size` messages, widened back to the user message that opens
+    the exchange so a tool response is never separated from its call.
+    """
+    start = max(0, len(buffer_dicts) - size)
+    while start > 0 and buffer_dicts[start]['role'] != 'user':
+        start -= 1
+    return buffer_dicts[start:]
+
+
+def token_window(buffer_dicts: list, budget: int = HISTORY_TOKEN_BUDGET) -> list:
+    """
+    The newest whole exchanges (a user message and what followed it) that
+    fit in `budget` estimated tokens. The latest exchange is always kept.
+    """
+    start, used = len(buffer_dicts), 0
+    while start > 0:
+        exchange_start = start - 1
+        while exchange_start > 0 and buffer_dicts[exchange_start]['role'] != 'user':
+            exchange_start -= 1
+        cost = sum(message_tokens(m) for m in buffer_dicts[exchange_start:start])
+        if used + cost > budget and start < len(buffer_dicts):
+            break
+        used += cost
+        start = exchange_start
+    return buffer_dicts[start:]
+
+
+# ---------------------------------------------------------------------------
+# Transcript cache
+# ---------------------------------------------------------------------------
+
+class Transcript:
+    """
+    One conversation's unsummarized messages and the Content groups built
+    from them (see history_groups). Never modified once built, so turns can
+    share it without copying.
+    """
+    __slots__ = ("version", "summary", "last_id", "rows", "groups")
+
+    def __init__(self, version: int, summary: str, last_id: int, rows: list,
+                 groups: List[Tuple[int, List[types.Content]]]):
+        self.version = version
+        self.summary = summary
+        self.last_id = last_id    # highest message id read (or summarized)
+        self.rows = rows
+        self.groups = groups
+
+    def contents(self, window: list) -> List[types.Content]:
+        """Contents for `window`, a tail of `rows` that starts at a group (as recent/token windows do)."""
+        start = len(self.rows) - len(window)
+        return [content for first, contents in self.groups if first >= start for content in contents]
+
+    def advance(self, version: int, summary: str, summarized_id: int, new_rows: list) -> "Transcript":
+        """This transcript with rows up to `summarized_id` dropped and `new_rows` appended."""
+        rows, groups = self.rows, self.groups
+        cut = 0
+        while cut < len(rows) and rows[cut]['id'] <= summarized_id:
+            cut += 1
+        if cut:
+            rows = rows[cut:]
+            if cut < len(self.rows) and not any(first == cut for first, _ in groups):
+                # The summary ended inside a group: rebuild.
+                groups = history_groups(rows)
+            else:
+                groups = [(first - cut, contents) for first, contents in groups if first >= cut]
+        if new_rows:
+            rows = rows + new_rows
+            # The last group may still gain tool outputs, so it is parsed again with the new rows.
+            reparse_from = groups[-1][0] if groups else 0
+            groups = [g for g in groups if g[0] < reparse_from] + history_groups(rows, reparse_from)
+        last_id = max(self.last_id, summarized_id, new_rows[-1]['id'] if new_rows else 0)
+        return Transcript(version, summary, last_id, rows, groups)
+
+
+class TranscriptCache:
+    """
+    Per-conversation cache of the transcript sent with each turn. A turn
+    reads only the messages after the last one cached and parses only
+    those (plus the last group, which may still be growing), instead of
+    re-reading and rebuilding the whole unsummarized buffer. Editing or
+    deleting a stored message moves database.transcript_version(), which
+    discards the conversation's entry. The last `overlap` cached messages
+    are read again too, and a message among them the cache hasn't seen
+    (committed out of id order) discards the entry as well.
+    """
+
+    def __init__(self, size: int = TRANSCRIPT_CACHE_SIZE, enabled: bool = TRANSCRIPT_CACHE_ENABLED,
+                 overlap: int = TRANSCRIPT_OVERLAP):
+        self.size = size
+        self.enabled = enabled
+        self.overlap = overlap
+        self._entries: "OrderedDict[str, Transcript]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "rebuilds": 0, "rows_read": 0}
+
+    def _read_after(self, cached: Optional[Transcript]) -> int:
+        """Id to read messages after: just before the last `overlap` cached rows."""
+        if cached is None:
+            return 0
+        if self.overlap <= 0:
+            return cached.last_id
+        if len(cached.rows) <= self.overlap:
+            return 0
+        return cached.rows[-self.overlap]['id'] - 1
+
+    @staticmethod
+    def _unseen(cached: Transcript, floor: int, rows: list) -> Optional[list]:
+        """
+        `rows` (every message after `floor`) less those already cached, or
+        None when they don't extend the cache: a row appeared below the
+        highest id cached, or a cached one is gone.
+        """
+        cached_ids = {r['id'] for r in cached.rows if r['id'] > floor}
+        new_rows = [r for r in rows if r['id'] not in cached_ids]
+        if new_rows and new_rows[0]['id'] < cached.last_id:
+            return None
+        if len(rows) - len(new_rows) != len(cached_ids):
+            return None
+        return new_rows
+
+    def load(self) -> Transcript:
+        """Current tenant's transcript, brought up to date. Blocking; run it on the DB pool."""
+        if not self.enabled:
+            summary, rows = database.get_memory_context()
+            return Transcript(0, summary, 0, rows, history_groups(rows))
+        tenant = database.current_tenant.get()
+        version = database.transcript_version()
+        with self._lock:
+            cached = previous = self._entries.get(tenant)
+        if cached is not None and cached.version != version:
+            cached = None
+
+        read_after = self._read_after(cached)
+        summary, summarized_id, rows = database.get_memory_context_after(read_after)
+        rows_read = len(rows)
+        new_rows = rows
+        if cached is not None:
+            new_rows = self._unseen(cached, max(read_after, summarized_id), rows)
+            if new_rows is None:
+                cached = None
+                with self._lock:
+                    self.stats["rebuilds"] += 1
+                summary, summarized_id, new_rows = database.get_memory_context_after(0)
+                rows_read += len(new_rows)
+        if cached is None:
+            transcript = Transcript(version, summary, 0, [], []).advance(version, summary, summarized_id, new_rows)
+        else:
+            transcript = cached.advance(version, summary, summarized_id, new_rows)
+
+        with self._lock:
+            self.stats["hits" if cached else "misses"] += 1
+            self.stats["rows_read"] += rows_read
+            current = self._entries.get(tenant)
+            # Don't replace an entry another turn has already moved further.
+            if (current is None or current is previous
+                    or (current.version, current.last_id) < (transcript.version, transcript.last_id)):
+                self._entries[tenant] = transcript
+            self._entries.move_to_end(tenant)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return transcript
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                **self.stats,
+                "enabled": self.enabled,
+                "conversations": {tenant: len(t.rows) for tenant, t in self._entries.items()},
+            }
+
+
+transcript_cache = TranscriptCache()
 
 
 # ---------------------------------------------------------------------------
@@ -133,41 +519,90 @@ def load_history_from_db(buffer_dicts: list) -> List[types.Content]:
 class AgentState(TypedDict):
     messages: List[types.Content]
     user_message_str: str
-    system_prompt: str
+    mode: Optional[str]
+    # Per-turn part of the system prompt (prompts.get_state_context).
+    state_context: str
 
 
 # ---------------------------------------------------------------------------
 # Graph nodes
 # ---------------------------------------------------------------------------
 
-async def call_model(state: AgentState, config: RunnableConfig):
-    messages = state["messages"]
+def _model_request(state: AgentState, cache_name: Optional[str]) -> Tuple[types.GenerateContentConfig, List[types.Content]]:
+    """
+    Config and contents for one call. With a context cache the static prompt
+    and tools come from the cache, which rules out a system_instruction, so
+    the per-turn state travels as a leading user turn instead.
+    """
+    afc = types.AutomaticFunctionCallingConfig(disable=True)
+    if cache_name:
+        state_turn = types.Content(role='user', parts=[types.Part(
+            text=f"[CURRENT CONTEXT — provided by the system, not written by the user]\n\n{state['state_context']}"
+        )])
+        conf = types.GenerateContentConfig(
+            cached_content=cache_name, temperature=0.7, automatic_function_calling=afc,
+        )
+        return conf, [state_turn] + state["messages"]
 
     conf = types.GenerateContentConfig(
         tools=TOOL_CALLABLES,
-        system_instruction=state["system_prompt"],
+        system_instruction=f"{prompts.get_static_prompt(state['mode'])}\n\n{state['state_context']}",
         temperature=0.7,
-        automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=True),
+        automatic_function_calling=afc,
     )
+    return conf, state["messages"]
+
 
-    # Retry on transient API errors
-    response_stream = None
-    for attempt in range(3):
+async def _resume_stream(first: List[types.GenerateContentResponse], rest):
+    for chunk in first:
+        yield chunk
+    async for chunk in rest:
+        yield chunk
+
+
+async def open_model_stream(state: AgentState):
+    """Start a streamed generation for `state`, through the context cache when there is one."""
+    cache_name = await context_cache.get(MODEL_NAME, state["mode"])
+    attempt = 0
+    while True:
+        conf, contents = _model_request(state, cache_name)
         try:
-            response_stream = await client.aio.models.generate_content_stream(
-                model=MODEL_NAME, contents=messages, config=conf,
+            stream = await client.aio.models.generate_content_stream(
+                model=MODEL_NAME, contents=contents, config=conf,
             )
-            break
+            # The request goes out on first iteration: pull the first chunk
+            # here so API errors reach the handlers below.
+            try:
+                first = [await stream.__anext__()]
+            except StopAsyncIteration:
+                first = []
+            return _resume_stream(first, stream)
         except Exception as e:
-            if attempt < 2 and any(code in str(e) for code in ("429", "500", "503")):
+            if cache_name and getattr(e, "code", None) in (400, 403, 404):
+                # Most likely the cache expired or was deleted under us; go inline.
+                print(f"Cached request failed ({e}); retrying without the context cache.")
+                context_cache.invalidate(MODEL_NAME, state["mode"], cache_name)
+                cache_name = None
+            elif attempt < 2 and any(code in str(e) for code in ("429", "500", "503")):
+                # Retry on transient API errors
                 await asyncio.sleep(2 ** attempt)
+                attempt += 1
             else:
                 raise
 
+
+async def call_model(state: AgentState, config: RunnableConfig):
+    messages = state["messages"]
+
+    response_stream = await open_model_stream(state)
+
     full_text = ""
     accumulated_parts: List[types.Part] = []
 
     async for chunk in response_stream:
+        if chunk.usage_metadata and chunk.usage_metadata.cached_content_token_count:
+            # Reported on the final chunk only.
+            context_cache.stats["cached_tokens"] += chunk.usage_metadata.cached_content_token_count
         if chunk.text:
             full_text += chunk.text
             await adispatch_custom_event("token", {"text": chunk.text}, config=config)
@@ -191,7 +626,7 @@ async def call_model(state: AgentState, config: RunnableConfig):
     ] or None
 
     if full_text or tool_calls_for_db:
-        database.add_message(
+        await async_database.add_message(
             role='assistant', content=full_text, tool_calls=tool_calls_for_db,
         )
 
@@ -199,11 +634,11 @@ async def call_model(state: AgentState, config: RunnableConfig):
 
 
 async def _run_tool(name: str, args_dict: dict):
-    """Run a single tool function off the event-loop thread."""
+    """Run a single tool function on the DB thread pool, off the event-loop thread."""
     if name not in TOOL_FUNCTIONS:
         return name, f"Error: Tool {name} not found."
     try:
-        result = await asyncio.to_thread(TOOL_FUNCTIONS[name], **args_dict)
+        result = await async_database.run(TOOL_FUNCTIONS[name], **args_dict)
         return name, str(result)
     except Exception as e:
         return name, f"Error executing {name}: {e}"
@@ -220,7 +655,7 @@ async def execute_tools(state: AgentState, config: RunnableConfig):
 
     new_parts: List[types.Part] = []
     for name, output_text in results:
-        database.add_message(role='tool', content=output_text)
+        await async_database.add_message(role='tool', content=output_text)
         new_parts.append(types.Part(
             function_response=types.FunctionResponse(
                 name=name, response={"result": output_text},
@@ -270,20 +705,33 @@ async def _stream_generator(state: AgentState):
 
 
 # ---------------------------------------------------------------------------
-# Memory summarization (runs in background — never blocks a response)
+# Memory summarization (background worker — never blocks a response)
 # ---------------------------------------------------------------------------
 
-async def summarize_memory_if_needed(current_summary: str, buffer_dicts: list) -> str:
-    if len(buffer_dicts) <= 40:
-        return current_summary
-
-    chunk_to_summarize = buffer_dicts[:20]
-    last_summarized_id = chunk_to_summarize[-1]['id']
-
+def summary_chunk(buffer_dicts: list, tokens: List[int], limit: int) -> list:
+    """
+    The oldest messages to fold into the summary next: at least `limit`
+    estimated tokens, extended to an exchange boundary so a tool call and
+    its output stay together. The latest exchange is never included.
+    """
+    last_user = max((i for i, m in enumerate(buffer_dicts) if m['role'] == 'user'), default=0)
+    end, folded = 0, 0
+    while end < last_user and folded < limit:
+        folded += tokens[end]
+        end += 1
+    while end < last_user and buffer_dicts[end]['role'] != 'user':
+        end += 1
+    return buffer_dicts[:end]
+
+
+async def summarize_chunk(current_summary: str, chunk_to_summarize: list) -> str:
+    """The summary with `chunk_to_summarize` merged in (one LLM call)."""
     text_log = ""
     for msg in chunk_to_summarize:
         role = msg['role'].upper()
-        content = msg['content'] or (f"[Tool Call] {msg['tool_calls']}" if msg['tool_calls'] else "")
+        content = message_text(msg) or (f"[Tool Call] {msg['tool_calls']}" if msg['tool_calls'] else "")
+        if msg['role'] == 'tool':
+            content = clip_tool_output(content or "")
         text_log += f"{role}: {content}\n"
 
     summary_prompt = f"""
@@ -323,18 +771,125 @@ RULES:
 - Output ONLY the structured summary — no preamble.
 """
 
-    print(f"Triggering Memory Summarization (Chunk size: {len(chunk_to_summarize)})...")
-    try:
-        response = await client.aio.models.generate_content(
-            model=MODEL_NAME, contents=summary_prompt,
-        )
-        new_summary = response.text
-        database.update_summary(new_summary, last_summarized_id)
-        print("Memory Summarization Complete.")
-        return new_summary
-    except Exception as e:
-        print(f"Summarization Failed: {e}")
-        return current_summary
+    response = await client.aio.models.generate_content(
+        model=MODEL_NAME, contents=summary_prompt,
+    )
+    if not response.text:
+        raise ValueError("empty summary")
+    return response.text
+
+
+class SummaryWorker:
+    """
+    Folds old messages into the session summary off the request path.
+
+    request() queues the current tenant. A tenant is queued at most once and
+    summarized by one worker at a time (single flight), so back-to-back turns
+    never summarize the same messages twice; a request that arrives mid-run
+    gets one more pass afterwards. Once the unsummarized buffer is
+    SUMMARY_CHUNK_TOKENS over HISTORY_TOKEN_BUDGET, the whole overflow is
+    drained in chunks of up to `chunk_tokens`, each committed with its last
+    message id, so an interrupted drain resumes where it stopped. The chunk
+    size halves after a failed call and grows back after successes.
+    """
+
+    def __init__(self, workers: int = SUMMARY_WORKERS):
+        self.workers = workers
+        self.chunk_tokens = SUMMARY_MAX_CHUNK_TOKENS
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._queued: set = set()
+        self._running: set = set()
+        self._rerun: set = set()
+        self.stats = {"requests": 0, "runs": 0, "chunks": 0, "messages": 0, "failures": 0, "superseded": 0}
+
+    def start(self):
+        """Start the workers on the running loop (done on first request if not before)."""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._work(), name=f"summarizer-{i}") for i in range(self.workers)]
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    def request(self, tenant: Optional[str] = None):
+        """Summarize `tenant` (default: the current one) if its buffer is over budget. Never blocks."""
+        tenant = tenant or database.current_tenant.get()
+        self.start()
+        self.stats["requests"] += 1
+        if tenant in self._running:
+            self._rerun.add(tenant)
+        elif tenant not in self._queued:
+            self._queued.add(tenant)
+            self._queue.put_nowait(tenant)
+
+    async def _work(self):
+        while True:
+            tenant = await self._queue.get()
+            self._queued.discard(tenant)
+            self._running.add(tenant)
+            try:
+                with database.tenant_scope(tenant), database.query_scope(f"summarize [{tenant}]"):
+                    await self._drain()
+            except Exception as e:
+                print(f"Summarization failed for {tenant}: {e}")
+            finally:
+                self._running.discard(tenant)
+                if tenant in self._rerun:
+                    self._rerun.discard(tenant)
+                    self.request(tenant)
+
+    async def _drain(self):
+        triggered = False
+        while True:
+            summary, buffer_dicts = await async_database.get_memory_context()
+            tokens = [message_tokens(m) for m in buffer_dicts]
+            overflow = sum(tokens) - HISTORY_TOKEN_BUDGET
+            if overflow <= 0 or (not triggered and overflow < SUMMARY_CHUNK_TOKENS):
+                return
+            if not triggered:
+                self.stats["runs"] += 1
+                triggered = True
+
+            chunk = summary_chunk(buffer_dicts, tokens, min(overflow, self.chunk_tokens))
+            if not chunk:
+                return
+            print(f"Triggering Memory Summarization (Chunk: {len(chunk)} messages, "
+                  f"~{sum(tokens[:len(chunk)])} tokens, {overflow} over budget)...")
+            try:
+                new_summary = await summarize_chunk(summary, chunk)
+            except Exception as e:
+                self.stats["failures"] += 1
+                if self.chunk_tokens <= SUMMARY_MIN_CHUNK_TOKENS:
+                    print(f"Summarization Failed: {e}; leaving the backlog for the next request.")
+                    return
+                self.chunk_tokens = max(SUMMARY_MIN_CHUNK_TOKENS, self.chunk_tokens // 2)
+                print(f"Summarization Failed: {e}; retrying with chunks of {self.chunk_tokens} tokens.")
+                continue
+
+            if not await async_database.update_summary(new_summary, chunk[-1]['id']):
+                # Another instance moved the summary past this chunk first.
+                self.stats["superseded"] += 1
+                continue
+            self.stats["chunks"] += 1
+            self.stats["messages"] += len(chunk)
+            self.chunk_tokens = min(SUMMARY_MAX_CHUNK_TOKENS, self.chunk_tokens * 2)
+            print("Memory Summarization Complete.")
+
+    def get_stats(self) -> dict:
+        return {
+            **self.stats,
+            "chunk_tokens": self.chunk_tokens,
+            "queued": sorted(self._queued),
+            "running": sorted(self._running),
+            "workers": len(self._tasks),
+        }
+
+
+summary_worker = SummaryWorker()
 
 
 # ---------------------------------------------------------------------------
@@ -354,24 +909,42 @@ async def run_chat_agent_async(user_message: str, stream: bool = False, mode: Op
                      matching skill from prompts/<mode>_skill.md.
     """
     # 1. Persist the user message
-    database.add_message('user', f"[{datetime.now().strftime('%Y-%m-%d %H:%M')}] {user_message}")
-
-    # 2. Load memory context ONCE (was previously fetched 3× per request)
-    summary_text, buffer_dicts = database.get_memory_context()
-
-    # 3. Kick off summarization in the background — don't block the response
-    asyncio.create_task(summarize_memory_if_needed(summary_text, buffer_dicts))
+    await async_database.add_message('user', user_message, sent_at=datetime.now().strftime('%Y-%m-%d %H:%M'))
+
+    # 2. Load memory context ONCE, incrementally: only messages added since
+    #    the last turn are read and parsed
+    transcript = await async_database.run(transcript_cache.load)
+    summary_text, buffer_dicts = transcript.summary, transcript.rows
+
+    # 3. Ask the summarizer to fold in any overflow — off the request path,
+    #    at most one run per conversation at a time
+    summary_worker.request()
+
+    # 4. Window the history to HISTORY_TOKEN_BUDGET (and, with recall, a
+    #    short recent window), then recall the older entries relevant to
+    #    this message, so the prompt stays flat as the buffer grows.
+    buffer_dicts = token_window(recent_window(buffer_dicts) if memory_index.RECALL_ENABLED else buffer_dicts)
+    recalled = []
+    if memory_index.RECALL_ENABLED:
+        recalled = await async_database.run(
+            memory_index.recall, user_message, exclude_messages=[m['id'] for m in buffer_dicts],
+        )
 
-    # 4. Build system prompt once, passing cached summary AND active mode
-    system_prompt = prompts.get_system_context(summary_text=summary_text, mode=mode)
+    # 5. Build the per-turn part of the system prompt once, passing cached
+    #    summary and recalled memory; the static part (soul, skills, tools,
+    #    mode overlay) is added per call, or comes from the context cache.
+    state_context = await async_database.run(
+        prompts.get_state_context, summary_text=summary_text, recalled=recalled,
+    )
 
-    # 5. Reconstruct conversation history from the cached buffer
-    initial_messages = load_history_from_db(buffer_dicts)
+    # 6. Conversation history for the (windowed) buffer, from the transcript's prebuilt Contents
+    initial_messages = transcript.contents(buffer_dicts)
 
     state = AgentState(
         messages=initial_messages,
         user_message_str=user_message,
-        system_prompt=system_prompt,
+        mode=prompts.skill_mode(mode),
+        state_context=state_context,
     )
 
     if stream:
@@ -393,7 +966,7 @@ async def wake_cooper(reason: str):
     """Proactive entry point called by the scheduler."""
     try:
         print(f"Waking Cooper: {reason}")
-        ctx = database.get_wake_context()
+        ctx = await async_database.get_wake_context()
 
         sections = [
             "[SYSTEM EVENT]",
@@ -448,7 +1021,7 @@ async def wake_cooper(reason: str):
 
         from connection_manager import manager
         print(f"Cooper speaks: {response_text}")
-        await manager.broadcast_message(response_text)
+        await manager.send_to_tenant(database.current_tenant.get(), response_text)
 
     except Exception as e:
         print(f"Error in wake_cooper: {e}")
@@ -0,0 +1,99 @@
+"""
+Async face of database.py for the event-loop hot path.
+
+Every function here has the same name and signature as its database.py
+counterpart but is a coroutine: the call runs on a small dedicated thread
+pool, so the loop thread never blocks on a connection, a lock or a query.
+The SQL itself lives only in database.py — this module adds no second
+code path per dialect.
+
+Sizing the pool to the number of SQLite reader connections / Postgres pool
+slots we want busy at once keeps DB concurrency bounded even when many
+WebSocket and SSE streams are active.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+import database
+
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "8"))
+
+_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+
+async def run(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Run a blocking callable that touches the database on the DB thread pool.
+    Context variables (request-scoped state) are carried over to the worker.
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, functools.partial(ctx.run, fn, *args, **kwargs))
+
+
+def _wrap(fn: Callable[..., Any]) -> Callable[..., Any]:
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await run(fn, *args, **kwargs)
+    return wrapper
+
+
+def shutdown():
+    _executor.shutdown(wait=False)
+
+
+# --- MEMORY ---
+save_push_token = _wrap(database.save_push_token)
+get_push_tokens = _wrap(database.get_push_tokens)
+add_message = _wrap(database.add_message)
+update_message_content = _wrap(database.update_message_content)
+delete_message = _wrap(database.delete_message)
+get_memory_context = _wrap(database.get_memory_context)
+get_memory_context_after = _wrap(database.get_memory_context_after)
+update_summary = _wrap(database.update_summary)
+get_messages_range = _wrap(database.get_messages_range)
+get_recent_messages = _wrap(database.get_recent_messages)
+get_chat_history = _wrap(database.get_chat_history)
+
+# --- GOALS & TASKS ---
+create_goal = _wrap(database.create_goal)
+update_goal = _wrap(database.update_goal)
+list_goals = _wrap(database.list_goals)
+create_task = _wrap(database.create_task)
+update_task = _wrap(database.update_task)
+update_task_status = _wrap(database.update_task_status)
+delete_task = _wrap(database.delete_task)
+bulk_update_tasks = _wrap(database.bulk_update_tasks)
+list_tasks = _wrap(database.list_tasks)
+
+# --- HABITS ---
+create_habit = _wrap(database.create_habit)
+log_habit = _wrap(database.log_habit)
+list_habits = _wrap(database.list_habits)
+update_habit = _wrap(database.update_habit)
+get_habit_streaks = _wrap(database.get_habit_streaks)
+
+# --- PROFILE & REFLECTIONS ---
+set_profile = _wrap(database.set_profile)
+get_profile = _wrap(database.get_profile)
+save_reflection = _wrap(database.save_reflection)
+get_recent_reflections = _wrap(database.get_recent_reflections)
+search_memory = _wrap(database.search_memory)
+
+# --- ARCHIVE ---
+archive_cold_rows = _wrap(database.archive_cold_rows)
+get_archive_stats = _wrap(database.get_archive_stats)
+
+# --- ANALYTICS & CONTEXT ---
+get_task_stats = _wrap(database.get_task_stats)
+get_todays_tasks = _wrap(database.get_todays_tasks)
+get_overdue_tasks = _wrap(database.get_overdue_tasks)
+get_goal_progress = _wrap(database.get_goal_progress)
+get_rescheduled_tasks = _wrap(database.get_rescheduled_tasks)
+get_streak_data = _wrap(database.get_streak_data)
+get_wake_context = _wrap(database.get_wake_context)
+get_context_markdown = _wrap(database.get_context_markdown)
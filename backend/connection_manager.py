@@ -1,41 +1,47 @@
 from fastapi import WebSocket
-from typing import List
+from typing import Dict, List
 import json
 import httpx
 import asyncio
+import async_database
 import database
 
 class ConnectionManager:
     """
     Manages active WebSocket connections and fallback Push Notifications.
+    Connections are kept per tenant so a message only reaches its own user.
     """
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self.active_connections: Dict[str, List[WebSocket]] = {}
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, tenant: str):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        self.active_connections.setdefault(tenant, []).append(websocket)
 
     def disconnect(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            self.active_connections.remove(websocket)
+        for tenant, connections in list(self.active_connections.items()):
+            if websocket in connections:
+                connections.remove(websocket)
+                if not connections:
+                    del self.active_connections[tenant]
 
     async def send_json(self, message: dict, websocket: WebSocket):
         await websocket.send_json(message)
 
-    async def broadcast_message(self, text_message: str):
+    async def send_to_tenant(self, tenant: str, text_message: str):
         """
-        Sends a message to all active WebSockets.
-        Falls back to Push Notification if no delivery succeeded.
+        Sends a message to the tenant's active WebSockets.
+        Falls back to the tenant's Push Notification tokens if no delivery succeeded.
         """
         msg_payload = {"text": text_message, "is_final": True}
         delivered_via_ws = False
+        connections = list(self.active_connections.get(tenant, []))
 
-        # 1. Try WebSocket Broadcast
-        if self.active_connections:
-            print(f"📡 Broadcasting via WebSocket to {len(self.active_connections)} clients")
+        # 1. Try the tenant's WebSockets
+        if connections:
+            print(f"📡 Sending via WebSocket to {len(connections)} clients of {tenant}")
             dead_connections = []
-            for connection in self.active_connections:
+            for connection in connections:
                 try:
                     await connection.send_json(msg_payload)
                     delivered_via_ws = True
@@ -48,10 +54,11 @@ class ConnectionManager:
         # 2. Fallback to Push Notification if no WS delivery succeeded
         if not delivered_via_ws:
             print("📴 No successful WS delivery. Sending Push Notification.")
-            await self._send_push_notification(text_message)
+            with database.tenant_scope(tenant):
+                await self._send_push_notification(text_message)
 
     async def _send_push_notification(self, body: str):
-        tokens = database.get_push_tokens()
+        tokens = await async_database.get_push_tokens()
         if not tokens:
             print("⚠️ No push tokens registered.")
             return
@@ -1,25 +1,72 @@
 import sqlite3
 import os
 import re
-from datetime import datetime, timedelta
-from typing import List, Optional, Dict, Any, Tuple
+import sys
+import threading
+import time
+from collections import deque
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Dict, Any, Callable, Sequence, Tuple
 import json
+import zlib
+import hmac
+import hashlib
 from contextlib import contextmanager
+from contextvars import ContextVar
+
+from db_pool import SQLitePool, SQLitePoolCache, PostgresPool
 
 # Check for PostgreSQL dependency
 try:
     import psycopg2
+    import psycopg2.extensions
     from psycopg2.extras import RealDictCursor
-    from psycopg2 import pool
     HAS_POSTGRES = True
 except ImportError:
     HAS_POSTGRES = False
 
+if HAS_POSTGRES:
+    def _iso_caster(base):
+        def cast(value, cur):
+            parsed = base(value, cur)
+            return parsed.isoformat() if parsed is not None else None
+        return cast
+
+    # DATE/TIMESTAMP columns come back as the same ISO strings SQLite stores,
+    # so rows look identical to callers whichever database is behind them.
+    _PG_DATE_AS_ISO = psycopg2.extensions.new_type(
+        psycopg2.extensions.PYDATE.values, "DATE_ISO", _iso_caster(psycopg2.extensions.PYDATE))
+    _PG_TIMESTAMP_AS_ISO = psycopg2.extensions.new_type(
+        psycopg2.extensions.PYDATETIME.values, "TIMESTAMP_ISO", _iso_caster(psycopg2.extensions.PYDATETIME))
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 DB_NAME = "nachos.db"
 
-# Global connection pool for Postgres
+# Global connection pool for Postgres (see db_pool.PostgresPool)
 pg_pool = None
+_pg_pool_lock = threading.Lock()
+
+# Persistent connections for SQLite (see db_pool.SQLitePool)
+sqlite_pool = None
+
+# Tenant-sharded SQLite: with TENANT_DB_DIR set, every tenant (user) gets its
+# own database file <TENANT_DB_DIR>/<tenant>.db, migrated on first open and
+# served from an LRU of open pools. Callers pick the tenant with
+# tenant_scope(); code that never sets one uses DEFAULT_TENANT. Without
+# TENANT_DB_DIR (or on Postgres) there is the single shared database.
+TENANT_DB_DIR = None if DATABASE_URL else os.getenv("TENANT_DB_DIR")
+DEFAULT_TENANT = os.getenv("DEFAULT_TENANT", "default")
+current_tenant: ContextVar[str] = ContextVar("current_tenant", default=DEFAULT_TENANT)
+_TENANT_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+# Clients prove their tenant with a bearer token "<tenant>.<signature>", the
+# signature being HMAC-SHA256(TENANT_AUTH_SECRET, tenant) in hex (issue them
+# with scripts/tenant_token.py). Without a secret no tenant can be claimed and
+# every request runs as DEFAULT_TENANT.
+TENANT_AUTH_SECRET = os.getenv("TENANT_AUTH_SECRET")
+tenant_pools = SQLitePoolCache() if TENANT_DB_DIR else None
+_migrated_tenants = set()
+_tenant_migration_lock = threading.Lock()
+_tenant_migrating = threading.local()
 
 ALLOWED_TASK_COLUMNS = {'status', 'title', 'priority', 'due_date', 'scheduled_date', 'effort', 'notes', 'blocker_reason'}
 ALLOWED_GOAL_COLUMNS = {'title', 'description', 'status', 'notes'}
@@ -30,37 +77,159 @@ ALLOWED_PROFILE_KEYS = {
     'biggest_goal', 'motivation_style', 'check_in_preference',
 }
 
+def _get_sqlite_pool() -> SQLitePool:
+    global sqlite_pool
+    if sqlite_pool is None:
+        sqlite_pool = SQLitePool(DB_NAME)
+    return sqlite_pool
+
+def validate_tenant(tenant: str) -> str:
+    """Tenant ids become file names, so only [A-Za-z0-9_-] is allowed."""
+    if not isinstance(tenant, str) or not _TENANT_RE.match(tenant):
+        raise ValueError(f"Invalid tenant id: {tenant!r}")
+    return tenant
+
+def _tenant_signature(tenant: str) -> str:
+    return hmac.new(TENANT_AUTH_SECRET.encode(), tenant.encode(), hashlib.sha256).hexdigest()
+
+def tenant_token(tenant: str) -> str:
+    """Bearer token that authenticates as `tenant`."""
+    if not TENANT_AUTH_SECRET:
+        raise ValueError("TENANT_AUTH_SECRET is not set")
+    return f"{validate_tenant(tenant)}.{_tenant_signature(tenant)}"
+
+def tenant_from_token(token: str) -> str:
+    """The tenant a bearer token was issued for; ValueError unless the signature checks out."""
+    if not TENANT_AUTH_SECRET:
+        raise ValueError("Tenant authentication is not configured")
+    tenant, _, signature = (token or "").rpartition(".")
+    validate_tenant(tenant)
+    if not hmac.compare_digest(signature, _tenant_signature(tenant)):
+        raise ValueError("Invalid tenant token")
+    return tenant
+
+@contextmanager
+def tenant_scope(tenant: str):
+    """Route database calls in this block (and tasks/threads started from it) to `tenant`."""
+    token = current_tenant.set(validate_tenant(tenant))
+    try:
+        yield
+    finally:
+        current_tenant.reset(token)
+
+def tenant_db_path(tenant: str) -> str:
+    return os.path.join(TENANT_DB_DIR, f"{validate_tenant(tenant)}.db")
+
+def list_tenants() -> List[str]:
+    """Tenants with a database on this node (just DEFAULT_TENANT when not sharded)."""
+    if not TENANT_DB_DIR:
+        return [DEFAULT_TENANT]
+    if not os.path.isdir(TENANT_DB_DIR):
+        return []
+    return sorted(name[:-3] for name in os.listdir(TENANT_DB_DIR)
+                  if name.endswith(".db") and _TENANT_RE.match(name[:-3]))
+
+def _checkout_sqlite_pool() -> SQLitePool:
+    """The current tenant's pool, migrated on first use. Pair with _checkin_sqlite_pool()."""
+    if not TENANT_DB_DIR:
+        return _get_sqlite_pool()
+    tenant = current_tenant.get()
+    os.makedirs(TENANT_DB_DIR, exist_ok=True)
+    pool = tenant_pools.checkout(tenant_db_path(tenant))
+    # run_migrations() opens cursors itself; the thread-local flag lets those through.
+    if tenant not in _migrated_tenants and not getattr(_tenant_migrating, "active", False):
+        try:
+            with _tenant_migration_lock:
+                if tenant not in _migrated_tenants:
+                    _tenant_migrating.active = True
+                    try:
+                        run_migrations()
+                    finally:
+                        _tenant_migrating.active = False
+                    _migrated_tenants.add(tenant)
+        except Exception:
+            tenant_pools.checkin(pool)
+            raise
+    return pool
+
+def _checkin_sqlite_pool(pool: SQLitePool):
+    if TENANT_DB_DIR:
+        tenant_pools.checkin(pool)
+
+def _pg_connect():
+    conn = psycopg2.connect(DATABASE_URL)
+    psycopg2.extensions.register_type(_PG_DATE_AS_ISO, conn)
+    psycopg2.extensions.register_type(_PG_TIMESTAMP_AS_ISO, conn)
+    return conn
+
 def get_db_connection():
     """
     Returns a database connection.
     If DATABASE_URL is set, returns a Postgres connection.
-    Otherwise, returns a SQLite connection.
+    Otherwise, returns the SQLite writer connection (locked until released).
     """
     global pg_pool
+    started = time.perf_counter()
     if DATABASE_URL:
         if not HAS_POSTGRES:
             raise ImportError("psycopg2-binary is required for PostgreSQL but not installed. Please add it to requirements.txt.")
         
         if pg_pool is None:
-            pg_pool = psycopg2.pool.SimpleConnectionPool(1, 10, DATABASE_URL)
+            with _pg_pool_lock:
+                if pg_pool is None:
+                    pg_pool = PostgresPool(_pg_connect)
         
         conn = pg_pool.getconn()
+        _note_checkout(started)
         return conn
     else:
-        conn = sqlite3.connect(DB_NAME)
-        conn.row_factory = sqlite3.Row
-        conn.execute("PRAGMA journal_mode=WAL")
-        return conn
+        pool = _checkout_sqlite_pool()
+        try:
+            conn = pool.acquire_writer()
+            _note_checkout(started)
+            return conn
+        except Exception:
+            _checkin_sqlite_pool(pool)
+            raise
 
 def release_db_connection(conn):
     """
-    Releases the connection back to the pool (Postgres) or closes it (SQLite).
+    Releases the connection back to the pool (Postgres) or unlocks the SQLite writer.
     """
     global pg_pool
     if DATABASE_URL and pg_pool:
         pg_pool.putconn(conn)
+    elif TENANT_DB_DIR:
+        # Still checked out by get_db_connection(), so it can't have been evicted.
+        pool = tenant_pools.get(tenant_db_path(current_tenant.get()))
+        pool.release_writer(conn)
+        tenant_pools.checkin(pool)
     else:
-        conn.close()
+        _get_sqlite_pool().release_writer(conn)
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Connection pool counters for the debug endpoint."""
+    if DATABASE_URL:
+        if pg_pool is None:
+            return {"backend": "postgres", "initialized": False}
+        return {"backend": "postgres", "initialized": True, **pg_pool.stats()}
+    if TENANT_DB_DIR:
+        current = tenant_pools.get(tenant_db_path(current_tenant.get()))
+        return {"backend": "sqlite-tenants", "tenant": current_tenant.get(), **tenant_pools.stats(),
+                "current": current.stats() if current else None}
+    return {"backend": "sqlite", **_get_sqlite_pool().stats()}
+
+def close_pool():
+    """Close pooled connections on shutdown."""
+    global pg_pool, sqlite_pool
+    if pg_pool is not None:
+        pg_pool.closeall()
+        pg_pool = None
+    if sqlite_pool is not None:
+        sqlite_pool.close()
+        sqlite_pool = None
+    if tenant_pools is not None:
+        tenant_pools.close()
 
 def _dict_factory(cursor, row):
     """
@@ -71,36 +240,306 @@ def _dict_factory(cursor, row):
         d[col[0]] = row[idx]
     return d
 
+# --- QUERY INSTRUMENTATION ---
+# Every cursor get_cursor() hands out is wrapped to time each statement
+# (execute plus fetches) and count the rows it returned or touched.
+# Statements are fingerprinted by registry name, or by their normalised text
+# for ad-hoc SQL. Results are aggregated per fingerprint since startup and
+# per query_scope(), which main.py opens for every HTTP request and the
+# scheduler for every agent wake-up. Statements slower than
+# DB_SLOW_QUERY_MS are logged. All of it is served at /debug/db-stats.
+
+DB_STATS_ENABLED = os.getenv("DB_STATS_ENABLED", "true").lower() == "true"
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "100"))
+_RECENT_SCOPES = 50
+_SLOW_LOG_SIZE = 100
+_CALLERS_PER_FINGERPRINT = 10
+
+_query_stats_lock = threading.Lock()
+_query_totals: Dict[str, Dict[str, Any]] = {}
+_connection_totals = {"checkouts": 0, "wait_ms": 0.0}
+_recent_scopes: "deque[QueryStats]" = deque(maxlen=_RECENT_SCOPES)
+_slow_queries: "deque[Dict[str, Any]]" = deque(maxlen=_SLOW_LOG_SIZE)
+# SQL text -> registry name, so ad-hoc executes of SQL[name] fingerprint by name.
+_SQL_NAMES: Dict[str, str] = {}
+_LITERAL_RE = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+_PREPARED_RE = re.compile(r"^(EXECUTE|PREPARE) (\w+)")
+
+
+class QueryStats:
+    """Query and connection counters for one scope: an HTTP request or an agent turn."""
+
+    def __init__(self, label: str):
+        self.label = label
+        self.started_at = datetime.now().isoformat()
+        self.queries = 0
+        self.db_ms = 0.0
+        self.rows = 0
+        self.checkouts = 0
+        self.wait_ms = 0.0
+        self.by_fingerprint: Dict[str, List[float]] = {}  # fingerprint -> [count, ms]
+        self.lock = threading.Lock()
+
+    def to_dict(self, top: int = 5) -> Dict[str, Any]:
+        with self.lock:
+            heaviest = sorted(self.by_fingerprint.items(), key=lambda item: -item[1][1])[:top]
+            return {
+                "label": self.label,
+                "started_at": self.started_at,
+                "queries": self.queries,
+                "db_ms": round(self.db_ms, 2),
+                "rows": self.rows,
+                "connections": self.checkouts,
+                "connection_wait_ms": round(self.wait_ms, 2),
+                "top": [{"fingerprint": fp, "count": int(count), "ms": round(ms, 2)}
+                        for fp, (count, ms) in heaviest],
+            }
+
+
+_current_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("current_query_stats", default=None)
+
+
 @contextmanager
-def get_cursor():
+def query_scope(label: str):
+    """Attribute the queries run in this block (and threads it hands work to) to one scope."""
+    stats = QueryStats(label)
+    with _query_stats_lock:
+        _recent_scopes.append(stats)
+    token = _current_query_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_query_stats.reset(token)
+
+
+def _fingerprint(query: str) -> str:
+    name = _SQL_NAMES.get(query)
+    if name:
+        return name
+    prepared = _PREPARED_RE.match(query)
+    if prepared:
+        return prepared.group(2) if prepared.group(1) == "EXECUTE" else f"PREPARE {prepared.group(2)}"
+    return _LITERAL_RE.sub("?", " ".join(query.split()))[:160]
+
+
+_INTERNAL_FUNCTIONS = {"_execute", "get_cursor", "__enter__", "__exit__", "__next__", "__iter__"}
+
+
+def _caller() -> str:
+    """The database.py function that ran the statement, and the first caller outside it."""
+    frame = sys._getframe(3)
+    function = None
+    while frame is not None:
+        code = frame.f_code
+        if code.co_filename == __file__:
+            if function is None and code.co_name not in _INTERNAL_FUNCTIONS:
+                function = code.co_name
+        elif "contextlib" not in code.co_filename and not code.co_filename.startswith("<frozen"):
+            origin = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+            return f"{function} <- {origin}" if function else origin
+        frame = frame.f_back
+    return function or "?"
+
+
+def _note_checkout(started: float):
+    """Record a connection checkout that began at perf_counter() `started`."""
+    if not DB_STATS_ENABLED:
+        return
+    wait_ms = (time.perf_counter() - started) * 1000
+    with _query_stats_lock:
+        _connection_totals["checkouts"] += 1
+        _connection_totals["wait_ms"] += wait_ms
+    stats = _current_query_stats.get()
+    if stats is not None:
+        with stats.lock:
+            stats.checkouts += 1
+            stats.wait_ms += wait_ms
+
+
+def _record_query(fingerprint: str, caller: str, ms: float, rows: int):
+    with _query_stats_lock:
+        totals = _query_totals.get(fingerprint)
+        if totals is None:
+            totals = _query_totals[fingerprint] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "rows": 0, "callers": {}}
+        totals["count"] += 1
+        totals["total_ms"] += ms
+        totals["max_ms"] = max(totals["max_ms"], ms)
+        totals["rows"] += rows
+        callers = totals["callers"]
+        if caller in callers or len(callers) < _CALLERS_PER_FINGERPRINT:
+            callers[caller] = callers.get(caller, 0) + 1
+    stats = _current_query_stats.get()
+    if stats is not None:
+        with stats.lock:
+            stats.queries += 1
+            stats.db_ms += ms
+            stats.rows += rows
+            entry = stats.by_fingerprint.setdefault(fingerprint, [0, 0.0])
+            entry[0] += 1
+            entry[1] += ms
+    if ms >= DB_SLOW_QUERY_MS:
+        scope = stats.label if stats is not None else None
+        print(f"Slow query ({ms:.1f} ms, {rows} rows): {fingerprint} from {caller}" + (f" in {scope}" if scope else ""))
+        with _query_stats_lock:
+            _slow_queries.append({"at": datetime.now().isoformat(), "fingerprint": fingerprint, "ms": round(ms, 2),
+                                  "rows": rows, "caller": caller, "scope": scope})
+
+
+class _InstrumentedCursor:
+    """
+    Cursor wrapper that times each statement, including the fetches that
+    read its rows, and records it when the next statement starts or the
+    cursor closes. Everything else passes through to the real cursor.
+    """
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._pending = None  # [fingerprint, caller, seconds, rows fetched]
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def _finish(self):
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            fingerprint, caller, seconds, fetched = pending
+            rows = fetched if fetched is not None else max(self._cursor.rowcount, 0)
+            _record_query(fingerprint, caller, seconds * 1000, rows)
+
+    def _run(self, method, query, params):
+        self._finish()
+        started = time.perf_counter()
+        try:
+            return method(query, params)
+        finally:
+            self._pending = [_fingerprint(query), _caller(), time.perf_counter() - started, None]
+
+    def execute(self, query, params=()):
+        return self._run(self._cursor.execute, query, params)
+
+    def executemany(self, query, params):
+        return self._run(self._cursor.executemany, query, params)
+
+    def _fetched(self, started: float, count: int):
+        if self._pending is not None:
+            self._pending[2] += time.perf_counter() - started
+            self._pending[3] = (self._pending[3] or 0) + count
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = self._cursor.fetchone()
+        self._fetched(started, 0 if row is None else 1)
+        return row
+
+    def fetchmany(self, *args):
+        started = time.perf_counter()
+        rows = self._cursor.fetchmany(*args)
+        self._fetched(started, len(rows))
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._fetched(started, len(rows))
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        self._finish()
+        self._cursor.close()
+
+
+def _instrument(cursor):
+    return _InstrumentedCursor(cursor) if DB_STATS_ENABLED else cursor
+
+
+def get_query_stats(top: int = 25) -> Dict[str, Any]:
+    """Aggregates for /debug/db-stats: heaviest statements, recent scopes, slow-query log."""
+    with _query_stats_lock:
+        heaviest = sorted(_query_totals.items(), key=lambda item: -item[1]["total_ms"])[:top]
+        statements = [{
+            "fingerprint": fp,
+            "count": t["count"],
+            "total_ms": round(t["total_ms"], 2),
+            "mean_ms": round(t["total_ms"] / t["count"], 3),
+            "max_ms": round(t["max_ms"], 2),
+            "rows": t["rows"],
+            "callers": dict(sorted(t["callers"].items(), key=lambda item: -item[1])),
+        } for fp, t in heaviest]
+        scopes = list(_recent_scopes)
+        slow = list(_slow_queries)
+        connections = dict(_connection_totals)
+    connections["wait_ms"] = round(connections["wait_ms"], 2)
+    return {
+        "enabled": DB_STATS_ENABLED,
+        "slow_query_ms": DB_SLOW_QUERY_MS,
+        "connections": connections,
+        "statements": statements,
+        "recent_scopes": [s.to_dict() for s in reversed(scopes)],
+        "slow_queries": list(reversed(slow)),
+    }
+
+def reset_query_stats():
+    with _query_stats_lock:
+        _query_totals.clear()
+        _connection_totals.update(checkouts=0, wait_ms=0.0)
+        _recent_scopes.clear()
+        _slow_queries.clear()
+
+@contextmanager
+def get_cursor(readonly: bool = False):
     """
     Context manager to yield a cursor and handle commit/rollback/close automatically.
+
+    readonly=True lets SQLite serve the block from a pooled reader
+    connection, so reads never queue behind the writer. Postgres ignores it.
     """
+    if readonly and not DATABASE_URL:
+        started = time.perf_counter()
+        pool = _checkout_sqlite_pool()
+        try:
+            conn = pool.acquire_reader()
+            try:
+                _note_checkout(started)
+                cur = _instrument(conn.cursor())
+                try:
+                    yield cur
+                    if conn.in_transaction:
+                        conn.commit()
+                except Exception as e:
+                    if conn.in_transaction:
+                        conn.rollback()
+                    raise e
+                finally:
+                    cur.close()
+            finally:
+                pool.release_reader(conn)
+        finally:
+            _checkin_sqlite_pool(pool)
+        return
+
     conn = get_db_connection()
+    cur = None
     try:
         if DATABASE_URL:
             # Postgres
-            cur = conn.cursor(cursor_factory=RealDictCursor)
+            cur = _instrument(conn.cursor(cursor_factory=RealDictCursor))
             yield cur
         else:
-            # SQLite
-            # We don't set row_factory here because we might need raw tuples for some ops,
-            # but for consistency with RealDictCursor, we should convert rows to dicts mainly in fetch.
-            # However, sqlite3.Row is already dict-like enough for access by name.
-            cur = conn.cursor()
+            # SQLite: sqlite3.Row (set by the pool) is already dict-like enough for access by name.
+            cur = _instrument(conn.cursor())
             yield cur
         conn.commit()
     except Exception as e:
         conn.rollback()
         raise e
     finally:
-        if not DATABASE_URL:
-            # For SQLite we close cursor implied by connection close, but good practice
-            cur.close()
         try:
             # For Postgres, we must close cursor before returning to pool usually, 
             # though putconn often handles reset. Explicit close is safer.
-            if DATABASE_URL:
+            if cur is not None:
                 cur.close()
         except:
             pass
@@ -108,41 +547,618 @@ def get_cursor():
 
 def normalize_query(query: str) -> str:
     """
-    Adapts SQL query for the target database.
-    - Convert '?' to '%s' for Postgres.
-    - Handle AUTOINCREMENT replacement if necessary (though usually handled by SERIAL/sequence implicity).
+    Compile portable SQL (`?` placeholders) for the target database.
+    Called once per statement when the registry below is built, not per call.
     """
     if DATABASE_URL:
-        # Replace ? with %s
-        query = query.replace('?', '%s')
-        
-        # Replace weak SQLite types if needed, though Postgres often casts.
-        # Handle "INSERT OR REPLACE" -> Postgres "INSERT ... ON CONFLICT"
-        # This is a naive regex replacement, complex queries might need manual adjustment.
-        if "INSERT OR REPLACE" in query:
-             # This is tricky without knowing the PK. 
-             # For simple Key-Value tables like users(push_token), we can do ON CONFLICT.
-             # Ideally, we rewrite the specific functions using this.
-             pass
+        return query.replace('?', '%s')
     return query
 
-def init_db():
-    # Detect if we need to Initialize Postgres or SQLite
+# --- STATEMENT REGISTRY ---
+# Every query the module issues is written once, in portable SQL with `?`
+# placeholders, and compiled for the active dialect at import time. Calls
+# look statements up by name through _execute(), which on Postgres runs
+# them as per-connection prepared statements so the server parses and
+# plans each one once per connection instead of once per call.
+# Both dialects accept RETURNING and ON CONFLICT (SQLite >= 3.35), so each
+# operation has a single code path.
+
+PREPARE_STATEMENTS = os.getenv("DB_PREPARE_STATEMENTS", "1") != "0"
+
+# Rows per bulk UPDATE statement; each row binds the id plus one value per column.
+BULK_UPDATE_MAX_ROWS = 128
+
+# Messages carry an estimated token count (about four characters a token
+# plus per-message framing) so the agent can budget its history window
+# without a tokenizer. estimate_tokens() fills it on insert; the SQL twin
+# below recomputes it on edits and backfilled existing rows.
+TOKEN_CHARS = 4
+MESSAGE_TOKEN_OVERHEAD = 4
+
+def estimate_tokens(*texts: Optional[str]) -> int:
+    chars = sum(len(text) for text in texts if text)
+    return (chars + TOKEN_CHARS - 1) // TOKEN_CHARS + MESSAGE_TOKEN_OVERHEAD
+
+def _token_estimate_sql(content: str = "content") -> str:
+    """estimate_tokens(content, tool_calls, sent_at) of a messages row, in SQL."""
+    return (f"(COALESCE(LENGTH({content}), 0) + COALESCE(LENGTH(tool_calls), 0) + COALESCE(LENGTH(sent_at), 0)"
+            f" + {TOKEN_CHARS - 1}) / {TOKEN_CHARS} + {MESSAGE_TOKEN_OVERHEAD}")
+
+def _iso_date_predicate(column: str) -> str:
+    """SQL predicate that is true when `column` holds a plain YYYY-MM-DD date."""
     if DATABASE_URL:
-        init_postgres()
+        return f"{column} ~ '^[0-9]{{4}}-[0-9]{{2}}-[0-9]{{2}}$'"
+    return f"{column} GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'"
+
+# Task dates are typed: DATE/TIMESTAMP columns on Postgres. SQLite keeps the
+# ISO text and adds indexed, generated epoch-day columns (due_day,
+# scheduled_day) that date-window queries filter and sort on instead.
+_ISO_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+_EPOCH = date(1970, 1, 1)
+
+# Columns returned for a task row (SQLite's generated columns stay internal).
+TASK_FIELDS = ("id", "goal_id", "title", "status", "priority", "due_date", "scheduled_date", "effort",
+               "blocker_reason", "notes", "created_at", "updated_at")
+_TASK_COLUMNS = ", ".join(TASK_FIELDS)
+# Postgres types of task columns that aren't TEXT (migration 003 typed the dates).
+_PG_TASK_COLUMN_TYPES = {"id": "INTEGER", "due_date": "DATE", "scheduled_date": "DATE",
+                         "created_at": "TIMESTAMP", "updated_at": "TIMESTAMP"}
+
+def _day_column(column: str) -> str:
+    """The column date-window predicates on a task date column should use."""
+    if DATABASE_URL:
+        return column
+    return {"due_date": "due_day", "scheduled_date": "scheduled_day"}[column]
+
+def _day_value(day: str) -> Any:
+    """Bind value for comparing a YYYY-MM-DD date against a _day_column()."""
+    if DATABASE_URL:
+        return day
+    return (datetime.strptime(day, "%Y-%m-%d").date() - _EPOCH).days
+
+def _days_before_sql(day_column: str) -> str:
+    """SQL expression: whole days from `day_column` (see _day_column) to the bound day parameter."""
+    if DATABASE_URL:
+        return f"(CAST(? AS DATE) - {day_column})"
+    return f"(? - {day_column})"
+
+def _date_of_sql(column: str) -> str:
+    """SQL expression: the YYYY-MM-DD date part of a timestamp column."""
+    if DATABASE_URL:
+        return f"CAST({column} AS DATE)"
+    return f"substr({column}, 1, 10)"
+
+def _resolve_task_date(column: str, value: Any) -> Optional[str]:
+    """
+    Normalize a due/scheduled date for storage: 'TODAY' becomes today's date,
+    blanks become NULL, anything other than YYYY-MM-DD is rejected.
+    """
+    if value is None:
+        return None
+    if isinstance(value, date):
+        return value.strftime("%Y-%m-%d")
+    text = str(value).strip()
+    if not text:
+        return None
+    if text.upper() == "TODAY":
+        return datetime.now().strftime("%Y-%m-%d")
+    try:
+        if _ISO_DATE_RE.match(text):
+            return datetime.strptime(text, "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        pass
+    raise ValueError(f"{column} must be a date in YYYY-MM-DD format or 'TODAY', got {value!r}")
+
+def _resolve_task_dates(fields: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: _resolve_task_date(key, value) if key in ("due_date", "scheduled_date") else value
+            for key, value in fields.items()}
+
+def _hours_between_sql(start_col: str, end_col: str) -> str:
+    """SQL expression: hours elapsed between two ISO timestamp columns."""
+    if DATABASE_URL:
+        return f"EXTRACT(EPOCH FROM (CAST({end_col} AS TIMESTAMP) - CAST({start_col} AS TIMESTAMP))) / 3600.0"
+    return f"(julianday({end_col}) - julianday({start_col})) * 24.0"
+
+# Gaps-and-islands: within one habit, consecutive done-days share the same
+# (day - row_number) value, so grouping on it yields each unbroken run.
+# The current streak is the run that reaches today or yesterday.
+_HABIT_STREAKS_QUERY = """
+    WITH done_days AS (
+        SELECT DISTINCT habit_id, log_date
+        FROM habit_logs
+        WHERE user_id = :user_id AND status = 'done' AND log_date <= ? AND {iso_date}
+    ),
+    islands AS (
+        SELECT habit_id, log_date,
+               {day_number} - ROW_NUMBER() OVER (PARTITION BY habit_id ORDER BY log_date) AS grp
+        FROM done_days
+    ),
+    runs AS (
+        SELECT habit_id, COUNT(*) AS run_length, MAX(log_date) AS last_day
+        FROM islands
+        GROUP BY habit_id, grp
+    ),
+    run_stats AS (
+        SELECT habit_id,
+               MAX(run_length) AS longest_streak,
+               MAX(CASE WHEN last_day >= ? THEN run_length ELSE 0 END) AS current_streak
+        FROM runs
+        GROUP BY habit_id
+    ),
+    log_stats AS (
+        SELECT habit_id,
+               COUNT(*) AS total_logs,
+               SUM(CASE WHEN status = 'done' THEN 1 ELSE 0 END) AS done_logs,
+               MAX(CASE WHEN log_date = ? THEN 1 ELSE 0 END) AS logged_today
+        FROM habit_logs
+        WHERE user_id = :user_id
+        GROUP BY habit_id
+    )
+    SELECT h.id AS habit_id, h.title, h.frequency,
+           COALESCE(r.current_streak, 0) AS current_streak,
+           COALESCE(r.longest_streak, 0) AS longest_streak,
+           COALESCE(s.total_logs, 0) AS total_logs,
+           COALESCE(s.done_logs, 0) AS done_logs,
+           COALESCE(s.logged_today, 0) AS logged_today
+    FROM habits h
+    LEFT JOIN run_stats r ON r.habit_id = h.id
+    LEFT JOIN log_stats s ON s.habit_id = h.id
+    WHERE h.user_id = :user_id AND h.active = 1
+    ORDER BY h.created_at ASC, h.id ASC
+"""
+
+_GOAL_PROGRESS_QUERY = """
+    SELECT
+        g.id AS goal_id,
+        g.title AS title,
+        COUNT(t.id) AS total_tasks,
+        SUM(CASE WHEN t.status = 'DONE' THEN 1 ELSE 0 END) AS done,
+        SUM(CASE WHEN t.status = 'IN_PROGRESS' THEN 1 ELSE 0 END) AS in_progress,
+        SUM(CASE WHEN t.status = 'BLOCKED' THEN 1 ELSE 0 END) AS blocked,
+        SUM(CASE WHEN t.{due_day} < ?
+                      AND t.status NOT IN ('DONE', 'CANCELLED') THEN 1 ELSE 0 END) AS overdue
+    FROM goals g
+    LEFT JOIN tasks t ON t.user_id = g.user_id AND t.goal_id = g.id
+    WHERE g.user_id = :user_id AND g.status = 'ACTIVE'{goal_filter}
+    GROUP BY g.id, g.title
+    ORDER BY g.id ASC
+"""
+
+_OVERDUE_TASKS_QUERY = f"""
+    SELECT {_TASK_COLUMNS}, {_days_before_sql(_day_column('due_date'))} AS days_overdue
+    FROM tasks
+    WHERE user_id = :user_id AND {_day_column('due_date')} < ?
+      AND status NOT IN ('DONE', 'CANCELLED')
+    ORDER BY {_day_column('due_date')} ASC, id ASC
+"""
+
+_RESCHEDULED_TASKS_QUERY = f"""
+    SELECT {_TASK_COLUMNS}, {_days_before_sql(_day_column('scheduled_date'))} AS days_postponed
+    FROM tasks
+    WHERE user_id = :user_id AND status = 'TODO'
+      AND {_day_column('scheduled_date')} < ?
+      AND {_day_column('scheduled_date')} <= ?
+    ORDER BY {_day_column('scheduled_date')} ASC, id ASC
+"""
+
+# Ranked full-text search over memory_entries: FTS5 on SQLite (bm25 rank,
+# porter-stemmed), a GIN-indexed tsvector on Postgres. The ? is the
+# query string _memory_search_terms() builds.
+if DATABASE_URL:
+    _MEMORY_SEARCH_QUERY = """
+        SELECT e.kind, e.source_id, e.created_at,
+               ts_headline('english', e.body, q, 'MaxWords=32, MinWords=12') AS snippet
+        FROM memory_entries e, to_tsquery('english', ?) AS q
+        WHERE e.user_id = :user_id AND e.search_vector @@ q{kind_filter}
+        ORDER BY ts_rank(e.search_vector, q) DESC, e.id DESC
+        LIMIT ?
+    """
+else:
+    _MEMORY_SEARCH_QUERY = """
+        SELECT e.kind, e.source_id, e.created_at,
+               snippet(memory_search, 0, '', '', '...', 32) AS snippet
+        FROM memory_search
+        JOIN memory_entries e ON e.id = memory_search.rowid
+        WHERE memory_search MATCH ? AND e.user_id = :user_id{kind_filter}
+        ORDER BY memory_search.rank, e.id DESC
+        LIMIT ?
+    """
+
+# Every statement is scoped to one tenant with the `:user_id` marker. It
+# compiles to an ordinary placeholder that _execute() binds to
+# current_tenant, so callers never pass it and no query reads another
+# tenant's rows. On Postgres it also lets the planner prune messages and
+# habit_logs down to the one hash partition holding the tenant.
+_STATEMENTS = {
+    # Memory
+    "save_push_token": """
+        INSERT INTO users (user_id, push_token, created_at, last_active)
+        VALUES (:user_id, ?, ?, ?)
+        ON CONFLICT (push_token) DO UPDATE SET last_active = excluded.last_active, user_id = excluded.user_id
+    """,
+    "get_push_tokens": "SELECT push_token FROM users WHERE user_id = :user_id AND push_token IS NOT NULL",
+    "insert_message": """
+        INSERT INTO messages (user_id, role, content, tool_calls, tool_call_id, created_at, sent_at, visible,
+                              token_count)
+        VALUES (:user_id, ?, ?, ?, ?, ?, ?, ?, ?) RETURNING id
+    """,
+    "update_message_content": f"""
+        UPDATE messages SET content = ?, token_count = {_token_estimate_sql("CAST(? AS TEXT)")},
+            visible = CASE role WHEN 'user' THEN ? WHEN 'assistant' THEN ? ELSE 1 END
+        WHERE user_id = :user_id AND id = ?
+    """,
+    "delete_message": "DELETE FROM messages WHERE user_id = :user_id AND id = ?",
+    "get_summary": "SELECT content, last_summarized_message_id FROM session_summary WHERE user_id = :user_id",
+    "messages_after": "SELECT * FROM messages WHERE user_id = :user_id AND id > ? ORDER BY id ASC",
+    "update_summary": """
+        INSERT INTO session_summary (user_id, content, last_summarized_message_id) VALUES (:user_id, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE
+        SET content = excluded.content, last_summarized_message_id = excluded.last_summarized_message_id
+        WHERE COALESCE(session_summary.last_summarized_message_id, 0) < excluded.last_summarized_message_id
+    """,
+    "get_messages_range": "SELECT * FROM messages WHERE user_id = :user_id AND id >= ? ORDER BY id ASC LIMIT ?",
+    # Chat history pages walk the primary key. The role parameter names the
+    # role to leave out ('tool', or '' to keep everything).
+    "chat_history_latest": """
+        SELECT id, role, content, created_at, sent_at FROM messages
+        WHERE user_id = :user_id AND visible = 1 AND role <> ?
+        ORDER BY id DESC LIMIT ?
+    """,
+    "chat_history_before": """
+        SELECT id, role, content, created_at, sent_at FROM messages
+        WHERE user_id = :user_id AND visible = 1 AND role <> ? AND id < ?
+        ORDER BY id DESC LIMIT ?
+    """,
+    "chat_history_since": """
+        SELECT id, role, content, created_at, sent_at FROM messages
+        WHERE user_id = :user_id AND visible = 1 AND role <> ? AND id > ?
+        ORDER BY id ASC LIMIT ?
+    """,
+    "last_user_message_at": """
+        SELECT created_at FROM messages WHERE user_id = :user_id AND role = 'user' ORDER BY id DESC LIMIT 1
+    """,
+
+    # Goals & tasks
+    "insert_goal": """
+        INSERT INTO goals (user_id, title, description, status, created_at, notes)
+        VALUES (:user_id, ?, ?, 'ACTIVE', ?, ?) RETURNING id
+    """,
+    "list_goals": "SELECT * FROM goals WHERE user_id = :user_id AND status = 'ACTIVE'",
+    "insert_task": """
+        INSERT INTO tasks (user_id, title, goal_id, status, priority, due_date, scheduled_date, effort, notes, created_at, updated_at)
+        VALUES (:user_id, ?, ?, 'TODO', ?, ?, ?, ?, ?, ?, ?) RETURNING id
+    """,
+    "delete_task": "DELETE FROM tasks WHERE user_id = :user_id AND id = ?",
+    "list_tasks": f"SELECT {_TASK_COLUMNS} FROM tasks WHERE user_id = :user_id ORDER BY created_at DESC LIMIT ?",
+    "list_tasks_by_status": f"""
+        SELECT {_TASK_COLUMNS} FROM tasks WHERE user_id = :user_id AND status = ?
+        ORDER BY created_at DESC LIMIT ?
+    """,
+    "table_versions": "SELECT table_name, version FROM table_versions WHERE user_id = :user_id",
+
+    # Habits
+    "insert_habit": """
+        INSERT INTO habits (user_id, title, frequency, goal_id, active, created_at)
+        VALUES (:user_id, ?, ?, ?, 1, ?) RETURNING id
+    """,
+    "insert_habit_log": """
+        INSERT INTO habit_logs (user_id, habit_id, log_date, status, skip_reason, created_at)
+        VALUES (:user_id, ?, ?, ?, ?, ?) RETURNING id
+    """,
+    "list_habits_active": "SELECT * FROM habits WHERE user_id = :user_id AND active = 1 ORDER BY created_at ASC",
+    "list_habits_all": "SELECT * FROM habits WHERE user_id = :user_id ORDER BY created_at ASC",
+    "habit_streaks": _HABIT_STREAKS_QUERY.format(
+        iso_date=_iso_date_predicate('log_date'),
+        day_number="CAST(log_date AS DATE)" if DATABASE_URL else "julianday(log_date)",
+    ),
+
+    # Profile & reflections
+    "set_profile": """
+        INSERT INTO user_profile (user_id, key, value, updated_at)
+        VALUES (:user_id, ?, ?, ?)
+        ON CONFLICT (user_id, key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+    """,
+    "get_profile": "SELECT key, value FROM user_profile WHERE user_id = :user_id",
+    "insert_reflection": """
+        INSERT INTO reflections (user_id, content, reflection_type, created_at)
+        VALUES (:user_id, ?, ?, ?) RETURNING id
+    """,
+    "recent_reflections": "SELECT * FROM reflections WHERE user_id = :user_id ORDER BY created_at DESC LIMIT ?",
+    "recent_reflections_by_type": """
+        SELECT * FROM reflections WHERE user_id = :user_id AND reflection_type = ?
+        ORDER BY created_at DESC LIMIT ?
+    """,
+
+    # Memory search
+    "search_memory": _MEMORY_SEARCH_QUERY.format(kind_filter=""),
+    "search_memory_kind": _MEMORY_SEARCH_QUERY.format(kind_filter=" AND e.kind = ?"),
+    # New text always gets a new entry id (unindex first), so incremental
+    # indexers see it as added.
+    "index_memory_entry": """
+        INSERT INTO memory_entries (user_id, kind, source_id, body, created_at)
+        VALUES (:user_id, ?, ?, ?, ?)
+    """,
+    "unindex_memory_entry": "DELETE FROM memory_entries WHERE user_id = :user_id AND kind = ? AND source_id = ?",
+    "memory_entries_after": """
+        SELECT id, body FROM memory_entries WHERE user_id = :user_id AND id > ? ORDER BY id ASC LIMIT ?
+    """,
+    "memory_entry_count": "SELECT COUNT(*) AS count FROM memory_entries WHERE user_id = :user_id",
+
+    # Archive (cold storage)
+    "max_message_id": "SELECT MAX(id) AS max_id FROM messages WHERE user_id = :user_id",
+    "messages_to_archive": """
+        SELECT id, role, content, tool_calls, tool_call_id, created_at, sent_at, visible
+        FROM messages WHERE user_id = :user_id AND id <= ? ORDER BY id ASC LIMIT ?
+    """,
+    "insert_message_archive": """
+        INSERT INTO messages_archive (id, user_id, role, created_at, archived_at, visible, payload)
+        VALUES (?, :user_id, ?, ?, ?, ?, ?) ON CONFLICT (id) DO NOTHING
+    """,
+    "tasks_to_archive": f"""
+        SELECT {_TASK_COLUMNS}
+        FROM tasks
+        WHERE user_id = :user_id AND status IN ('DONE', 'CANCELLED') AND updated_at < ?
+          AND (goal_id IS NULL OR goal_id NOT IN (
+              SELECT id FROM goals WHERE user_id = :user_id AND status = 'ACTIVE'))
+        ORDER BY id ASC LIMIT ?
+    """,
+    "insert_task_archive": """
+        INSERT INTO tasks_archive (id, user_id, goal_id, status, created_at, updated_at, archived_at, payload)
+        VALUES (?, :user_id, ?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO NOTHING
+    """,
+    "archived_chat_history_latest": """
+        SELECT id, role, created_at, visible, payload FROM messages_archive
+        WHERE user_id = :user_id AND visible = 1 AND role <> ?
+        ORDER BY id DESC LIMIT ?
+    """,
+    "archived_chat_history_before": """
+        SELECT id, role, created_at, visible, payload FROM messages_archive
+        WHERE user_id = :user_id AND visible = 1 AND role <> ? AND id < ?
+        ORDER BY id DESC LIMIT ?
+    """,
+    "archived_chat_history_since": """
+        SELECT id, role, created_at, visible, payload FROM messages_archive
+        WHERE user_id = :user_id AND visible = 1 AND role <> ? AND id > ?
+        ORDER BY id ASC LIMIT ?
+    """,
+    "archived_messages_range": """
+        SELECT id, role, created_at, visible, payload FROM messages_archive
+        WHERE user_id = :user_id AND id >= ? ORDER BY id ASC LIMIT ?
+    """,
+    "archived_message": """
+        SELECT id, role, created_at, visible, payload FROM messages_archive WHERE user_id = :user_id AND id = ?
+    """,
+    "update_archived_message": "UPDATE messages_archive SET payload = ?, visible = ? WHERE user_id = :user_id AND id = ?",
+    "delete_archived_message": "DELETE FROM messages_archive WHERE user_id = :user_id AND id = ?",
+    "archived_tasks": "SELECT payload FROM tasks_archive WHERE user_id = :user_id ORDER BY created_at DESC LIMIT ?",
+    "archived_tasks_by_status": """
+        SELECT payload FROM tasks_archive WHERE user_id = :user_id AND status = ?
+        ORDER BY created_at DESC LIMIT ?
+    """,
+    "delete_archived_task": "DELETE FROM tasks_archive WHERE user_id = :user_id AND id = ?",
+    "archived_task": "SELECT payload FROM tasks_archive WHERE user_id = :user_id AND id = ?",
+    "restore_task": f"""
+        INSERT INTO tasks (user_id, {_TASK_COLUMNS})
+        VALUES (:user_id, {', '.join(['?'] * len(TASK_FIELDS))})
+    """,
+    "archive_stats": """
+        SELECT
+            (SELECT COUNT(*) FROM messages WHERE user_id = :user_id) AS hot_messages,
+            (SELECT COUNT(*) FROM messages_archive WHERE user_id = :user_id) AS archived_messages,
+            (SELECT COUNT(*) FROM tasks WHERE user_id = :user_id) AS hot_tasks,
+            (SELECT COUNT(*) FROM tasks_archive WHERE user_id = :user_id) AS archived_tasks
+    """,
+
+    # Analytics
+    "task_stats": f"""
+        SELECT
+            COUNT(*) AS total,
+            SUM(CASE WHEN status = 'DONE' THEN 1 ELSE 0 END) AS done,
+            SUM(CASE WHEN status = 'TODO' THEN 1 ELSE 0 END) AS todo,
+            SUM(CASE WHEN status = 'IN_PROGRESS' THEN 1 ELSE 0 END) AS in_progress,
+            SUM(CASE WHEN status = 'BLOCKED' THEN 1 ELSE 0 END) AS blocked,
+            SUM(CASE WHEN status = 'CANCELLED' THEN 1 ELSE 0 END) AS cancelled,
+            SUM(CASE WHEN status IN ('DONE', 'TODO', 'IN_PROGRESS', 'BLOCKED') THEN 1 ELSE 0 END) AS tracked,
+            SUM(CASE WHEN status NOT IN ('DONE', 'CANCELLED') THEN 1 ELSE 0 END) AS active,
+            SUM(CASE WHEN status NOT IN ('DONE', 'CANCELLED') AND goal_id IS NOT NULL THEN 1 ELSE 0 END)
+                AS active_linked,
+            AVG(CASE WHEN status = 'DONE' AND created_at IS NOT NULL AND updated_at IS NOT NULL
+                     THEN {_hours_between_sql('created_at', 'updated_at')} END) AS avg_completion_hours,
+            SUM(CASE WHEN status = 'DONE' AND updated_at >= ? THEN 1 ELSE 0 END) AS completed_this_week
+        FROM task_history
+        WHERE user_id = :user_id
+    """,
+    "todays_tasks": f"""
+        SELECT {_TASK_COLUMNS}
+        FROM tasks
+        WHERE user_id = :user_id AND {_day_column('scheduled_date')} = ?
+        ORDER BY created_at DESC
+    """,
+    "overdue_tasks": _OVERDUE_TASKS_QUERY,
+    "overdue_tasks_limited": _OVERDUE_TASKS_QUERY + " LIMIT ?",
+    "overdue_count": f"""
+        SELECT COUNT(*) AS overdue
+        FROM tasks
+        WHERE user_id = :user_id AND {_day_column('due_date')} < ?
+          AND status NOT IN ('DONE', 'CANCELLED')
+    """,
+    "goal_progress": _GOAL_PROGRESS_QUERY.format(due_day=_day_column('due_date'), goal_filter=""),
+    "goal_progress_one": _GOAL_PROGRESS_QUERY.format(due_day=_day_column('due_date'), goal_filter=" AND g.id = ?"),
+    "rescheduled_tasks": _RESCHEDULED_TASKS_QUERY,
+    "rescheduled_tasks_limited": _RESCHEDULED_TASKS_QUERY + " LIMIT ?",
+    "task_done_days": f"""
+        SELECT DISTINCT {_date_of_sql('updated_at')} AS day
+        FROM task_history
+        WHERE user_id = :user_id AND status = 'DONE' AND updated_at IS NOT NULL
+    """,
+}
+
+def _prepared_form(query: str) -> str:
+    """Number the placeholders ($1, $2, ...) for a Postgres PREPARE."""
+    counter = iter(range(1, query.count('?') + 1))
+    return re.sub(r"\?", lambda _: f"${next(counter)}", query)
+
+_PLACEHOLDER_RE = re.compile(r"\?|:user_id\b")
+
+def _register(name: str, query: str):
+    """Compile `query` into the registry under `name`, noting where the tenant is bound."""
+    slots = tuple(m.group() != "?" for m in _PLACEHOLDER_RE.finditer(query))
+    query = query.replace(":user_id", "?")
+    SQL[name] = normalize_query(query)
+    _SQL_NAMES[SQL[name]] = name
+    if DATABASE_URL:
+        _PREPARED_SQL[name] = _prepared_form(query)
+    if any(slots):
+        _USER_SLOTS[name] = slots
+
+def _bind(name: str, params: Sequence[Any]) -> Sequence[Any]:
+    """Full parameter list for statement `name`: `params` with the current tenant at each :user_id."""
+    slots = _USER_SLOTS.get(name)
+    if slots is None:
+        return params
+    user_id = current_tenant.get()
+    values = iter(params)
+    return [user_id if is_user else next(values) for is_user in slots]
+
+# name -> SQL for the active dialect, and the PREPARE body on Postgres.
+SQL: Dict[str, str] = {}
+_PREPARED_SQL: Dict[str, str] = {}
+# name -> for each placeholder, whether it is the tenant (:user_id).
+_USER_SLOTS: Dict[str, Tuple[bool, ...]] = {}
+for _name, _query in _STATEMENTS.items():
+    _register(_name, _query)
+_registry_lock = threading.Lock()
+_dynamic_statements: Dict[Tuple[Any, ...], str] = {}
+
+# Bumped when migrations change the schema; connections holding prepared
+# statements from an older generation drop them (SELECT * shapes change).
+_statement_generation = 0
+
+def _dynamic_statement(prefix: str, key: Tuple[Any, ...], build: Callable[[], str]) -> str:
+    """
+    Register (once) the statement `build()` returns for `key` and return its name.
+    For statements whose shape depends on the call, e.g. the SET column list.
+    """
+    name = _dynamic_statements.get(key)
+    if name is not None:
+        return name
+    with _registry_lock:
+        name = _dynamic_statements.get(key)
+        if name is None:
+            name = f"{prefix}_{len(_dynamic_statements) + 1}"
+            _register(name, build())
+            _dynamic_statements[key] = name
+    return name
+
+def _update_statement(table: str, columns: Tuple[str, ...]) -> str:
+    """
+    `UPDATE <table> SET <columns> WHERE id = ?` for the current tenant's row.
+    Callers pass columns in a stable order so each column set compiles one statement.
+    """
+    return _dynamic_statement(
+        f"update_{table}", ("update", table, columns),
+        lambda: f"UPDATE {table} SET {', '.join(f'{col} = ?' for col in columns)} "
+                f"WHERE user_id = :user_id AND id = ?",
+    )
+
+def _memory_entries_statement(count: int) -> str:
+    """SELECT of `count` memory_entries rows by id."""
+    return _dynamic_statement("memory_entries", ("memory_entries", count), lambda: (
+        "SELECT id, kind, source_id, body, created_at FROM memory_entries "
+        f"WHERE user_id = :user_id AND id IN ({', '.join(['?'] * count)})"
+    ))
+
+def _bulk_update_tasks_sql(columns: Tuple[str, ...], rows: int, postgres: bool) -> str:
+    """
+    One UPDATE for `rows` tasks that all change `columns`. Parameters are the
+    (task_id, *columns) of each row followed by updated_at; returns the ids it updated.
+    """
+    def param(col: str) -> str:
+        # On Postgres a PREPAREd VALUES list can't infer its parameter types,
+        # and text won't assign to a DATE or TIMESTAMP column, so cast each one.
+        return f"CAST(? AS {_PG_TASK_COLUMN_TYPES.get(col, 'TEXT')})" if postgres else "?"
+
+    row = f"({', '.join(param(col) for col in ('id',) + columns)})"
+    sets = ', '.join(f"{col} = v.{col}" for col in columns)
+    return (
+        f"WITH v (task_id, {', '.join(columns)}) AS (VALUES {', '.join([row] * rows)}) "
+        f"UPDATE tasks SET {sets}, updated_at = {param('updated_at')} FROM v "
+        f"WHERE tasks.user_id = :user_id AND tasks.id = v.task_id RETURNING tasks.id"
+    )
+
+def _bulk_update_tasks_statement(columns: Tuple[str, ...], rows: int) -> str:
+    """Registered name of _bulk_update_tasks_sql() for the active dialect."""
+    build = lambda: _bulk_update_tasks_sql(columns, rows, postgres=bool(DATABASE_URL))
+    return _dynamic_statement("bulk_update_tasks", ("bulk_update_tasks", columns, rows), build)
+
+# Task page filters: keyword -> (SQL condition, column whose date it bounds).
+_TASK_PAGE_FILTERS = {
+    "status": ("status = ?", None),
+    "goal_id": ("goal_id = ?", None),
+    "scheduled_from": (f"{_day_column('scheduled_date')} >= ?", "scheduled_date"),
+    "scheduled_to": (f"{_day_column('scheduled_date')} <= ?", "scheduled_date"),
+    "due_from": (f"{_day_column('due_date')} >= ?", "due_date"),
+    "due_to": (f"{_day_column('due_date')} <= ?", "due_date"),
+    "before_id": ("id < ?", None),
+}
+# Filters the archive can apply in SQL (it has no date columns).
+_ARCHIVE_PAGE_FILTERS = ("status", "goal_id", "before_id")
+
+def _task_page_statement(table: str, filters: Tuple[str, ...]) -> str:
+    """Newest-first page of `table` (tasks or tasks_archive) with the given filters; last param is the limit."""
+    def build() -> str:
+        columns = _TASK_COLUMNS if table == "tasks" else "payload"
+        where = " AND ".join(["user_id = :user_id"] + [_TASK_PAGE_FILTERS[key][0] for key in filters])
+        return f"SELECT {columns} FROM {table} WHERE {where} ORDER BY id DESC LIMIT ?"
+    return _dynamic_statement(f"{table}_page", ("page", table, filters), build)
+
+def _execute(c, name: str, params: Sequence[Any] = ()):
+    """Run registry statement `name` on cursor `c`."""
+    params = _bind(name, params)
+    if not (DATABASE_URL and PREPARE_STATEMENTS and pg_pool is not None):
+        c.execute(SQL[name], params)
+        return
+
+    info = pg_pool.info(c.connection)
+    if info.get("statement_generation") != _statement_generation:
+        if info.get("prepared"):
+            c.execute("DEALLOCATE ALL")
+        info["prepared"] = set()
+        info["statement_generation"] = _statement_generation
+    prepared = info["prepared"]
+    if name not in prepared:
+        c.execute(f"PREPARE {name} AS {_PREPARED_SQL[name]}")
+        prepared.add(name)
+    if params:
+        c.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
     else:
-        init_sqlite()
+        c.execute(f"EXECUTE {name}")
 
-def init_sqlite():
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL")
-    c = conn.cursor()
-    
-    # Create Goals Table
-    c.execute('''
+
+
+# --- SCHEMA MIGRATIONS ---
+# Schema changes are numbered migrations recorded in `schema_version`.
+# A warm start reads the current version and runs no DDL at all; only
+# migrations newer than the recorded version are applied, each in its own
+# transaction together with its version row.
+
+def _column_exists(c, table: str, column: str) -> bool:
+    if DATABASE_URL:
+        c.execute(
+            "SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = %s",
+            (table, column),
+        )
+        return c.fetchone() is not None
+    c.execute(f"PRAGMA table_info({table})")
+    return any(col[1] == column for col in c.fetchall())
+
+def _migration_001_baseline(c):
+    """Tables as they existed before versioned migrations (safe to re-run on old databases)."""
+    pk = "SERIAL PRIMARY KEY" if DATABASE_URL else "INTEGER PRIMARY KEY AUTOINCREMENT"
+
+    c.execute(f'''
         CREATE TABLE IF NOT EXISTS goals (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            id {pk},
             title TEXT NOT NULL,
             description TEXT,
             status TEXT DEFAULT 'ACTIVE', -- ACTIVE, COMPLETED, ARCHIVED
@@ -150,17 +1166,12 @@ def init_sqlite():
             notes TEXT
         )
     ''')
-    
-    # Check if 'notes' column exists in goals, if not add it
-    c.execute("PRAGMA table_info(goals)")
-    columns = [column[1] for column in c.fetchall()]
-    if 'notes' not in columns:
+    if not _column_exists(c, 'goals', 'notes'):
         c.execute("ALTER TABLE goals ADD COLUMN notes TEXT")
-    
-    # Create Tasks Table
-    c.execute('''
+
+    c.execute(f'''
         CREATE TABLE IF NOT EXISTS tasks (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            id {pk},
             goal_id INTEGER,
             title TEXT NOT NULL,
             status TEXT DEFAULT 'TODO', -- TODO, IN_PROGRESS, DONE, BLOCKED
@@ -175,19 +1186,15 @@ def init_sqlite():
             FOREIGN KEY (goal_id) REFERENCES goals (id)
         )
     ''')
-    
-    # Check if new columns exist in tasks, if not add them
-    c.execute("PRAGMA table_info(tasks)")
-    columns = [column[1] for column in c.fetchall()]
-    if 'notes' not in columns:
+    if not _column_exists(c, 'tasks', 'notes'):
         c.execute("ALTER TABLE tasks ADD COLUMN notes TEXT")
-    if 'scheduled_date' not in columns:
+    if not _column_exists(c, 'tasks', 'scheduled_date'):
         c.execute("ALTER TABLE tasks ADD COLUMN scheduled_date TEXT")
 
     # --- MEMORY TABLES ---
-    c.execute('''
+    c.execute(f'''
         CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            id {pk},
             role TEXT NOT NULL,    -- user, assistant, tool
             content TEXT,
             tool_calls TEXT,       -- JSON string
@@ -195,7 +1202,7 @@ def init_sqlite():
             created_at TEXT
         )
     ''')
-    
+
     c.execute('''
         CREATE TABLE IF NOT EXISTS session_summary (
             id INTEGER PRIMARY KEY DEFAULT 1, -- Singleton row
@@ -203,10 +1210,10 @@ def init_sqlite():
             last_summarized_message_id INTEGER DEFAULT 0
         )
     ''')
-    
-    c.execute('''
+
+    c.execute(f'''
         CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            id {pk},
             push_token TEXT UNIQUE,
             created_at TEXT,
             last_active TEXT
@@ -214,9 +1221,9 @@ def init_sqlite():
     ''')
 
     # --- HABITS TABLES ---
-    c.execute('''
+    c.execute(f'''
         CREATE TABLE IF NOT EXISTS habits (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            id {pk},
             title TEXT NOT NULL,
             frequency TEXT DEFAULT 'daily',  -- daily, weekdays, MWF, TTh, weekly
             goal_id INTEGER,
@@ -226,9 +1233,9 @@ def init_sqlite():
         )
     ''')
 
-    c.execute('''
+    c.execute(f'''
         CREATE TABLE IF NOT EXISTS habit_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            id {pk},
             habit_id INTEGER NOT NULL,
             log_date TEXT NOT NULL,       -- YYYY-MM-DD
             status TEXT DEFAULT 'done',   -- done, skipped
@@ -248,9 +1255,9 @@ def init_sqlite():
     ''')
 
     # --- REFLECTIONS TABLE ---
-    c.execute('''
+    c.execute(f'''
         CREATE TABLE IF NOT EXISTS reflections (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            id {pk},
             content TEXT NOT NULL,
             reflection_type TEXT DEFAULT 'daily',  -- daily, weekly, milestone
             created_at TEXT
@@ -258,855 +1265,1645 @@ def init_sqlite():
     ''')
 
     # Initialize summary row if it doesn't exist
-    c.execute("INSERT OR IGNORE INTO session_summary (id, content, last_summarized_message_id) VALUES (1, '', 0)")
+    c.execute(
+        "INSERT INTO session_summary (id, content, last_summarized_message_id) VALUES (1, '', 0) "
+        "ON CONFLICT (id) DO NOTHING"
+    )
 
-    conn.commit()
-    conn.close()
+def _migration_002_indexes(c):
+    """Secondary indexes for the columns the hot queries filter and sort on."""
+    for statement in (
+        "CREATE INDEX IF NOT EXISTS idx_tasks_status ON tasks (status)",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_scheduled_date ON tasks (scheduled_date)",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_due_date ON tasks (due_date)",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_goal_id ON tasks (goal_id)",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_created_at ON tasks (created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_goals_status ON goals (status)",
+        "CREATE INDEX IF NOT EXISTS idx_habits_active ON habits (active, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_habit_logs_habit_date ON habit_logs (habit_id, log_date)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_role_id ON messages (role, id)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_created_at ON messages (created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_reflections_type_created ON reflections (reflection_type, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_reflections_created_at ON reflections (created_at)",
+    ):
+        c.execute(statement)
+
+def _migration_003_typed_task_dates(c):
+    """
+    Typed task dates. 'TODAY' sentinels become the migration date and values
+    that aren't dates are moved into the task's notes. Postgres switches the
+    columns to DATE/TIMESTAMP; SQLite gains indexed epoch-day columns.
+    """
+    c.execute("SELECT id, due_date, scheduled_date, created_at, updated_at, notes FROM tasks")
+    for row in c.fetchall():
+        row = dict(row)
+        fixed = dict(row)
+        for column in ("due_date", "scheduled_date"):
+            try:
+                fixed[column] = _resolve_task_date(column, row[column])
+            except ValueError:
+                fixed[column] = None
+                fixed['notes'] = ((fixed['notes'] or "") + f" [{column} was: {row[column]}]").strip()
+        for column in ("created_at", "updated_at"):
+            try:
+                datetime.fromisoformat(row[column])
+            except (ValueError, TypeError):
+                fixed[column] = None
+        if fixed != row:
+            c.execute(
+                normalize_query("UPDATE tasks SET due_date = ?, scheduled_date = ?, created_at = ?, "
+                                "updated_at = ?, notes = ? WHERE id = ?"),
+                (fixed['due_date'], fixed['scheduled_date'], fixed['created_at'],
+                 fixed['updated_at'], fixed['notes'], row['id']),
+            )
 
-def init_postgres():
-    # Initialize Postgres Tables
-    # Postgres uses SERIAL for auto-increment.
-    # We must use separate connection logic here.
-    with get_cursor() as c:
-        # Create Goals Table
+    if DATABASE_URL:
+        c.execute("""
+            ALTER TABLE tasks
+                ALTER COLUMN due_date TYPE DATE USING CAST(due_date AS DATE),
+                ALTER COLUMN scheduled_date TYPE DATE USING CAST(scheduled_date AS DATE),
+                ALTER COLUMN created_at TYPE TIMESTAMP USING CAST(created_at AS TIMESTAMP),
+                ALTER COLUMN updated_at TYPE TIMESTAMP USING CAST(updated_at AS TIMESTAMP)
+        """)
+    else:
+        iso_day = "CASE WHEN {col} GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]' " \
+                  "THEN CAST(julianday({col}) - 2440587.5 AS INTEGER) END"
+        c.execute(f"ALTER TABLE tasks ADD COLUMN due_day INTEGER "
+                  f"GENERATED ALWAYS AS ({iso_day.format(col='due_date')}) VIRTUAL")
+        c.execute(f"ALTER TABLE tasks ADD COLUMN scheduled_day INTEGER "
+                  f"GENERATED ALWAYS AS ({iso_day.format(col='scheduled_date')}) VIRTUAL")
+        c.execute("DROP INDEX IF EXISTS idx_tasks_due_date")
+        c.execute("DROP INDEX IF EXISTS idx_tasks_scheduled_date")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_tasks_due_day ON tasks (due_day)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_tasks_scheduled_day ON tasks (scheduled_day)")
+
+    # Completed-in-window lookups range-scan (status, updated_at); it also serves status filters.
+    c.execute("DROP INDEX IF EXISTS idx_tasks_status")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_tasks_status_updated ON tasks (status, updated_at)")
+
+def _migration_004_archive_tables(c):
+    """
+    Cold storage for summarized messages and old finished tasks. Rows keep the
+    columns queries filter on; everything else is a compressed JSON payload.
+    """
+    blob = "BYTEA" if DATABASE_URL else "BLOB"
+    timestamp = "TIMESTAMP" if DATABASE_URL else "TEXT"
+    c.execute(f'''
+        CREATE TABLE IF NOT EXISTS messages_archive (
+            id INTEGER PRIMARY KEY,   -- same id the message had in `messages`
+            role TEXT NOT NULL,
+            created_at TEXT,
+            archived_at TEXT,
+            payload {blob} NOT NULL   -- zlib(JSON: content, tool_calls, tool_call_id)
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_messages_archive_created_at ON messages_archive (created_at)")
+
+    c.execute(f'''
+        CREATE TABLE IF NOT EXISTS tasks_archive (
+            id INTEGER PRIMARY KEY,   -- same id the task had in `tasks`
+            goal_id INTEGER,
+            status TEXT NOT NULL,
+            created_at {timestamp},
+            updated_at {timestamp},
+            archived_at TEXT,
+            payload {blob} NOT NULL   -- zlib(JSON: the full task row)
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_tasks_archive_status_updated ON tasks_archive (status, updated_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_tasks_archive_created_at ON tasks_archive (created_at)")
+
+    # Task history for analytics: hot and archived tasks together.
+    c.execute('''
+        CREATE VIEW task_history AS
+            SELECT id, goal_id, status, created_at, updated_at FROM tasks
+            UNION ALL
+            SELECT id, goal_id, status, created_at, updated_at FROM tasks_archive
+    ''')
+
+# Archive payloads are zlib-compressed JSON.
+def _pack(data: Dict[str, Any]) -> bytes:
+    return zlib.compress(json.dumps(data).encode("utf-8"))
+
+def _unpack(payload) -> Dict[str, Any]:
+    return json.loads(zlib.decompress(bytes(payload)).decode("utf-8"))
+
+# User messages used to carry their send time as a "[YYYY-MM-DD HH:MM] " prefix.
+_SENT_AT_PREFIX_RE = re.compile(r"^\[(\d{4}-\d{2}-\d{2} \d{2}:\d{2})\] ")
+
+def _message_visible(role: str, content: Optional[str]) -> int:
+    """1 if the message belongs in the chat history shown to the user."""
+    content = content or ""
+    if role == 'user' and "[SYSTEM EVENT]" in content:
+        return 0
+    if role == 'assistant' and "SLEEP" in content:
+        return 0
+    return 1
+
+def _split_sent_at(role: str, content: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """(sent_at, content) with a legacy timestamp prefix moved out of a user message."""
+    match = _SENT_AT_PREFIX_RE.match(content or "") if role == 'user' else None
+    if not match:
+        return None, content
+    return match.group(1), content[match.end():]
+
+def _migration_005_chat_history_columns(c):
+    """
+    Chat history is filtered and paged in SQL: `visible` marks rows the user
+    sees (not wake-up events or SLEEP replies) and `sent_at` holds the user's
+    send time that used to be prefixed to the content.
+    """
+    for table in ("messages", "messages_archive"):
+        c.execute(f"ALTER TABLE {table} ADD COLUMN visible INTEGER NOT NULL DEFAULT 1")
+    c.execute("ALTER TABLE messages ADD COLUMN sent_at TEXT")
+
+    c.execute("SELECT id, role, content FROM messages WHERE role IN ('user', 'assistant')")
+    for row in c.fetchall():
+        row = dict(row)
+        sent_at, content = _split_sent_at(row['role'], row['content'])
+        visible = _message_visible(row['role'], content)
+        if sent_at or not visible:
+            c.execute(normalize_query("UPDATE messages SET content = ?, sent_at = ?, visible = ? WHERE id = ?"),
+                      (content, sent_at, visible, row['id']))
+
+    c.execute("SELECT id, role, payload FROM messages_archive WHERE role IN ('user', 'assistant')")
+    for row in c.fetchall():
+        row = dict(row)
+        message = _unpack(row['payload'])
+        message['sent_at'], message['content'] = _split_sent_at(row['role'], message.get('content'))
+        visible = _message_visible(row['role'], message['content'])
+        if message['sent_at'] or not visible:
+            c.execute(normalize_query("UPDATE messages_archive SET payload = ?, visible = ? WHERE id = ?"),
+                      (_pack(message), visible, row['id']))
+
+    for table in ("messages", "messages_archive"):
+        c.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_visible_id ON {table} (visible, id)")
+
+# Tables whose writes bump a row in `table_versions`; readers compare the
+# counter to tell whether anything changed without reading the table.
+_VERSIONED_TABLES = ("tasks", "tasks_archive")
+
+def _migration_006_table_versions(c):
+    """Per-table change counters, maintained by triggers on every write."""
+    c.execute(
+        "CREATE TABLE IF NOT EXISTS table_versions ("
+        "table_name TEXT PRIMARY KEY, version INTEGER NOT NULL DEFAULT 0)"
+    )
+    if DATABASE_URL:
+        c.execute("""
+            CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+            BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE table_name = TG_TABLE_NAME;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+    for table in _VERSIONED_TABLES:
+        c.execute(normalize_query(
+            "INSERT INTO table_versions (table_name, version) VALUES (?, 0) ON CONFLICT (table_name) DO NOTHING"
+        ), (table,))
+        if DATABASE_URL:
+            c.execute(f"""
+                CREATE TRIGGER trg_{table}_version
+                AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+                FOR EACH STATEMENT EXECUTE PROCEDURE bump_table_version()
+            """)
+        else:
+            for event in ("INSERT", "UPDATE", "DELETE"):
+                c.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_{table}_version_{event.lower()}
+                    AFTER {event} ON {table}
+                    BEGIN
+                        UPDATE table_versions SET version = version + 1 WHERE table_name = '{table}';
+                    END
+                """)
+
+# Postgres: messages and habit_logs are hash-partitioned by user_id.
+PG_TENANT_PARTITIONS = 8
+
+def _partition_by_user(c, table: str, columns: str, tenant: str):
+    """
+    Rebuild `table` as PARTITION BY HASH (user_id) with primary key
+    (user_id, id). Rows keep their ids and the id sequence carries over;
+    `columns` is the DDL for every column but id and user_id.
+    """
+    seq = f"{table}_id_seq"
+    c.execute(f"ALTER SEQUENCE {seq} OWNED BY NONE")
+    c.execute(f"ALTER TABLE {table} RENAME TO {table}_unpartitioned")
+    c.execute(f"ALTER INDEX {table}_pkey RENAME TO {table}_unpartitioned_pkey")
+    c.execute(f'''
+        CREATE TABLE {table} (
+            id INTEGER NOT NULL DEFAULT nextval('{seq}'),
+            user_id TEXT NOT NULL,
+            {columns},
+            PRIMARY KEY (user_id, id)
+        ) PARTITION BY HASH (user_id)
+    ''')
+    for remainder in range(PG_TENANT_PARTITIONS):
+        c.execute(
+            f"CREATE TABLE {table}_p{remainder} PARTITION OF {table} "
+            f"FOR VALUES WITH (MODULUS {PG_TENANT_PARTITIONS}, REMAINDER {remainder})"
+        )
+    c.execute(f"SELECT * FROM {table}_unpartitioned LIMIT 0")
+    names = ", ".join(col[0] for col in c.description)
+    c.execute(normalize_query(
+        f"INSERT INTO {table} (user_id, {names}) SELECT ?, {names} FROM {table}_unpartitioned"
+    ), (tenant,))
+    c.execute(f"DROP TABLE {table}_unpartitioned")
+    c.execute(f"ALTER SEQUENCE {seq} OWNED BY {table}.id")
+
+def _migration_007_tenant_columns(c):
+    """
+    Every table carries user_id and every index leads with it, so one
+    database can hold many users. Existing rows belong to the tenant being
+    migrated. session_summary and user_profile are keyed per user.
+    """
+    tenant = validate_tenant(current_tenant.get())
+    user_column = f"user_id TEXT NOT NULL DEFAULT '{tenant}'"
+
+    for table in ("goals", "tasks", "habits", "reflections", "users", "messages_archive", "tasks_archive"):
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {user_column}")
+    if DATABASE_URL:
+        _partition_by_user(c, "messages", '''
+            role TEXT NOT NULL,
+            content TEXT,
+            tool_calls TEXT,
+            tool_call_id TEXT,
+            created_at TEXT,
+            visible INTEGER NOT NULL DEFAULT 1,
+            sent_at TEXT
+        ''', tenant)
+        _partition_by_user(c, "habit_logs", '''
+            habit_id INTEGER NOT NULL REFERENCES habits (id),
+            log_date TEXT NOT NULL,
+            status TEXT DEFAULT 'done',
+            skip_reason TEXT,
+            created_at TEXT
+        ''', tenant)
+    else:
+        c.execute(f"ALTER TABLE messages ADD COLUMN {user_column}")
+        c.execute(f"ALTER TABLE habit_logs ADD COLUMN {user_column}")
+
+    c.execute('''
+        CREATE TABLE session_summary_by_user (
+            user_id TEXT PRIMARY KEY,
+            content TEXT,
+            last_summarized_message_id INTEGER DEFAULT 0
+        )
+    ''')
+    c.execute(normalize_query(
+        "INSERT INTO session_summary_by_user (user_id, content, last_summarized_message_id) "
+        "SELECT ?, content, last_summarized_message_id FROM session_summary WHERE id = 1"
+    ), (tenant,))
+    c.execute("DROP TABLE session_summary")
+    c.execute("ALTER TABLE session_summary_by_user RENAME TO session_summary")
+
+    c.execute('''
+        CREATE TABLE user_profile_by_user (
+            user_id TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT,
+            updated_at TEXT,
+            PRIMARY KEY (user_id, key)
+        )
+    ''')
+    c.execute(normalize_query(
+        "INSERT INTO user_profile_by_user (user_id, key, value, updated_at) "
+        "SELECT ?, key, value, updated_at FROM user_profile"
+    ), (tenant,))
+    c.execute("DROP TABLE user_profile")
+    c.execute("ALTER TABLE user_profile_by_user RENAME TO user_profile")
+
+    c.execute("DROP VIEW task_history")
+    c.execute('''
+        CREATE VIEW task_history AS
+            SELECT user_id, id, goal_id, status, created_at, updated_at FROM tasks
+            UNION ALL
+            SELECT user_id, id, goal_id, status, created_at, updated_at FROM tasks_archive
+    ''')
+
+    # Indexes are rebuilt with user_id leading; names stay where they still fit.
+    for index in (
+        "idx_tasks_status_updated", "idx_tasks_goal_id", "idx_tasks_created_at",
+        "idx_tasks_due_date", "idx_tasks_scheduled_date", "idx_tasks_due_day", "idx_tasks_scheduled_day",
+        "idx_goals_status", "idx_habits_active", "idx_habit_logs_habit_date",
+        "idx_messages_role_id", "idx_messages_created_at", "idx_messages_visible_id",
+        "idx_reflections_type_created", "idx_reflections_created_at",
+        "idx_messages_archive_created_at", "idx_messages_archive_visible_id",
+        "idx_tasks_archive_status_updated", "idx_tasks_archive_created_at",
+    ):
+        c.execute(f"DROP INDEX IF EXISTS {index}")
+    for statement in (
+        "CREATE INDEX idx_tasks_user_id ON tasks (user_id, id)",
+        "CREATE INDEX idx_tasks_status_updated ON tasks (user_id, status, updated_at)",
+        "CREATE INDEX idx_tasks_goal_id ON tasks (user_id, goal_id)",
+        "CREATE INDEX idx_tasks_created_at ON tasks (user_id, created_at)",
+        f"CREATE INDEX idx_tasks_due_day ON tasks (user_id, {_day_column('due_date')})",
+        f"CREATE INDEX idx_tasks_scheduled_day ON tasks (user_id, {_day_column('scheduled_date')})",
+        "CREATE INDEX idx_goals_status ON goals (user_id, status)",
+        "CREATE INDEX idx_habits_active ON habits (user_id, active, created_at)",
+        "CREATE INDEX idx_habit_logs_habit_date ON habit_logs (user_id, habit_id, log_date)",
+        "CREATE INDEX idx_messages_role_id ON messages (user_id, role, id)",
+        "CREATE INDEX idx_messages_visible_id ON messages (user_id, visible, id)",
+        "CREATE INDEX idx_reflections_type_created ON reflections (user_id, reflection_type, created_at)",
+        "CREATE INDEX idx_reflections_created_at ON reflections (user_id, created_at)",
+        "CREATE INDEX idx_users_user_id ON users (user_id)",
+        "CREATE INDEX idx_messages_archive_user_id ON messages_archive (user_id, id)",
+        "CREATE INDEX idx_messages_archive_visible_id ON messages_archive (user_id, visible, id)",
+        "CREATE INDEX idx_tasks_archive_user_id ON tasks_archive (user_id, id)",
+        "CREATE INDEX idx_tasks_archive_status_updated ON tasks_archive (user_id, status, updated_at)",
+        "CREATE INDEX idx_tasks_archive_created_at ON tasks_archive (user_id, created_at)",
+    ):
+        c.execute(statement)
+    if not DATABASE_URL:
+        # On Postgres the partitioned primary keys already lead with user_id.
+        c.execute("CREATE INDEX idx_messages_user_id ON messages (user_id, id)")
+        c.execute("CREATE INDEX idx_habit_logs_user_id ON habit_logs (user_id, id)")
+
+# What the memory search index covers: kind -> (table, archive table,
+# columns whose update re-indexes, body, condition). Expressions are over
+# `{row}`: NEW/OLD in triggers, the table itself when backfilling.
+_MEMORY_SOURCES = {
+    "message": (
+        "messages", "messages_archive", "content, visible", "{row}.content",
+        "{row}.role IN ('user', 'assistant') AND {row}.visible = 1 AND COALESCE({row}.content, '') <> ''",
+    ),
+    "reflection": (
+        "reflections", None, "content", "{row}.content", "COALESCE({row}.content, '') <> ''",
+    ),
+    "task": (
+        "tasks", "tasks_archive", "title, notes", "{row}.title || COALESCE(': ' || NULLIF({row}.notes, ''), '')",
+        "{row}.title IS NOT NULL",
+    ),
+}
+
+def _memory_index_sql(kind: str, row: str) -> str:
+    """INSERT adding `row` (NEW, or a table to backfill from) to memory_entries if it qualifies."""
+    table, _, _, body, condition = _MEMORY_SOURCES[kind]
+    source = "" if row.upper() == "NEW" else f" FROM {table}"
+    return (
+        f"INSERT INTO memory_entries (user_id, kind, source_id, body, created_at) "
+        f"SELECT {row}.user_id, '{kind}', {row}.id, {body.format(row=row)}, {row}.created_at{source} "
+        f"WHERE {condition.format(row=row)}"
+    )
+
+def _memory_unindex_sql(kind: str) -> str:
+    """DELETE dropping OLD's entry, unless the row moved to its archive table (still searchable there)."""
+    _, archive, _, _, _ = _MEMORY_SOURCES[kind]
+    keep_archived = (
+        f" AND NOT EXISTS (SELECT 1 FROM {archive} a WHERE a.user_id = OLD.user_id AND a.id = OLD.id)"
+        if archive else ""
+    )
+    return f"DELETE FROM memory_entries WHERE user_id = OLD.user_id AND kind = '{kind}' AND source_id = OLD.id{keep_archived}"
+
+def _memory_indexable(role: str, visible: int, content: Optional[str]) -> bool:
+    """Python twin of the message condition in _MEMORY_SOURCES, for rows edited in the archive."""
+    return role in ('user', 'assistant') and bool(visible) and bool(content)
+
+def _migration_008_memory_search(c):
+    """
+    Full-text index over messages, reflections and task notes. Triggers on
+    the source tables keep memory_entries current; archived rows stay
+    indexed until deleted from the archive.
+    """
+    if DATABASE_URL:
         c.execute('''
-            CREATE TABLE IF NOT EXISTS goals (
+            CREATE TABLE memory_entries (
                 id SERIAL PRIMARY KEY,
-                title TEXT NOT NULL,
-                description TEXT,
-                status TEXT DEFAULT 'ACTIVE',
+                user_id TEXT NOT NULL,
+                kind TEXT NOT NULL,       -- message, reflection, task
+                source_id INTEGER NOT NULL,
+                body TEXT NOT NULL,
                 created_at TEXT,
-                notes TEXT
+                search_vector TSVECTOR GENERATED ALWAYS AS (to_tsvector('english', body)) STORED,
+                UNIQUE (user_id, kind, source_id)
             )
         ''')
-        
-        # Check if 'notes' column exists in goals - Postgres way
-        c.execute("SELECT column_name FROM information_schema.columns WHERE table_name='goals' AND column_name='notes'")
-        if not c.fetchone():
-            c.execute("ALTER TABLE goals ADD COLUMN notes TEXT")
-        
-        # Create Tasks Table
+        c.execute("CREATE INDEX idx_memory_entries_search ON memory_entries USING GIN (search_vector)")
+    else:
         c.execute('''
-            CREATE TABLE IF NOT EXISTS tasks (
-                id SERIAL PRIMARY KEY,
-                goal_id INTEGER,
-                title TEXT NOT NULL,
-                status TEXT DEFAULT 'TODO',
-                priority TEXT DEFAULT 'MEDIUM',
-                due_date TEXT,
-                scheduled_date TEXT,
-                effort TEXT,
-                blocker_reason TEXT,
-                notes TEXT,
+            CREATE TABLE memory_entries (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                kind TEXT NOT NULL,       -- message, reflection, task
+                source_id INTEGER NOT NULL,
+                body TEXT NOT NULL,
                 created_at TEXT,
-                updated_at TEXT,
-                FOREIGN KEY (goal_id) REFERENCES goals (id)
+                UNIQUE (user_id, kind, source_id)
             )
         ''')
-        
-         # Check columns for tasks
-        c.execute("SELECT column_name FROM information_schema.columns WHERE table_name='tasks' AND column_name='notes'")
-        if not c.fetchone():
-            c.execute("ALTER TABLE tasks ADD COLUMN notes TEXT")
-            
-        c.execute("SELECT column_name FROM information_schema.columns WHERE table_name='tasks' AND column_name='scheduled_date'")
-        if not c.fetchone():
-             c.execute("ALTER TABLE tasks ADD COLUMN scheduled_date TEXT")
-
-        # --- MEMORY TABLES ---
+        # External-content FTS5 table: the text lives in memory_entries only.
+        c.execute(
+            "CREATE VIRTUAL TABLE memory_search USING fts5("
+            "body, content='memory_entries', content_rowid='id', tokenize='porter unicode61')"
+        )
         c.execute('''
-            CREATE TABLE IF NOT EXISTS messages (
-                id SERIAL PRIMARY KEY,
-                role TEXT NOT NULL,
-                content TEXT,
-                tool_calls TEXT,
-                tool_call_id TEXT,
-                created_at TEXT
-            )
+            CREATE TRIGGER trg_memory_entries_insert AFTER INSERT ON memory_entries BEGIN
+                INSERT INTO memory_search (rowid, body) VALUES (new.id, new.body);
+            END
         ''')
-
         c.execute('''
-            CREATE TABLE IF NOT EXISTS session_summary (
-                id INTEGER PRIMARY KEY DEFAULT 1,
-                content TEXT,
-                last_summarized_message_id INTEGER DEFAULT 0
-            )
+            CREATE TRIGGER trg_memory_entries_delete AFTER DELETE ON memory_entries BEGIN
+                INSERT INTO memory_search (memory_search, rowid, body) VALUES ('delete', old.id, old.body);
+            END
         ''')
-        
         c.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id SERIAL PRIMARY KEY,
-                push_token TEXT UNIQUE,
-                created_at TEXT,
-                last_active TEXT
-            )
-        ''')
-        
-        # --- HABITS TABLES ---
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS habits (
-                id SERIAL PRIMARY KEY,
-                title TEXT NOT NULL,
-                frequency TEXT DEFAULT 'daily',
-                goal_id INTEGER,
-                active INTEGER DEFAULT 1,
-                created_at TEXT,
-                FOREIGN KEY (goal_id) REFERENCES goals (id)
-            )
+            CREATE TRIGGER trg_memory_entries_update AFTER UPDATE ON memory_entries BEGIN
+                INSERT INTO memory_search (memory_search, rowid, body) VALUES ('delete', old.id, old.body);
+                INSERT INTO memory_search (rowid, body) VALUES (new.id, new.body);
+            END
         ''')
 
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS habit_logs (
-                id SERIAL PRIMARY KEY,
-                habit_id INTEGER NOT NULL,
-                log_date TEXT NOT NULL,
-                status TEXT DEFAULT 'done',
-                skip_reason TEXT,
-                created_at TEXT,
-                FOREIGN KEY (habit_id) REFERENCES habits (id)
-            )
-        ''')
+    for kind, (table, archive, columns, _, _) in _MEMORY_SOURCES.items():
+        c.execute(_memory_index_sql(kind, table))
+        if DATABASE_URL:
+            c.execute(f"""
+                CREATE OR REPLACE FUNCTION index_memory_{kind}() RETURNS trigger AS $$
+                BEGIN
+                    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                        {_memory_unindex_sql(kind)};
+                    END IF;
+                    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                        {_memory_index_sql(kind, 'NEW')};
+                    END IF;
+                    RETURN NULL;
+                END
+                $$ LANGUAGE plpgsql
+            """)
+            c.execute(f"""
+                CREATE TRIGGER trg_{table}_memory
+                AFTER INSERT OR UPDATE OF {columns} OR DELETE ON {table}
+                FOR EACH ROW EXECUTE PROCEDURE index_memory_{kind}()
+            """)
+            if archive:
+                c.execute(f"""
+                    CREATE TRIGGER trg_{archive}_memory
+                    AFTER DELETE ON {archive}
+                    FOR EACH ROW EXECUTE PROCEDURE index_memory_{kind}()
+                """)
+        else:
+            c.execute(f"""
+                CREATE TRIGGER trg_{table}_memory_insert AFTER INSERT ON {table} BEGIN
+                    {_memory_index_sql(kind, 'NEW')};
+                END
+            """)
+            c.execute(f"""
+                CREATE TRIGGER trg_{table}_memory_update AFTER UPDATE OF {columns} ON {table} BEGIN
+                    {_memory_unindex_sql(kind)};
+                    {_memory_index_sql(kind, 'NEW')};
+                END
+            """)
+            c.execute(f"""
+                CREATE TRIGGER trg_{table}_memory_delete AFTER DELETE ON {table} BEGIN
+                    {_memory_unindex_sql(kind)};
+                END
+            """)
+            if archive:
+                # The row is gone from the archive by now, so the same DELETE applies.
+                c.execute(f"""
+                    CREATE TRIGGER trg_{archive}_memory_delete AFTER DELETE ON {archive} BEGIN
+                        {_memory_unindex_sql(kind)};
+                    END
+                """)
+
+    # Archived rows keep their text in the compressed payload.
+    insert = normalize_query(
+        "INSERT INTO memory_entries (user_id, kind, source_id, body, created_at) VALUES (?, ?, ?, ?, ?)"
+    )
+    c.execute("SELECT user_id, id, role, visible, created_at, payload FROM messages_archive")
+    entries = []
+    for row in c.fetchall():
+        row = dict(row)
+        content = _unpack(row['payload']).get('content')
+        if _memory_indexable(row['role'], row['visible'], content):
+            entries.append((row['user_id'], 'message', row['id'], content, row['created_at']))
+    c.execute("SELECT user_id, id, created_at, payload FROM tasks_archive")
+    for row in c.fetchall():
+        row = dict(row)
+        task = _unpack(row['payload'])
+        if task.get('title') is not None:
+            body = task['title'] + (f": {task['notes']}" if task.get('notes') else "")
+            created_at = str(row['created_at']) if row['created_at'] is not None else None
+            entries.append((row['user_id'], 'task', row['id'], body, created_at))
+    if entries:
+        c.executemany(insert, entries)
+
+def _migration_009_message_tokens(c):
+    """Estimated tokens per message, so the history window is budgeted by size rather than count."""
+    c.execute("ALTER TABLE messages ADD COLUMN token_count INTEGER")
+    c.execute(f"UPDATE messages SET token_count = {_token_estimate_sql()}")
+
+# Tables that gained user_id in migration 007.
+_TENANT_TABLES = (
+    "goals", "tasks", "habits", "habit_logs", "reflections", "users",
+    "messages", "messages_archive", "tasks_archive",
+)
+
+def _sqlite_drop_user_default(c, table: str):
+    """
+    SQLite can't drop a column default in place, so `table` is rebuilt
+    without it. Rows keep their ids; the AUTOINCREMENT counter (which may be
+    past the highest live id, e.g. ids held by the archive), indexes and
+    triggers are carried over.
+    """
+    c.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+    create = c.fetchone()['sql']
+    create = re.sub(r"user_id TEXT NOT NULL DEFAULT '[^']*'", "user_id TEXT NOT NULL", create)
+    create = re.sub(r'^CREATE TABLE\s+"?\w+"?', f"CREATE TABLE {table}_rebuild", create)
+    c.execute(
+        "SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+        (table,),
+    )
+    dependents = [row['sql'] for row in c.fetchall()]
+    c.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,))
+    row = c.fetchone()
+    seq = row['seq'] if row else None
+    c.execute(f"PRAGMA table_xinfo({table})")
+    # hidden: 0 = ordinary, 2/3 = generated (due_day, scheduled_day).
+    columns = ", ".join(col[1] for col in c.fetchall() if col[6] == 0)
+
+    c.execute(create)
+    c.execute(f"INSERT INTO {table}_rebuild ({columns}) SELECT {columns} FROM {table}")
+    c.execute(f"DROP TABLE {table}")
+    c.execute(f"ALTER TABLE {table}_rebuild RENAME TO {table}")
+    for statement in dependents:
+        c.execute(statement)
+    if seq is not None:
+        c.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = ?", (seq, table))
+
+def _migration_010_drop_user_defaults(c):
+    """
+    Migration 007 used a column default to give existing rows their tenant;
+    left in place it would silently file any insert that forgets user_id
+    under that tenant. Writes must now name their user.
+    """
+    if DATABASE_URL:
+        for table in _TENANT_TABLES:
+            c.execute(f"ALTER TABLE {table} ALTER COLUMN user_id DROP DEFAULT")
+        return
+    # Triggers and views on other tables name these ones; without the legacy
+    # behaviour RENAME would re-check them while a table is briefly missing.
+    c.execute("PRAGMA legacy_alter_table = ON")
+    try:
+        for table in _TENANT_TABLES:
+            _sqlite_drop_user_default(c, table)
+    finally:
+        c.execute("PRAGMA legacy_alter_table = OFF")
 
-        # --- USER PROFILE TABLE ---
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS user_profile (
-                key TEXT PRIMARY KEY,
-                value TEXT,
-                updated_at TEXT
-            )
-        ''')
+def _table_version_bump_sql(table: str, row: str) -> str:
+    """Upsert moving `row`'s tenant's counter for `table` on by one."""
+    return (
+        f"INSERT INTO table_versions (user_id, table_name, version) VALUES ({row}.user_id, '{table}', 1) "
+        f"ON CONFLICT (user_id, table_name) DO UPDATE SET version = table_versions.version + 1"
+    )
 
-        # --- REFLECTIONS TABLE ---
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS reflections (
-                id SERIAL PRIMARY KEY,
-                content TEXT NOT NULL,
-                reflection_type TEXT DEFAULT 'daily',
-                created_at TEXT
+def _migration_011_tenant_table_versions(c):
+    """
+    Change counters per (user_id, table), bumped by row-level triggers, so
+    one tenant's writes don't move another tenant's ETags. Every known
+    tenant starts from the old shared value, including one with no rows
+    left in the counted table, so no counter ever goes backwards.
+    """
+    c.execute('''
+        CREATE TABLE table_versions_by_user (
+            user_id TEXT NOT NULL,
+            table_name TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, table_name)
+        )
+    ''')
+    # Anyone with a row anywhere may hold an ETag, plus the tenant migrating
+    # this file (a tenant database can be empty).
+    tenants = " UNION ".join(
+        [f"SELECT user_id FROM {table}" for table in _TENANT_TABLES + ("session_summary", "user_profile")]
+        + ["SELECT ?"]
+    )
+    for table in _VERSIONED_TABLES:
+        c.execute(normalize_query(
+            f"INSERT INTO table_versions_by_user (user_id, table_name, version) "
+            f"SELECT u.user_id, v.table_name, v.version FROM ({tenants}) u "
+            f"JOIN table_versions v ON v.table_name = ?"
+        ), (current_tenant.get(), table))
+        if DATABASE_URL:
+            c.execute(f"DROP TRIGGER trg_{table}_version ON {table}")
+        else:
+            for event in ("insert", "update", "delete"):
+                c.execute(f"DROP TRIGGER trg_{table}_version_{event}")
+    c.execute("DROP TABLE table_versions")
+    c.execute("ALTER TABLE table_versions_by_user RENAME TO table_versions")
+
+    if DATABASE_URL:
+        c.execute("""
+            CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'DELETE' THEN
+                    INSERT INTO table_versions (user_id, table_name, version) VALUES (OLD.user_id, TG_TABLE_NAME, 1)
+                    ON CONFLICT (user_id, table_name) DO UPDATE SET version = table_versions.version + 1;
+                ELSE
+                    INSERT INTO table_versions (user_id, table_name, version) VALUES (NEW.user_id, TG_TABLE_NAME, 1)
+                    ON CONFLICT (user_id, table_name) DO UPDATE SET version = table_versions.version + 1;
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        # TRUNCATE has no rows to attribute, so it moves every tenant's counter.
+        c.execute("""
+            CREATE OR REPLACE FUNCTION bump_table_versions_truncate() RETURNS trigger AS $$
+            BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE table_name = TG_TABLE_NAME;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+    for table in _VERSIONED_TABLES:
+        if DATABASE_URL:
+            c.execute(f"""
+                CREATE TRIGGER trg_{table}_version
+                AFTER INSERT OR UPDATE OR DELETE ON {table}
+                FOR EACH ROW EXECUTE PROCEDURE bump_table_version()
+            """)
+            c.execute(f"""
+                CREATE TRIGGER trg_{table}_version_truncate
+                AFTER TRUNCATE ON {table}
+                FOR EACH STATEMENT EXECUTE PROCEDURE bump_table_versions_truncate()
+            """)
+        else:
+            for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+                c.execute(f"""
+                    CREATE TRIGGER trg_{table}_version_{event.lower()}
+                    AFTER {event} ON {table}
+                    BEGIN
+                        {_table_version_bump_sql(table, row)};
+                    END
+                """)
+
+MIGRATIONS = [
+    (1, "baseline schema", _migration_001_baseline),
+    (2, "secondary indexes", _migration_002_indexes),
+    (3, "typed task dates", _migration_003_typed_task_dates),
+    (4, "archive tables", _migration_004_archive_tables),
+    (5, "chat history columns", _migration_005_chat_history_columns),
+    (6, "table change counters", _migration_006_table_versions),
+    (7, "tenant columns", _migration_007_tenant_columns),
+    (8, "memory search index", _migration_008_memory_search),
+    (9, "message token counts", _migration_009_message_tokens),
+    (10, "drop user_id defaults", _migration_010_drop_user_defaults),
+    (11, "per-tenant table change counters", _migration_011_tenant_table_versions),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# Arbitrary key for pg_advisory_xact_lock so instances that start at the
+# same time apply migrations one after another.
+_MIGRATION_LOCK_ID = 7263541
+
+def _current_schema_version(c) -> int:
+    if DATABASE_URL:
+        c.execute("SELECT to_regclass('schema_version') IS NOT NULL AS present")
+        present = c.fetchone()['present']
+    else:
+        c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'")
+        present = c.fetchone() is not None
+    if not present:
+        return 0
+    c.execute("SELECT MAX(version) AS version FROM schema_version")
+    row = c.fetchone()
+    return (row['version'] if row else None) or 0
+
+def run_migrations() -> int:
+    """
+    Bring the schema up to SCHEMA_VERSION. Returns the number of migrations applied.
+    On a warm start this is a single catalog lookup and no DDL.
+    """
+    global _statement_generation
+    with get_cursor(readonly=True) as c:
+        if _current_schema_version(c) >= SCHEMA_VERSION:
+            return 0
+
+    applied = 0
+    for version, description, migrate in MIGRATIONS:
+        with get_cursor() as c:
+            if DATABASE_URL:
+                c.execute("SELECT pg_advisory_xact_lock(%s)", (_MIGRATION_LOCK_ID,))
+            else:
+                c.execute("BEGIN IMMEDIATE")
+            c.execute(
+                "CREATE TABLE IF NOT EXISTS schema_version ("
+                "version INTEGER PRIMARY KEY, description TEXT, applied_at TEXT)"
             )
-        ''')
+            # Another process may have applied it while we waited for the lock.
+            if _current_schema_version(c) >= version:
+                continue
+            migrate(c)
+            c.execute(
+                normalize_query("INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)"),
+                (version, description, datetime.now().isoformat()),
+            )
+            applied += 1
+            print(f"Applied schema migration {version}: {description}")
+    if applied:
+        _statement_generation += 1
+    return applied
 
-        # Initialize summary row
-        c.execute("INSERT INTO session_summary (id, content, last_summarized_message_id) VALUES (1, '', 0) ON CONFLICT (id) DO NOTHING")
+def init_db():
+    # Detect if we need to Initialize Postgres or SQLite
+    if DATABASE_URL:
+        init_postgres()
+    else:
+        init_sqlite()
+
+def init_sqlite():
+    run_migrations()
+
+def init_postgres():
+    run_migrations()
 
 # Initialize DB
 # For SQLite, we can init on module load since it's local
 # For Postgres, we defer to the app lifespan event to ensure network is ready
-if not DATABASE_URL:
-    if not os.path.exists(DB_NAME):
-        init_sqlite()
-    else:
-        # Ensure tables/columns exist
-        init_sqlite()
+# Tenant databases are migrated when first opened instead.
+if not DATABASE_URL and not TENANT_DB_DIR:
+    init_sqlite()
 
 # NOTE: For Postgres (DATABASE_URL set), init_postgres() is called 
 # from main.py's lifespan event to ensure networking is ready.
 
 
+# --- READ CACHE ---
+# The profile, active goals and habits are read on every prompt build, wake-up
+# and tool call but change only through set_profile, create_goal/update_goal
+# and create_habit/update_habit, which drop the cached copy after they commit.
+# With READ_CACHE_NOTIFY on Postgres those writes are also broadcast (NOTIFY)
+# so other instances drop theirs; READ_CACHE_TTL bounds how long a write made
+# by another process can go unseen when there is no such channel.
+#
+# Every write to state the context markdown shows (tasks, goals, habits and
+# their logs, profile) also moves data_version() on, through the same
+# invalidation path, so prompts.get_system_context can reuse its last build.
+# Likewise transcript_version() moves when a stored message is edited or
+# deleted, for the agent's transcript cache (appends don't need it).
+
+READ_CACHE_ENABLED = os.getenv("READ_CACHE_ENABLED", "1") != "0"
+READ_CACHE_TTL = float(os.getenv("READ_CACHE_TTL", "300"))
+READ_CACHE_NOTIFY = os.getenv("READ_CACHE_NOTIFY", "0") == "1"
+_READ_CACHE_CHANNEL = "nachos_read_cache"
+
+_read_cache: Dict[str, Tuple[float, Any]] = {}
+# Bumped by every invalidation, so a load that raced a write isn't stored.
+_read_cache_generation: Dict[str, int] = {}
+_read_cache_lock = threading.Lock()
+_read_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0}
+_read_cache_listener = None
+
+def _cache_key(key: str) -> str:
+    return f"{current_tenant.get()}/{key}"
+
+def _cached(key: str, load: Callable[[], Any]) -> Any:
+    """Value of `key` for the current tenant, loaded with `load()` on a miss. Callers must not mutate it."""
+    if not READ_CACHE_ENABLED:
+        return load()
+    key = _cache_key(key)
+    if DATABASE_URL and READ_CACHE_NOTIFY:
+        _start_read_cache_listener()
+    with _read_cache_lock:
+        entry = _read_cache.get(key)
+        if entry and time.monotonic() - entry[0] < READ_CACHE_TTL:
+            _read_cache_stats["hits"] += 1
+            return entry[1]
+        _read_cache_stats["misses"] += 1
+        generation = _read_cache_generation.get(key, 0)
+    loaded_at = time.monotonic()
+    value = load()
+    with _read_cache_lock:
+        if _read_cache_generation.get(key, 0) == generation:
+            _read_cache[key] = (loaded_at, value)
+    return value
+
+def _drop_cached(*keys: str):
+    with _read_cache_lock:
+        for key in keys:
+            _read_cache.pop(key, None)
+            _read_cache_generation[key] = _read_cache_generation.get(key, 0) + 1
+            _read_cache_stats["invalidations"] += 1
+
+def _drop_all_cached():
+    # Generations too, so data versions move even though nothing is stored under them.
+    with _read_cache_lock:
+        keys = set(_read_cache) | set(_read_cache_generation)
+    _drop_cached(*keys)
+
+def _invalidate_cached(*keys: str):
+    """Call after the write transaction has committed."""
+    if not READ_CACHE_ENABLED:
+        return
+    keys = tuple(_cache_key(key) for key in keys)
+    _drop_cached(*keys)
+    if DATABASE_URL and READ_CACHE_NOTIFY:
+        try:
+            with get_cursor() as c:
+                c.execute("SELECT pg_notify(%s, %s)", (_READ_CACHE_CHANNEL, ",".join(keys)))
+        except Exception as e:
+            print(f"Read cache notify error: {e}")
+
+def _start_read_cache_listener():
+    global _read_cache_listener
+    with _read_cache_lock:
+        if _read_cache_listener is not None:
+            return
+        _read_cache_listener = threading.Thread(
+            target=_listen_for_invalidations, name="read-cache-listener", daemon=True)
+        _read_cache_listener.start()
+
+def _listen_for_invalidations():
+    """Drop cached entries other instances announce. Runs on its own connection, outside the pool."""
+    import select
+    while True:
+        try:
+            conn = psycopg2.connect(DATABASE_URL)
+            conn.autocommit = True
+            conn.cursor().execute(f"LISTEN {_READ_CACHE_CHANNEL}")
+            # Writes made while we weren't listening went unannounced.
+            _drop_all_cached()
+            while True:
+                if select.select([conn], [], [], 60)[0]:
+                    conn.poll()
+                    while conn.notifies:
+                        _drop_cached(*conn.notifies.pop(0).payload.split(","))
+        except Exception as e:
+            print(f"Read cache listener error: {e}")
+            _drop_all_cached()
+            time.sleep(5)
+
+_DATA_VERSION_KEY = "data"
+
+def _data_changed(*keys: str):
+    """Call after a state write has committed: drops `keys` and moves data_version() on."""
+    _invalidate_cached(*keys, _DATA_VERSION_KEY)
+
+def data_version() -> int:
+    """Current tenant's state version; stays put while READ_CACHE_ENABLED is off."""
+    with _read_cache_lock:
+        return _read_cache_generation.get(_cache_key(_DATA_VERSION_KEY), 0)
+
+_TRANSCRIPT_VERSION_KEY = "transcript"
+
+def transcript_version() -> int:
+    """Current tenant's message-edit version; stays put while READ_CACHE_ENABLED is off."""
+    with _read_cache_lock:
+        return _read_cache_generation.get(_cache_key(_TRANSCRIPT_VERSION_KEY), 0)
+
+def get_read_cache_stats() -> Dict[str, Any]:
+    with _read_cache_lock:
+        lookups = _read_cache_stats["hits"] + _read_cache_stats["misses"]
+        return {
+            **_read_cache_stats,
+            "hit_rate": round(_read_cache_stats["hits"] / lookups, 3) if lookups else None,
+            "entries": sorted(_read_cache),
+            "enabled": READ_CACHE_ENABLED,
+            "notify": bool(DATABASE_URL and READ_CACHE_NOTIFY),
+        }
+
+
 # --- MEMORY FUNCTIONS ---
 
 def save_push_token(token: str) -> bool:
     try:
         with get_cursor() as c:
             now = datetime.now().isoformat()
-            
-            if DATABASE_URL:
-                # Postgres UPSERT
-                c.execute('''
-                    INSERT INTO users (push_token, created_at, last_active)
-                    VALUES (%s, %s, %s)
-                    ON CONFLICT (push_token) 
-                    DO UPDATE SET last_active = EXCLUDED.last_active
-                ''', (token, now, now))
-            else:
-                # SQLite UPSERT-ish
-                c.execute('''
-                    INSERT OR REPLACE INTO users (push_token, created_at, last_active)
-                    VALUES (?, COALESCE((SELECT created_at FROM users WHERE push_token = ?), ?), ?)
-                ''', (token, token, now, now))
+            _execute(c, "save_push_token", (token, now, now))
             return True
     except Exception as e:
         print(f"Error saving push token: {e}")
         return False
 
 def get_push_tokens() -> List[str]:
-    with get_cursor() as c:
-        c.execute("SELECT push_token FROM users WHERE push_token IS NOT NULL")
+    with get_cursor(readonly=True) as c:
+        _execute(c, "get_push_tokens")
         rows = c.fetchall()
         # Row factory handles dict access for both
         return [row['push_token'] for row in rows]
 
-def add_message(role: str, content: str, tool_calls: Optional[List[Dict]] = None, tool_call_id: Optional[str] = None) -> int:
-    conn = get_db_connection()
-    try:
-        cur = conn.cursor()
+def add_message(role: str, content: str, tool_calls: Optional[List[Dict]] = None, tool_call_id: Optional[str] = None,
+                sent_at: Optional[str] = None) -> int:
+    """`sent_at` is the user's send time ("YYYY-MM-DD HH:MM"), kept apart from the content."""
+    with get_cursor() as c:
         created_at = datetime.now().isoformat()
         tool_calls_json = json.dumps(tool_calls) if tool_calls else None
-
-        if DATABASE_URL:
-            cur.execute(
-                "INSERT INTO messages (role, content, tool_calls, tool_call_id, created_at) "
-                "VALUES (%s, %s, %s, %s, %s) RETURNING id",
-                (role, content, tool_calls_json, tool_call_id, created_at)
-            )
-            msg_id = cur.fetchone()[0]
-        else:
-            cur.execute(
-                "INSERT INTO messages (role, content, tool_calls, tool_call_id, created_at) "
-                "VALUES (?, ?, ?, ?, ?)",
-                (role, content, tool_calls_json, tool_call_id, created_at)
-            )
-            msg_id = cur.lastrowid
-
-        conn.commit()
-        return msg_id
-    finally:
-        release_db_connection(conn)
+        _execute(c, "insert_message", (role, content, tool_calls_json, tool_call_id, created_at,
+                                       sent_at, _message_visible(role, content),
+                                       estimate_tokens(content, tool_calls_json, sent_at)))
+        return c.fetchone()['id']
 
 
 def update_message_content(message_id: int, new_content: str) -> bool:
     with get_cursor() as c:
-        query = "UPDATE messages SET content = ? WHERE id = ?"
-        query = normalize_query(query)
-        c.execute(query, (new_content, message_id))
-        return c.rowcount > 0
+        # Visibility depends on the role, so both candidates are bound and SQL picks one.
+        _execute(c, "update_message_content", (new_content, new_content, _message_visible('user', new_content),
+                                               _message_visible('assistant', new_content), message_id))
+        if c.rowcount == 0:
+            # Not hot: the message may have been archived.
+            return _update_archived_message_content(c, message_id, new_content)
+    _invalidate_cached(_TRANSCRIPT_VERSION_KEY)
+    return True
+
+def _update_archived_message_content(c, message_id: int, new_content: str) -> bool:
+    _execute(c, "archived_message", (message_id,))
+    row = c.fetchone()
+    if row is None:
+        return False
+    message = _archived_message(row)
+    payload = _pack({"content": new_content, "tool_calls": message['tool_calls'],
+                     "tool_call_id": message['tool_call_id'], "sent_at": message['sent_at']})
+    visible = _message_visible(message['role'], new_content)
+    _execute(c, "update_archived_message", (payload, visible, message_id))
+    if c.rowcount == 0:
+        return False
+    # Triggers can't read the payload, so the search entry is kept here,
+    # replaced like the triggers do it: delete, then insert under a new id.
+    _execute(c, "unindex_memory_entry", ('message', message_id))
+    if _memory_indexable(message['role'], visible, new_content):
+        _execute(c, "index_memory_entry", ('message', message_id, new_content, message['created_at']))
+    return True
 
 def delete_message(message_id: int) -> bool:
     with get_cursor() as c:
-        query = "DELETE FROM messages WHERE id = ?"
-        query = normalize_query(query)
-        c.execute(query, (message_id,))
-        return c.rowcount > 0
+        _execute(c, "delete_message", (message_id,))
+        if c.rowcount == 0:
+            _execute(c, "delete_archived_message", (message_id,))
+            return c.rowcount > 0
+    _invalidate_cached(_TRANSCRIPT_VERSION_KEY)
+    return True
 
 def get_memory_context() -> Tuple[str, List[Dict[str, Any]]]:
-    with get_cursor() as c:
+    with get_cursor(readonly=True) as c:
         # 1. Get Summary
-        query_sum = "SELECT content, last_summarized_message_id FROM session_summary WHERE id = 1"
-        c.execute(query_sum)
+        _execute(c, "get_summary")
         row = c.fetchone()
         summary = row['content'] if row else ""
         last_id = row['last_summarized_message_id'] if row else 0
 
         # 2. Get Unsummarized Messages
-        query_msg = "SELECT * FROM messages WHERE id > ? ORDER BY id ASC"
-        query_msg = normalize_query(query_msg)
-        c.execute(query_msg, (last_id,))
+        _execute(c, "messages_after", (last_id,))
         messages = [dict(r) for r in c.fetchall()]
 
         return summary, messages
 
-def update_summary(new_content: str, last_summarized_id: int):
+def get_memory_context_after(after_id: int) -> Tuple[str, int, List[Dict[str, Any]]]:
+    """
+    Incremental get_memory_context(): the summary, the id it covers up to,
+    and only the unsummarized messages with id > `after_id`.
+    """
+    with get_cursor(readonly=True) as c:
+        _execute(c, "get_summary")
+        row = c.fetchone()
+        summary = row['content'] if row else ""
+        last_id = (row['last_summarized_message_id'] if row else 0) or 0
+        _execute(c, "messages_after", (max(last_id, after_id),))
+        return summary, last_id, [dict(r) for r in c.fetchall()]
+
+def update_summary(new_content: str, last_summarized_id: int) -> bool:
+    """Store the summary unless it already covers `last_summarized_id`; the summary only moves forward."""
     with get_cursor() as c:
-        query = "UPDATE session_summary SET content = ?, last_summarized_message_id = ? WHERE id = 1"
-        query = normalize_query(query)
-        c.execute(query, (new_content, last_summarized_id))
+        _execute(c, "update_summary", (new_content, last_summarized_id))
+        return c.rowcount > 0
 
 def get_messages_range(start_id: int, limit: int) -> List[Dict[str, Any]]:
-    with get_cursor() as c:
-        query = "SELECT * FROM messages WHERE id >= ? ORDER BY id ASC LIMIT ?"
-        query = normalize_query(query)
-        c.execute(query, (start_id, limit))
-        return [dict(r) for r in c.fetchall()]
+    with get_cursor(readonly=True) as c:
+        # Archived ids all precede the hot ones, so the archive is read first.
+        _execute(c, "archived_messages_range", (start_id, limit))
+        messages = [_archived_message(r) for r in c.fetchall()]
+        if len(messages) < limit:
+            _execute(c, "get_messages_range", (start_id, limit - len(messages)))
+            messages += [dict(r) for r in c.fetchall()]
+        return messages
 
 def create_goal(title: str, description: str = "", notes: str = "") -> int:
-    conn = get_db_connection()
-    try:
+    with get_cursor() as c:
         created_at = datetime.now().isoformat()
-        if DATABASE_URL:
-            cur = conn.cursor()
-            cur.execute("""
-                INSERT INTO goals (title, description, status, created_at, notes) 
-                VALUES (%s, %s, 'ACTIVE', %s, %s) RETURNING id
-            """, (title, description, created_at, notes))
-            goal_id = cur.fetchone()[0]
-            conn.commit()
-            return goal_id
-        else:
-            cur = conn.cursor()
-            cur.execute('INSERT INTO goals (title, description, status, created_at, notes) VALUES (?, ?, "ACTIVE", ?, ?)',
-                      (title, description, created_at, notes))
-            goal_id = cur.lastrowid
-            conn.commit()
-            return goal_id
-    finally:
-        release_db_connection(conn)
+        _execute(c, "insert_goal", (title, description, created_at, notes))
+        goal_id = c.fetchone()['id']
+    _data_changed("goals")
+    return goal_id
 
 def create_task(title: str, goal_id: Optional[int] = None, priority: str = "MEDIUM", due_date: Optional[str] = None, scheduled_date: Optional[str] = None, effort: str = "MEDIUM", notes: str = "") -> int:
-    conn = get_db_connection()
-    try:
+    due_date = _resolve_task_date("due_date", due_date)
+    scheduled_date = _resolve_task_date("scheduled_date", scheduled_date)
+    with get_cursor() as c:
         created_at = datetime.now().isoformat()
-        if DATABASE_URL:
-            cur = conn.cursor()
-            cur.execute("""
-                INSERT INTO tasks (title, goal_id, status, priority, due_date, scheduled_date, effort, notes, created_at, updated_at)
-                VALUES (%s, %s, 'TODO', %s, %s, %s, %s, %s, %s, %s) RETURNING id
-            """, (title, goal_id, priority, due_date, scheduled_date, effort, notes, created_at, created_at))
-            task_id = cur.fetchone()[0]
-            conn.commit()
-            return task_id
-        else:
-            cur = conn.cursor()
-            cur.execute('''
-                INSERT INTO tasks (title, goal_id, status, priority, due_date, scheduled_date, effort, notes, created_at, updated_at)
-                VALUES (?, ?, 'TODO', ?, ?, ?, ?, ?, ?, ?)
-            ''', (title, goal_id, priority, due_date, scheduled_date, effort, notes, created_at, created_at))
-            task_id = cur.lastrowid
-            conn.commit()
-            return task_id
-    finally:
-        release_db_connection(conn)
+        _execute(c, "insert_task", (title, goal_id, priority, due_date, scheduled_date, effort, notes, created_at, created_at))
+        task_id = c.fetchone()['id']
+    _data_changed()
+    return task_id
 
 def update_task_status(task_id: int, status: str, blocker_reason: Optional[str] = None) -> bool:
     return update_task(task_id, {"status": status, "blocker_reason": blocker_reason})
 
-def update_task(task_id: int, updates: Dict[str, Any]) -> bool:
-    with get_cursor() as c:
-        updated_at = datetime.now().isoformat()
-
-        fields = []
-        values = []
-
-        for key, value in updates.items():
-            if key not in ALLOWED_TASK_COLUMNS:
-                continue
-            fields.append(f"{key} = ?" if not DATABASE_URL else f"{key} = %s")
-            values.append(value)
-
-        fields.append("updated_at = ?" if not DATABASE_URL else "updated_at = %s")
-        values.append(updated_at)
+def _task_update_columns(updates: Dict[str, Any]) -> Tuple[str, ...]:
+    """Allowed columns present in `updates`, in a stable order so equal column sets share a statement."""
+    return tuple(sorted(key for key in updates if key in ALLOWED_TASK_COLUMNS))
 
-        if len(fields) <= 1:
-            return False
+def _restore_archived_task(c, task_id: int) -> bool:
+    """
+    Move an archived task back into `tasks` so it can be edited like any other.
+    If it still qualifies for the archive, the next archive run moves it out again.
+    """
+    _execute(c, "archived_task", (task_id,))
+    row = c.fetchone()
+    if row is None:
+        return False
+    task = _unpack(row['payload'])
+    # Archive row first: its trigger drops the search entry the insert re-creates.
+    _execute(c, "delete_archived_task", (task_id,))
+    _execute(c, "restore_task", tuple(task.get(field) for field in TASK_FIELDS))
+    return True
 
-        query = f"UPDATE tasks SET {', '.join(fields)} WHERE id = ?"
-        if DATABASE_URL:
-            query = query.replace("?", "%s") # Safety net
-        
-        values.append(task_id)
+def update_task(task_id: int, updates: Dict[str, Any]) -> bool:
+    """Update a task, restoring it from the archive first if it was archived."""
+    columns = _task_update_columns(updates)
+    if not columns:
+        return False
+    updates = _resolve_task_dates(updates)
 
-        c.execute(query, values)
-        return c.rowcount > 0
+    with get_cursor() as c:
+        updated_at = datetime.now().isoformat()
+        values = [updates[col] for col in columns] + [updated_at, task_id]
+        statement = _update_statement("tasks", columns + ("updated_at",))
+        _execute(c, statement, values)
+        updated = c.rowcount > 0
+        if not updated and _restore_archived_task(c, task_id):
+            _execute(c, statement, values)
+            updated = c.rowcount > 0
+    _data_changed()
+    return updated
 
 def delete_task(task_id: int) -> bool:
     with get_cursor() as c:
-        query = "DELETE FROM tasks WHERE id = ?"
-        query = normalize_query(query)
-        c.execute(query, (task_id,))
-        return c.rowcount > 0
+        _execute(c, "delete_task", (task_id,))
+        deleted = c.rowcount > 0
+        if not deleted:
+            _execute(c, "delete_archived_task", (task_id,))
+            deleted = c.rowcount > 0
+    _data_changed()
+    return deleted
+
+def bulk_update_tasks(updates_list: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """
+    Apply many task updates in one transaction, one statement per column set.
+    Archived tasks are restored and updated, as in update_task(). Returns the
+    ids that were updated, the ids that don't exist ("missing"), and the ids
+    whose entry had no updatable field ("skipped").
+    """
+    # Later entries for the same id win, as if the updates ran one by one.
+    merged: Dict[int, Dict[str, Any]] = {}
+    missing: List[Any] = []
+    for update_item in updates_list:
+        if 'id' not in update_item:
+            continue
+        try:
+            task_id = int(update_item['id'])
+        except (TypeError, ValueError):
+            missing.append(update_item['id'])
+            continue
+        merged.setdefault(task_id, {}).update(_resolve_task_dates(
+            {key: value for key, value in update_item.items() if key in ALLOWED_TASK_COLUMNS}
+        ))
+
+    groups: Dict[Tuple[str, ...], List[Tuple[int, Dict[str, Any]]]] = {}
+    skipped: List[int] = []
+    for task_id, fields in merged.items():
+        columns = _task_update_columns(fields)
+        if columns:
+            groups.setdefault(columns, []).append((task_id, fields))
+        else:
+            skipped.append(task_id)
 
-def bulk_update_tasks(updates_list: List[Dict[str, Any]]) -> int:
-    # Transaction handling is tricky with pool vs single conn, so we use explcit conn
-    conn = get_db_connection()
     updated_at = datetime.now().isoformat()
-    total_affected = 0
-    
+    updated = set()
+
+    def apply(c, columns, items):
+        for start in range(0, len(items), BULK_UPDATE_MAX_ROWS):
+            chunk = items[start:start + BULK_UPDATE_MAX_ROWS]
+            # Pad to a power of two with repeats of the last row so only
+            # a handful of statement shapes exist per column set.
+            rows = 1 << (len(chunk) - 1).bit_length()
+            chunk += [chunk[-1]] * (rows - len(chunk))
+            params = [value for task_id, fields in chunk
+                      for value in (task_id, *(fields[col] for col in columns))]
+            params.append(updated_at)
+            _execute(c, _bulk_update_tasks_statement(columns, rows), params)
+            updated.update(row['id'] for row in c.fetchall())
+
     try:
-        cur = conn.cursor()
-        
-        for update_item in updates_list:
-            if 'id' not in update_item:
-                continue
-            task_id = update_item.get('id')
-
-            fields = []
-            values = []
-
-            for key, value in update_item.items():
-                if key == 'id': continue
-                if key not in ALLOWED_TASK_COLUMNS: continue
-                fields.append(f"{key} = ?" if not DATABASE_URL else f"{key} = %s")
-                values.append(value)
-            
-            if not fields: continue
-            
-            fields.append("updated_at = ?" if not DATABASE_URL else "updated_at = %s")
-            values.append(updated_at)
-            
-            query = f"UPDATE tasks SET {', '.join(fields)} WHERE id = ?"
-            if DATABASE_URL:
-                query = query.replace("?", "%s")
-                
-            values.append(task_id)
-            cur.execute(query, values)
-            total_affected += cur.rowcount
-            
-        conn.commit()
+        with get_cursor() as c:
+            for columns, items in groups.items():
+                apply(c, columns, items)
+            # Ids not in `tasks` may be archived; restore those and update them too.
+            for columns, items in groups.items():
+                restored = [(task_id, fields) for task_id, fields in items
+                            if task_id not in updated and _restore_archived_task(c, task_id)]
+                if restored:
+                    apply(c, columns, restored)
     except Exception as e:
-        conn.rollback()
         print(f"Bulk Update Error: {e}")
         raise e
-    finally:
-        if DATABASE_URL:
-            cur.close()
-        release_db_connection(conn)
-        
-    return total_affected
+    if updated:
+        _data_changed()
 
-def get_recent_messages(limit: int = 50, include_tool_calls: bool = True) -> List[Dict[str, Any]]:
-    with get_cursor() as c:
-        if DATABASE_URL:
-             # Postgres subquery layout
-            query = """
-                SELECT * FROM (
-                    SELECT id, role, content, created_at
-                    FROM messages
-                    ORDER BY created_at DESC
-                    LIMIT %s
-                ) AS sub ORDER BY created_at ASC
-            """
-            c.execute(query, (limit,))
-        else:
-             c.execute('''
-                SELECT * FROM (
-                    SELECT id, role, content, created_at
-                    FROM messages
-                    ORDER BY created_at DESC
-                    LIMIT ?
-                ) ORDER BY created_at ASC
-            ''', (limit,))
-            
-        rows = c.fetchall()
-        # Process rows...
-        # Since we use dict_factory/RealDictCursor, rows are dicts
-        
-    clean_messages = []
-    import re
-    timestamp_pattern = re.compile(r"^\[\d{4}-\d{2}-\d{2} \d{2}:\d{2}\] ")
-
-    for row in rows:
-        msg = dict(row) # ensure dict
-        content = msg.get('content') or ""
-        
-        if not include_tool_calls and msg['role'] == 'tool':
-            continue
-        if msg['role'] == 'user' and "[SYSTEM EVENT]" in content:
-            continue
-        if msg['role'] == 'assistant' and "SLEEP" in content:
-            continue
-        if msg['role'] == 'user' and content:
-            msg['content'] = timestamp_pattern.sub("", content)
-            
-        clean_messages.append(msg)
-    return clean_messages
-
-def update_goal(goal_id: int, updates: Dict[str, Any]) -> bool:
-    with get_cursor() as c:
-        fields = []
-        values = []
+    return {
+        "updated": [task_id for task_id in merged if task_id in updated],
+        "missing": missing + [task_id for items in groups.values() for task_id, _ in items
+                              if task_id not in updated],
+        "skipped": skipped,
+    }
 
-        for key, value in updates.items():
-            if key not in ALLOWED_GOAL_COLUMNS: continue
-            fields.append(f"{key} = ?" if not DATABASE_URL else f"{key} = %s")
-            values.append(value)
+def _history_row(message: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: message[key] for key in ("id", "role", "content", "created_at", "sent_at")}
 
-        if not fields: return False
+def get_chat_history(limit: int = 50, before_id: Optional[int] = None, since_id: Optional[int] = None,
+                     include_tool_calls: bool = False) -> List[Dict[str, Any]]:
+    """
+    One page of the chat history the user sees, oldest first. With `since_id`
+    it is the first `limit` messages after that id (fetch new messages);
+    otherwise the last `limit` messages before `before_id`, or the latest ones
+    (scroll back). Hidden rows are filtered in SQL, so a page is always full
+    when enough history exists.
+    """
+    skip_role = "" if include_tool_calls else "tool"
+    with get_cursor(readonly=True) as c:
+        if since_id is not None:
+            # Archived ids all precede the hot ones, so the archive is read first.
+            _execute(c, "archived_chat_history_since", (skip_role, since_id, limit))
+            rows = [_history_row(_archived_message(r)) for r in c.fetchall()]
+            if len(rows) < limit:
+                _execute(c, "chat_history_since", (skip_role, since_id, limit - len(rows)))
+                rows += [dict(r) for r in c.fetchall()]
+            return rows
+
+        if before_id is None:
+            _execute(c, "chat_history_latest", (skip_role, limit))
+        else:
+            _execute(c, "chat_history_before", (skip_role, before_id, limit))
+        rows = [dict(r) for r in c.fetchall()]
+        if len(rows) < limit:
+            # History reaches back past the hot table into the archive.
+            bound = rows[-1]['id'] if rows else before_id
+            if bound is None:
+                _execute(c, "archived_chat_history_latest", (skip_role, limit))
+            else:
+                _execute(c, "archived_chat_history_before", (skip_role, bound, limit - len(rows)))
+            rows += [_history_row(_archived_message(r)) for r in c.fetchall()]
+        rows.reverse()
+        return rows
 
-        query = f"UPDATE goals SET {', '.join(fields)} WHERE id = ?"
-        if DATABASE_URL: query = query.replace("?", "%s")
-        values.append(goal_id)
+def get_recent_messages(limit: int = 50, include_tool_calls: bool = True) -> List[Dict[str, Any]]:
+    """The latest `limit` messages of the chat history; see get_chat_history."""
+    return get_chat_history(limit=limit, include_tool_calls=include_tool_calls)
 
-        c.execute(query, values)
-        return c.rowcount > 0
+def update_goal(goal_id: int, updates: Dict[str, Any]) -> bool:
+    columns = tuple(sorted(key for key in updates if key in ALLOWED_GOAL_COLUMNS))
+    if not columns: return False
 
-def list_tasks(status: Optional[str] = None, limit: int = 10000) -> List[Dict[str, Any]]:
     with get_cursor() as c:
-        query = 'SELECT * FROM tasks'
-        params = []
-
+        values = [updates[col] for col in columns] + [goal_id]
+        _execute(c, _update_statement("goals", columns), values)
+        updated = c.rowcount > 0
+    _data_changed("goals")
+    return updated
+
+def list_tasks(status: Optional[str] = None, limit: int = 10000, include_archived: bool = False) -> List[Dict[str, Any]]:
+    with get_cursor(readonly=True) as c:
         if status:
-            query += ' WHERE status = ?' if not DATABASE_URL else ' WHERE status = %s'
-            params.append(status)
-
-        query += ' ORDER BY created_at DESC LIMIT ?' if not DATABASE_URL else ' ORDER BY created_at DESC LIMIT %s'
-        params.append(limit)
+            _execute(c, "list_tasks_by_status", (status, limit))
+        else:
+            _execute(c, "list_tasks", (limit,))
+        tasks = [dict(row) for row in c.fetchall()]
 
-        c.execute(query, params)
-        rows = c.fetchall()
-        return [dict(row) for row in rows]
+        if include_archived:
+            if status:
+                _execute(c, "archived_tasks_by_status", (status, limit))
+            else:
+                _execute(c, "archived_tasks", (limit,))
+            tasks += [_unpack(row['payload']) for row in c.fetchall()]
+            tasks.sort(key=lambda t: t['created_at'] or "", reverse=True)
+            tasks = tasks[:limit]
+        return tasks
+
+def get_task_page(limit: int = 100, before_id: Optional[int] = None, fields: Optional[Sequence[str]] = None,
+                  include_archived: bool = False, **filters: Any) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+    """
+    One newest-first page of tasks. Filters: status, goal_id, scheduled_from,
+    scheduled_to, due_from, due_to (dates accept 'TODAY'). `fields` limits the
+    returned columns (id is always included). Returns (tasks, next_before_id);
+    next_before_id is None on the last page.
+    """
+    fields = tuple(fields or TASK_FIELDS)
+    unknown = [f for f in fields if f not in TASK_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown task fields: {', '.join(unknown)}")
+    if "id" not in fields:
+        fields = ("id",) + fields
+
+    filters = {key: value for key, value in filters.items() if value not in (None, "")}
+    unknown = [key for key in filters if key not in _TASK_PAGE_FILTERS]
+    if unknown:
+        raise ValueError(f"Unknown task filters: {', '.join(unknown)}")
+    for key, value in filters.items():
+        column = _TASK_PAGE_FILTERS[key][1]
+        if column:
+            filters[key] = _day_value(_resolve_task_date(key, value))
+    if include_archived and any(key not in _ARCHIVE_PAGE_FILTERS for key in filters):
+        raise ValueError("Date filters can't be combined with include_archived")
+    if before_id is not None:
+        filters["before_id"] = before_id
+    keys = tuple(key for key in _TASK_PAGE_FILTERS if key in filters)
+    params = [filters[key] for key in keys] + [limit]
+
+    with get_cursor(readonly=True) as c:
+        _execute(c, _task_page_statement("tasks", keys), params)
+        tasks = [dict(row) for row in c.fetchall()]
+        if include_archived:
+            _execute(c, _task_page_statement("tasks_archive", keys), params)
+            tasks += [_unpack(row['payload']) for row in c.fetchall()]
+            tasks.sort(key=lambda t: t['id'], reverse=True)
+            tasks = tasks[:limit]
+
+    next_before_id = tasks[-1]['id'] if len(tasks) == limit else None
+    return [{f: task.get(f) for f in fields} for task in tasks], next_before_id
+
+def get_table_versions() -> Dict[str, int]:
+    """The current tenant's change counters of the versioned tables; they grow on every write of theirs."""
+    with get_cursor(readonly=True) as c:
+        _execute(c, "table_versions")
+        return {row['table_name']: row['version'] for row in c.fetchall()}
+
+def _load_goals() -> List[Dict[str, Any]]:
+    with get_cursor(readonly=True) as c:
+        _execute(c, "list_goals")
+        return [dict(row) for row in c.fetchall()]
 
 def list_goals() -> List[Dict[str, Any]]:
-    with get_cursor() as c:
-        c.execute('SELECT * FROM goals WHERE status = "ACTIVE"' if not DATABASE_URL else "SELECT * FROM goals WHERE status = 'ACTIVE'")
-        rows = c.fetchall()
-        return [dict(row) for row in rows]
+    return [dict(row) for row in _cached("goals", _load_goals)]
 
 # --- HABIT FUNCTIONS ---
 
 def create_habit(title: str, frequency: str = "daily", goal_id: Optional[int] = None) -> int:
-    conn = get_db_connection()
-    try:
+    with get_cursor() as c:
         created_at = datetime.now().isoformat()
-        if DATABASE_URL:
-            cur = conn.cursor()
-            cur.execute("""
-                INSERT INTO habits (title, frequency, goal_id, active, created_at)
-                VALUES (%s, %s, %s, 1, %s) RETURNING id
-            """, (title, frequency, goal_id, created_at))
-            habit_id = cur.fetchone()[0]
-            conn.commit()
-            return habit_id
-        else:
-            cur = conn.cursor()
-            cur.execute('''
-                INSERT INTO habits (title, frequency, goal_id, active, created_at)
-                VALUES (?, ?, ?, 1, ?)
-            ''', (title, frequency, goal_id, created_at))
-            habit_id = cur.lastrowid
-            conn.commit()
-            return habit_id
-    finally:
-        release_db_connection(conn)
+        _execute(c, "insert_habit", (title, frequency, goal_id, created_at))
+        habit_id = c.fetchone()['id']
+    _data_changed("habits:active", "habits:all")
+    return habit_id
 
 def log_habit(habit_id: int, log_date: Optional[str] = None, status: str = "done", skip_reason: str = "") -> int:
-    conn = get_db_connection()
-    try:
+    with get_cursor() as c:
         created_at = datetime.now().isoformat()
         if not log_date:
             log_date = datetime.now().strftime("%Y-%m-%d")
-        if DATABASE_URL:
-            cur = conn.cursor()
-            cur.execute("""
-                INSERT INTO habit_logs (habit_id, log_date, status, skip_reason, created_at)
-                VALUES (%s, %s, %s, %s, %s) RETURNING id
-            """, (habit_id, log_date, status, skip_reason, created_at))
-            log_id = cur.fetchone()[0]
-            conn.commit()
-            return log_id
-        else:
-            cur = conn.cursor()
-            cur.execute('''
-                INSERT INTO habit_logs (habit_id, log_date, status, skip_reason, created_at)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (habit_id, log_date, status, skip_reason, created_at))
-            log_id = cur.lastrowid
-            conn.commit()
-            return log_id
-    finally:
-        release_db_connection(conn)
+        _execute(c, "insert_habit_log", (habit_id, log_date, status, skip_reason, created_at))
+        log_id = c.fetchone()['id']
+    _data_changed()
+    return log_id
 
 def list_habits(active_only: bool = True) -> List[Dict[str, Any]]:
-    with get_cursor() as c:
-        if active_only:
-            query = "SELECT * FROM habits WHERE active = 1 ORDER BY created_at ASC"
-        else:
-            query = "SELECT * FROM habits ORDER BY created_at ASC"
-        c.execute(query)
-        return [dict(row) for row in c.fetchall()]
+    def load():
+        with get_cursor(readonly=True) as c:
+            _execute(c, "list_habits_active" if active_only else "list_habits_all")
+            return [dict(row) for row in c.fetchall()]
+    return [dict(row) for row in _cached("habits:active" if active_only else "habits:all", load)]
 
 def update_habit(habit_id: int, updates: Dict[str, Any]) -> bool:
+    columns = tuple(sorted(key for key in updates if key in ALLOWED_HABIT_COLUMNS))
+    if not columns:
+        return False
     with get_cursor() as c:
-        fields = []
-        values = []
-        for key, value in updates.items():
-            if key not in ALLOWED_HABIT_COLUMNS:
-                continue
-            fields.append(f"{key} = ?" if not DATABASE_URL else f"{key} = %s")
-            values.append(value)
-        if not fields:
-            return False
-        query = f"UPDATE habits SET {', '.join(fields)} WHERE id = ?"
-        if DATABASE_URL:
-            query = query.replace("?", "%s")
-        values.append(habit_id)
-        c.execute(query, values)
-        return c.rowcount > 0
+        values = [updates[col] for col in columns] + [habit_id]
+        _execute(c, _update_statement("habits", columns), values)
+        updated = c.rowcount > 0
+    _data_changed("habits:active", "habits:all")
+    return updated
+
+def _fetch_habit_streaks(c) -> List[Dict[str, Any]]:
+    """Run the single-pass streak query on an open cursor."""
+    today = datetime.now().date()
+    today_str = today.strftime("%Y-%m-%d")
+    yesterday_str = (today - timedelta(days=1)).strftime("%Y-%m-%d")
+    _execute(c, "habit_streaks", (today_str, yesterday_str, today_str))
 
-def get_habit_streaks() -> List[Dict[str, Any]]:
-    """Compute current streak, longest streak, and completion rate per habit."""
-    habits = list_habits(active_only=True)
-    today = datetime.now().strftime("%Y-%m-%d")
     results = []
-
-    with get_cursor() as c:
-        for habit in habits:
-            hid = habit['id']
-            query = "SELECT log_date, status FROM habit_logs WHERE habit_id = ? ORDER BY log_date DESC"
-            query = normalize_query(query)
-            c.execute(query, (hid,))
-            logs = [dict(r) for r in c.fetchall()]
-
-            done_dates = sorted(set(l['log_date'] for l in logs if l['status'] == 'done'), reverse=True)
-            total_logs = len(logs)
-            done_count = len([l for l in logs if l['status'] == 'done'])
-
-            # Current streak: consecutive days ending today (or yesterday)
-            current_streak = 0
-            check_date = datetime.now().date()
-            for _ in range(365):
-                date_str = check_date.strftime("%Y-%m-%d")
-                if date_str in done_dates:
-                    current_streak += 1
-                    check_date -= timedelta(days=1)
-                elif current_streak == 0 and check_date == datetime.now().date():
-                    # Today not logged yet — check from yesterday
-                    check_date -= timedelta(days=1)
-                    continue
-                else:
-                    break
-
-            # Longest streak
-            longest_streak = 0
-            if done_dates:
-                sorted_asc = sorted(done_dates)
-                streak = 1
-                for i in range(1, len(sorted_asc)):
-                    prev = datetime.strptime(sorted_asc[i-1], "%Y-%m-%d").date()
-                    curr = datetime.strptime(sorted_asc[i], "%Y-%m-%d").date()
-                    if (curr - prev).days == 1:
-                        streak += 1
-                    else:
-                        longest_streak = max(longest_streak, streak)
-                        streak = 1
-                longest_streak = max(longest_streak, streak)
-
-            completion_rate = round(done_count / total_logs * 100) if total_logs > 0 else 0
-
-            results.append({
-                "habit_id": hid,
-                "title": habit['title'],
-                "frequency": habit['frequency'],
-                "current_streak": current_streak,
-                "longest_streak": longest_streak,
-                "completion_rate": completion_rate,
-                "total_logs": total_logs,
-                "logged_today": today in [l['log_date'] for l in logs],
-            })
+    for r in c.fetchall():
+        r = dict(r)
+        total_logs = r['total_logs']
+        results.append({
+            "habit_id": r['habit_id'],
+            "title": r['title'],
+            "frequency": r['frequency'],
+            "current_streak": r['current_streak'],
+            "longest_streak": r['longest_streak'],
+            "completion_rate": round(r['done_logs'] / total_logs * 100) if total_logs > 0 else 0,
+            "total_logs": total_logs,
+            "logged_today": bool(r['logged_today']),
+        })
     return results
 
+def get_habit_streaks() -> List[Dict[str, Any]]:
+    """Compute current streak, longest streak, and completion rate per habit in one query."""
+    with get_cursor(readonly=True) as c:
+        return _fetch_habit_streaks(c)
+
 
 # --- USER PROFILE FUNCTIONS ---
 
 def set_profile(key: str, value: str) -> bool:
     with get_cursor() as c:
         now = datetime.now().isoformat()
-        if DATABASE_URL:
-            c.execute("""
-                INSERT INTO user_profile (key, value, updated_at)
-                VALUES (%s, %s, %s)
-                ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = EXCLUDED.updated_at
-            """, (key, value, now))
-        else:
-            c.execute("""
-                INSERT OR REPLACE INTO user_profile (key, value, updated_at)
-                VALUES (?, ?, ?)
-            """, (key, value, now))
-        return True
+        _execute(c, "set_profile", (key, value, now))
+    _data_changed("profile")
+    return True
+
+def _load_profile() -> Dict[str, str]:
+    with get_cursor(readonly=True) as c:
+        _execute(c, "get_profile")
+        return {row['key']: row['value'] for row in c.fetchall()}
 
 def get_profile() -> Dict[str, str]:
-    with get_cursor() as c:
-        c.execute("SELECT key, value FROM user_profile")
-        rows = c.fetchall()
-        return {row['key']: row['value'] for row in rows}
+    return dict(_cached("profile", _load_profile))
 
 
 # --- REFLECTION FUNCTIONS ---
 
 def save_reflection(content: str, reflection_type: str = "daily") -> int:
-    conn = get_db_connection()
-    try:
+    with get_cursor() as c:
         created_at = datetime.now().isoformat()
-        if DATABASE_URL:
-            cur = conn.cursor()
-            cur.execute("""
-                INSERT INTO reflections (content, reflection_type, created_at)
-                VALUES (%s, %s, %s) RETURNING id
-            """, (content, reflection_type, created_at))
-            rid = cur.fetchone()[0]
-            conn.commit()
-            return rid
-        else:
-            cur = conn.cursor()
-            cur.execute('''
-                INSERT INTO reflections (content, reflection_type, created_at)
-                VALUES (?, ?, ?)
-            ''', (content, reflection_type, created_at))
-            rid = cur.lastrowid
-            conn.commit()
-            return rid
-    finally:
-        release_db_connection(conn)
+        _execute(c, "insert_reflection", (content, reflection_type, created_at))
+        return c.fetchone()['id']
 
 def get_recent_reflections(limit: int = 5, reflection_type: Optional[str] = None) -> List[Dict[str, Any]]:
-    with get_cursor() as c:
+    with get_cursor(readonly=True) as c:
         if reflection_type:
-            query = "SELECT * FROM reflections WHERE reflection_type = ? ORDER BY created_at DESC LIMIT ?"
-            query = normalize_query(query)
-            c.execute(query, (reflection_type, limit))
+            _execute(c, "recent_reflections_by_type", (reflection_type, limit))
+        else:
+            _execute(c, "recent_reflections", (limit,))
+        return [dict(r) for r in c.fetchall()]
+
+
+# --- MEMORY SEARCH ---
+# Messages (hot and archived), reflections and tasks are indexed by
+# triggers as they are written; see _migration_008_memory_search.
+
+MEMORY_SEARCH_KINDS = tuple(_MEMORY_SOURCES)
+
+def _memory_search_terms(query: str) -> str:
+    """
+    The search string as an OR of its words, so a natural-language query
+    still matches and rank puts the rows with the most (and rarest) words first.
+    """
+    words = re.findall(r"\w+", query.lower())
+    if DATABASE_URL:
+        return " | ".join(words)
+    return " OR ".join(f'"{word}"' for word in words)
+
+def search_memory(query: str, limit: int = 10, kind: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Best-matching messages, reflections and tasks for `query`, each with a snippet of its text."""
+    terms = _memory_search_terms(query)
+    if not terms:
+        return []
+    with get_cursor(readonly=True) as c:
+        if kind:
+            _execute(c, "search_memory_kind", (terms, kind, limit))
         else:
-            query = "SELECT * FROM reflections ORDER BY created_at DESC LIMIT ?"
-            query = normalize_query(query)
-            c.execute(query, (limit,))
+            _execute(c, "search_memory", (terms, limit))
+        return [dict(r) for r in c.fetchall()]
+
+def get_memory_entries_after(after_id: int, limit: int) -> List[Dict[str, Any]]:
+    """(id, body) of the index entries added after `after_id`, oldest first; for incremental indexers."""
+    with get_cursor(readonly=True) as c:
+        _execute(c, "memory_entries_after", (after_id, limit))
         return [dict(r) for r in c.fetchall()]
 
+def count_memory_entries() -> int:
+    with get_cursor(readonly=True) as c:
+        _execute(c, "memory_entry_count")
+        return c.fetchone()['count']
+
+def get_memory_entries(entry_ids: List[int]) -> List[Dict[str, Any]]:
+    """Entries by id, in the order given; ids no longer indexed are left out."""
+    if not entry_ids:
+        return []
+    with get_cursor(readonly=True) as c:
+        _execute(c, _memory_entries_statement(len(entry_ids)), list(entry_ids))
+        rows = {r['id']: dict(r) for r in c.fetchall()}
+    return [rows[i] for i in entry_ids if i in rows]
+
+
+# --- ARCHIVE (COLD STORAGE) ---
+# Summarized messages and old DONE/CANCELLED tasks are moved out of the hot
+# tables by archive_cold_rows() (scheduled nightly), so hot-table size stays
+# bounded by the unsummarized conversation plus the retention windows below.
+# The read and debug functions above fall through to the archive, so callers
+# don't need to know where a row lives.
+
+# Summarized messages kept hot anyway, so chat history rarely touches the archive.
+ARCHIVE_KEEP_MESSAGES = int(os.getenv("ARCHIVE_KEEP_MESSAGES", "200"))
+# DONE/CANCELLED tasks (not linked to an active goal) older than this are archived.
+ARCHIVE_TASKS_AFTER_DAYS = int(os.getenv("ARCHIVE_TASKS_AFTER_DAYS", "30"))
+# Rows moved per transaction, so the SQLite writer lock is never held for long.
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+
+def _archived_message(row) -> Dict[str, Any]:
+    """Rebuild a `messages` row from its archived form."""
+    row = dict(row)
+    return {"id": row['id'], "role": row['role'], "sent_at": None, **_unpack(row['payload']),
+            "created_at": row['created_at'], "visible": row['visible']}
+
+def _archive_messages(keep_recent: int) -> int:
+    with get_cursor(readonly=True) as c:
+        _execute(c, "get_summary")
+        row = c.fetchone()
+        last_summarized = row['last_summarized_message_id'] if row else 0
+        _execute(c, "max_message_id")
+        max_id = c.fetchone()['max_id'] or 0
+    # Only messages already folded into the summary, minus the recent tail.
+    cutoff = min(last_summarized or 0, max_id - keep_recent)
+
+    moved = 0
+    while True:
+        with get_cursor() as c:
+            _execute(c, "messages_to_archive", (cutoff, ARCHIVE_BATCH_SIZE))
+            rows = [dict(r) for r in c.fetchall()]
+            if not rows:
+                return moved
+            archived_at = datetime.now().isoformat()
+            c.executemany(SQL["insert_message_archive"], [
+                _bind("insert_message_archive", (
+                    r['id'], r['role'], r['created_at'], archived_at, r['visible'],
+                    _pack({"content": r['content'], "tool_calls": r['tool_calls'],
+                           "tool_call_id": r['tool_call_id'], "sent_at": r['sent_at']})))
+                for r in rows
+            ])
+            c.executemany(SQL["delete_message"], [_bind("delete_message", (r['id'],)) for r in rows])
+            moved += len(rows)
+
+def _archive_tasks(older_than_days: int) -> int:
+    cutoff = (datetime.now() - timedelta(days=older_than_days)).isoformat()
+    moved = 0
+    while True:
+        with get_cursor() as c:
+            _execute(c, "tasks_to_archive", (cutoff, ARCHIVE_BATCH_SIZE))
+            rows = [dict(r) for r in c.fetchall()]
+            if not rows:
+                if moved:
+                    _data_changed()
+                return moved
+            archived_at = datetime.now().isoformat()
+            c.executemany(SQL["insert_task_archive"], [
+                _bind("insert_task_archive",
+                      (r['id'], r['goal_id'], r['status'], r['created_at'], r['updated_at'], archived_at, _pack(r)))
+                for r in rows
+            ])
+            c.executemany(SQL["delete_task"], [_bind("delete_task", (r['id'],)) for r in rows])
+            moved += len(rows)
+
+def archive_cold_rows(keep_recent_messages: int = ARCHIVE_KEEP_MESSAGES,
+                      task_age_days: int = ARCHIVE_TASKS_AFTER_DAYS) -> Dict[str, int]:
+    """Move summarized messages and old finished tasks into the archive tables."""
+    return {
+        "messages": _archive_messages(keep_recent_messages),
+        "tasks": _archive_tasks(task_age_days),
+    }
+
+def get_archive_stats() -> Dict[str, Any]:
+    """Row counts of the hot and archive tables, for the debug endpoint."""
+    with get_cursor(readonly=True) as c:
+        _execute(c, "archive_stats")
+        return dict(c.fetchone())
+
 
 # --- ANALYTICS FUNCTIONS ---
+# Aggregates are computed in SQL so tool calls only move counts and the
+# handful of rows they report on, never the whole tasks table.
+
+
+def _week_start() -> str:
+    return (datetime.now() - timedelta(days=datetime.now().weekday())).strftime("%Y-%m-%d")
+
+def _streaks_from_dates(dates: List[str]) -> Tuple[int, int]:
+    """
+    Given YYYY-MM-DD strings, return (current_streak, longest_streak).
+    The current streak ends today, or yesterday if today has no entry yet.
+    """
+    days = set()
+    for d in dates:
+        try:
+            days.add(datetime.strptime(d, "%Y-%m-%d").date())
+        except (ValueError, TypeError):
+            pass
+    if not days:
+        return 0, 0
+
+    today = datetime.now().date()
+    check = today if today in days else today - timedelta(days=1)
+    current = 0
+    while check in days:
+        current += 1
+        check -= timedelta(days=1)
+
+    longest = 0
+    streak = 0
+    prev = None
+    for d in sorted(days):
+        streak = streak + 1 if prev is not None and (d - prev).days == 1 else 1
+        longest = max(longest, streak)
+        prev = d
+    return current, longest
 
 def get_task_stats() -> Dict[str, Any]:
     """Compute task analytics: completion rates, overdue count, avg completion time."""
-    tasks = list_tasks(limit=10000)
-    today = datetime.now().strftime("%Y-%m-%d")
+    week_start = _week_start()
 
-    total = len(tasks)
-    done = [t for t in tasks if t['status'] == 'DONE']
-    todo = [t for t in tasks if t['status'] == 'TODO']
-    in_progress = [t for t in tasks if t['status'] == 'IN_PROGRESS']
-    blocked = [t for t in tasks if t['status'] == 'BLOCKED']
+    with get_cursor(readonly=True) as c:
+        _execute(c, "task_stats", (week_start,))
+        row = dict(c.fetchone())
 
-    # Overdue: tasks with due_date < today and not DONE/CANCELLED
-    overdue = []
-    for t in tasks:
-        if t['due_date'] and t['status'] not in ('DONE', 'CANCELLED'):
-            try:
-                if t['due_date'] < today:
-                    overdue.append(t)
-            except (TypeError, ValueError):
-                pass
-
-    # Completion rate
-    completed_or_active = [t for t in tasks if t['status'] in ('DONE', 'TODO', 'IN_PROGRESS', 'BLOCKED')]
-    completion_rate = round(len(done) / len(completed_or_active) * 100) if completed_or_active else 0
-
-    # Avg time to complete (created_at -> updated_at for DONE tasks)
-    completion_times = []
-    for t in done:
-        if t.get('created_at') and t.get('updated_at'):
-            try:
-                created = datetime.fromisoformat(t['created_at'])
-                updated = datetime.fromisoformat(t['updated_at'])
-                delta = (updated - created).total_seconds() / 3600  # hours
-                completion_times.append(delta)
-            except (ValueError, TypeError):
-                pass
-    avg_completion_hours = round(sum(completion_times) / len(completion_times), 1) if completion_times else None
+    return _task_stats(row, get_overdue_tasks())
 
-    # Tasks completed this week
-    week_start = (datetime.now() - timedelta(days=datetime.now().weekday())).strftime("%Y-%m-%d")
-    completed_this_week = sum(1 for t in done if t.get('updated_at', '') >= week_start)
+def _task_stats(row: Dict[str, Any], overdue: List[Dict[str, Any]]) -> Dict[str, Any]:
+    done = row['done'] or 0
+    tracked = row['tracked'] or 0
+    avg_hours = row['avg_completion_hours']
 
     return {
-        "total_tasks": total,
-        "done": len(done),
-        "todo": len(todo),
-        "in_progress": len(in_progress),
-        "blocked": len(blocked),
+        "total_tasks": row['total'] or 0,
+        "done": done,
+        "todo": row['todo'] or 0,
+        "in_progress": row['in_progress'] or 0,
+        "blocked": row['blocked'] or 0,
         "overdue": len(overdue),
         "overdue_tasks": [{"id": t['id'], "title": t['title'], "due_date": t['due_date']} for t in overdue],
-        "completion_rate": completion_rate,
-        "avg_completion_hours": avg_completion_hours,
-        "completed_this_week": completed_this_week,
+        "completion_rate": round(done / tracked * 100) if tracked else 0,
+        "avg_completion_hours": round(float(avg_hours), 1) if avg_hours is not None else None,
+        "completed_this_week": row['completed_this_week'] or 0,
     }
 
+def get_todays_tasks() -> List[Dict[str, Any]]:
+    """Return the tasks scheduled for today."""
+    today = datetime.now().strftime("%Y-%m-%d")
+    with get_cursor(readonly=True) as c:
+        _execute(c, "todays_tasks", (_day_value(today),))
+        return [dict(r) for r in c.fetchall()]
+
 def get_overdue_tasks() -> List[Dict[str, Any]]:
     """Return all tasks that are past their due_date and not DONE/CANCELLED."""
-    tasks = list_tasks(limit=10000)
     today = datetime.now().strftime("%Y-%m-%d")
-    overdue = []
-    for t in tasks:
-        if t['due_date'] and t['status'] not in ('DONE', 'CANCELLED'):
-            try:
-                if t['due_date'] < today:
-                    days_overdue = (datetime.now().date() - datetime.strptime(t['due_date'], "%Y-%m-%d").date()).days
-                    t['days_overdue'] = days_overdue
-                    overdue.append(t)
-            except (TypeError, ValueError):
-                pass
-    overdue.sort(key=lambda x: x.get('days_overdue', 0), reverse=True)
-    return overdue
+    with get_cursor(readonly=True) as c:
+        _execute(c, "overdue_tasks", (_day_value(today), _day_value(today)))
+        return [dict(r) for r in c.fetchall()]
 
 def get_goal_progress(goal_id: Optional[int] = None) -> List[Dict[str, Any]]:
     """Get progress for goals based on linked tasks."""
-    goals = list_goals()
-    tasks = list_tasks(limit=10000)
+    today = datetime.now().strftime("%Y-%m-%d")
+    with get_cursor(readonly=True) as c:
+        if goal_id:
+            _execute(c, "goal_progress_one", (_day_value(today), goal_id))
+        else:
+            _execute(c, "goal_progress", (_day_value(today),))
+        return _goal_progress([dict(r) for r in c.fetchall()])
 
+def _goal_progress(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     results = []
-    target_goals = [g for g in goals if g['id'] == goal_id] if goal_id else goals
-
-    for g in target_goals:
-        linked = [t for t in tasks if t.get('goal_id') == g['id']]
-        total = len(linked)
-        done = sum(1 for t in linked if t['status'] == 'DONE')
-        in_progress = sum(1 for t in linked if t['status'] == 'IN_PROGRESS')
-        blocked = sum(1 for t in linked if t['status'] == 'BLOCKED')
-        overdue = sum(1 for t in linked if t.get('due_date') and t['due_date'] < datetime.now().strftime("%Y-%m-%d") and t['status'] not in ('DONE', 'CANCELLED'))
-        pct = round(done / total * 100) if total > 0 else 0
-
+    for r in rows:
+        total = r['total_tasks'] or 0
+        done = r['done'] or 0
         results.append({
-            "goal_id": g['id'],
-            "title": g['title'],
+            "goal_id": r['goal_id'],
+            "title": r['title'],
             "total_tasks": total,
             "done": done,
-            "in_progress": in_progress,
-            "blocked": blocked,
-            "overdue": overdue,
-            "progress_pct": pct,
+            "in_progress": r['in_progress'] or 0,
+            "blocked": r['blocked'] or 0,
+            "overdue": r['overdue'] or 0,
+            "progress_pct": round(done / total * 100) if total > 0 else 0,
         })
     return results
 
 def get_rescheduled_tasks(threshold: int = 2) -> List[Dict[str, Any]]:
     """Identify tasks scheduled for past dates that are still TODO — likely rescheduled/postponed."""
-    tasks = list_tasks(limit=10000)
-    today = datetime.now().strftime("%Y-%m-%d")
-    postponed = []
-    for t in tasks:
-        if t['status'] == 'TODO' and t.get('scheduled_date') and t['scheduled_date'] != 'TODAY':
-            try:
-                if t['scheduled_date'] < today:
-                    days_postponed = (datetime.now().date() - datetime.strptime(t['scheduled_date'], "%Y-%m-%d").date()).days
-                    if days_postponed >= threshold:
-                        t['days_postponed'] = days_postponed
-                        postponed.append(t)
-            except (TypeError, ValueError):
-                pass
-    postponed.sort(key=lambda x: x.get('days_postponed', 0), reverse=True)
-    return postponed
+    today = datetime.now().date()
+    cutoff = (today - timedelta(days=threshold)).strftime("%Y-%m-%d")
+    today_str = today.strftime("%Y-%m-%d")
+    with get_cursor(readonly=True) as c:
+        _execute(c, "rescheduled_tasks", (_day_value(today_str), _day_value(today_str), _day_value(cutoff)))
+        return [dict(r) for r in c.fetchall()]
 
 def get_streak_data() -> Dict[str, Any]:
     """Compute consecutive days with at least one task completed."""
-    tasks = list_tasks(limit=10000)
-    done_tasks = [t for t in tasks if t['status'] == 'DONE' and t.get('updated_at')]
-
-    # Collect unique completion dates
-    done_dates = set()
-    for t in done_tasks:
-        try:
-            d = datetime.fromisoformat(t['updated_at']).strftime("%Y-%m-%d")
-            done_dates.add(d)
-        except (ValueError, TypeError):
-            pass
+    with get_cursor(readonly=True) as c:
+        _execute(c, "task_done_days")
+        done_dates = [r['day'] for r in c.fetchall()]
 
     if not done_dates:
         return {"current_streak": 0, "longest_streak": 0, "total_productive_days": 0}
 
-    sorted_dates = sorted(done_dates, reverse=True)
-
-    # Current streak
-    current_streak = 0
-    check_date = datetime.now().date()
-    for _ in range(365):
-        ds = check_date.strftime("%Y-%m-%d")
-        if ds in done_dates:
-            current_streak += 1
-            check_date -= timedelta(days=1)
-        elif current_streak == 0:
-            # Today not done yet — check yesterday
-            check_date -= timedelta(days=1)
-            continue
-        else:
-            break
-
-    # Longest streak
-    sorted_asc = sorted(done_dates)
-    longest = 1
-    streak = 1
-    for i in range(1, len(sorted_asc)):
-        prev = datetime.strptime(sorted_asc[i-1], "%Y-%m-%d").date()
-        curr = datetime.strptime(sorted_asc[i], "%Y-%m-%d").date()
-        if (curr - prev).days == 1:
-            streak += 1
-        else:
-            longest = max(longest, streak)
-            streak = 1
-    longest = max(longest, streak)
+    current_streak, longest = _streaks_from_dates(done_dates)
 
     return {
         "current_streak": current_streak,
@@ -1115,76 +2912,19 @@ def get_streak_data() -> Dict[str, Any]:
     }
 
 
-# --- WAKE CONTEXT (for proactive agent) ---
-
-def get_wake_context() -> Dict[str, Any]:
-    """Build a rich context payload for proactive wake-ups."""
-    today = datetime.now().strftime("%Y-%m-%d")
-    now_str = datetime.now().strftime("%Y-%m-%d %H:%M")
-    tasks = list_tasks(limit=10000)
-
-    # Today's tasks
-    todays_tasks = [t for t in tasks if t.get('scheduled_date') == today or t.get('scheduled_date') == 'TODAY']
-    todays_done = [t for t in todays_tasks if t['status'] == 'DONE']
-    todays_remaining = [t for t in todays_tasks if t['status'] not in ('DONE', 'CANCELLED')]
-
-    # Overdue tasks
-    overdue = get_overdue_tasks()
-
-    # Blocked tasks
-    blocked = [t for t in tasks if t['status'] == 'BLOCKED']
-
-    # Last user message time
-    last_user_time = None
-    with get_cursor() as c:
-        query = "SELECT created_at FROM messages WHERE role = 'user' ORDER BY id DESC LIMIT 1"
-        c.execute(query)
-        row = c.fetchone()
-        if row:
-            last_user_time = row['created_at']
-
-    hours_since_last_interaction = None
-    if last_user_time:
-        try:
-            last_dt = datetime.fromisoformat(last_user_time)
-            hours_since_last_interaction = round((datetime.now() - last_dt).total_seconds() / 3600, 1)
-        except (ValueError, TypeError):
-            pass
-
-    # Habit status
-    habit_streaks = get_habit_streaks()
-    habits_not_logged = [h for h in habit_streaks if not h['logged_today']]
-
-    # Postponed tasks
-    postponed = get_rescheduled_tasks(threshold=2)
-
-    # Weekly stats (useful for weekly planning heartbeat)
-    week_start = (datetime.now() - timedelta(days=datetime.now().weekday())).strftime("%Y-%m-%d")
-    completed_this_week = sum(
-        1 for t in tasks
-        if t['status'] == 'DONE' and t.get('updated_at', '') >= week_start
-    )
-
-    # Goal progress summary
-    goal_progress = get_goal_progress()
-
-    return {
-        "time": now_str,
-        "todays_scheduled": len(todays_tasks),
-        "todays_done": len(todays_done),
-        "todays_remaining": [{"id": t['id'], "title": t['title'], "priority": t['priority']} for t in todays_remaining],
-        "overdue_count": len(overdue),
-        "overdue_tasks": [{"id": t['id'], "title": t['title'], "due_date": t['due_date'], "days_overdue": t.get('days_overdue', 0)} for t in overdue[:5]],
-        "blocked_tasks": [{"id": t['id'], "title": t['title'], "blocker_reason": t.get('blocker_reason', '')} for t in blocked],
-        "hours_since_last_interaction": hours_since_last_interaction,
-        "habits_pending_today": [{"id": h['habit_id'], "title": h['title'], "current_streak": h['current_streak']} for h in habits_not_logged],
-        "postponed_tasks": [{"id": t['id'], "title": t['title'], "days_postponed": t.get('days_postponed', 0)} for t in postponed[:5]],
-        "completed_this_week": completed_this_week,
-        "goal_progress": [{"title": gp['title'], "progress_pct": gp['progress_pct'], "done": gp['done'], "total": gp['total_tasks']} for gp in goal_progress],
-    }
-
+# --- STATE SNAPSHOT ---
+# The prompt builder and the proactive wake-up both need the same picture of
+# the user's world. StateSnapshot reads it once, in a single read-only
+# transaction: today's tasks, the overdue/blocked/postponed lists and each
+# backlog status through their indexes, capped at SNAPSHOT_LIST_LIMIT rows,
+# and everything else as SQL aggregates. The cost stays flat however many
+# tasks a user has accumulated.
 
-# --- ENRICHED CONTEXT MARKDOWN ---
+# Rows per task list in the snapshot; the rest only show up in counts.
+SNAPSHOT_LIST_LIMIT = int(os.getenv("SNAPSHOT_LIST_LIMIT", "50"))
+# Completed tasks listed in the context markdown.
+SNAPSHOT_DONE_SHOWN = 20
+_BACKLOG_STATUSES = ("IN_PROGRESS", "TODO", "DONE", "CANCELLED")
 
 def _urgency_tag(due_date_str: str) -> str:
     """Return an urgency label based on how close the deadline is."""
@@ -1206,157 +2946,314 @@ def _urgency_tag(due_date_str: str) -> str:
     except (ValueError, TypeError):
         return ""
 
-def get_context_markdown() -> str:
-    goals = list_goals()
-    tasks = list_tasks(limit=10000)
-    habits = list_habits(active_only=True)
-    habit_streak_data = get_habit_streaks()
-    profile = get_profile()
-
-    today_date = datetime.now().strftime("%Y-%m-%d")
-
-    md_output = f"## CURRENT STATE ({today_date})\n\n"
-
-    # --- User Profile ---
-    if profile:
-        md_output += "### USER PROFILE\n"
-        for k, v in profile.items():
-            md_output += f"- **{k}**: {v}\n"
-        md_output += "\n"
-
-    # --- Goals with Progress ---
-    md_output += "### ACTIVE GOALS\n"
-    if not goals:
-        md_output += "- No active goals yet.\n"
-    else:
-        goal_progress = get_goal_progress()
-        progress_map = {gp['goal_id']: gp for gp in goal_progress}
-        for g in goals:
-            notes = f" | Notes: {g['notes']}" if g['notes'] else ""
-            gp = progress_map.get(g['id'])
-            if gp and gp['total_tasks'] > 0:
-                bar_fill = round(gp['progress_pct'] / 10)
-                bar = "=" * bar_fill + "-" * (10 - bar_fill)
-                progress_str = f" [{bar}] {gp['progress_pct']}% ({gp['done']}/{gp['total_tasks']} tasks)"
-                if gp['overdue'] > 0:
-                    progress_str += f" | {gp['overdue']} overdue"
-                if gp['blocked'] > 0:
-                    progress_str += f" | {gp['blocked']} blocked"
+class StateSnapshot:
+    """
+    Point-in-time view of tasks, goals, habit streaks and profile.
+    Use StateSnapshot.load() to read everything in one transaction.
+    """
+
+    def __init__(self, todays: List[Dict[str, Any]], overdue: List[Dict[str, Any]], overdue_count: int,
+                 blocked: List[Dict[str, Any]], postponed: List[Dict[str, Any]],
+                 backlog: Dict[str, List[Dict[str, Any]]], backlog_hidden: Dict[str, int], stats: Dict[str, Any],
+                 goal_progress: List[Dict[str, Any]], goals: List[Dict[str, Any]],
+                 habit_streaks: List[Dict[str, Any]], profile: Dict[str, str],
+                 last_user_message_at: Optional[str] = None, now: Optional[datetime] = None):
+        self._todays = todays
+        self._overdue = overdue
+        self.overdue_count = overdue_count
+        self._blocked = blocked
+        self._postponed = postponed
+        self._backlog = backlog
+        self._backlog_hidden = backlog_hidden
+        self.stats = stats
+        self._goal_progress = goal_progress
+        self.goals = goals
+        self._habit_streaks = habit_streaks
+        self.profile = profile
+        self.last_user_message_at = last_user_message_at
+        self.now = now or datetime.now()
+        self.today = self.now.date()
+        self.today_str = self.today.strftime("%Y-%m-%d")
+
+    @classmethod
+    def load(cls) -> "StateSnapshot":
+        now = datetime.now()
+        today = _day_value(now.strftime("%Y-%m-%d"))
+        postponed_cutoff = _day_value((now.date() - timedelta(days=2)).strftime("%Y-%m-%d"))
+        week_start = (now - timedelta(days=now.weekday())).strftime("%Y-%m-%d")
+        limit = SNAPSHOT_LIST_LIMIT
+        with get_cursor(readonly=True) as c:
+            if DATABASE_URL:
+                c.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY")
             else:
-                progress_str = " (no linked tasks)"
-            md_output += f"- [ID: {g['id']}] **{g['title']}**: {g['description']}{progress_str}{notes}\n"
-
-    # --- Goal-Task Alignment ---
-    active_tasks = [t for t in tasks if t['status'] not in ('DONE', 'CANCELLED')]
-    if active_tasks:
-        linked = sum(1 for t in active_tasks if t.get('goal_id'))
-        unlinked = len(active_tasks) - linked
-        md_output += f"\n**Alignment**: {linked}/{len(active_tasks)} active tasks linked to goals"
-        if unlinked > 0:
-            md_output += f" — {unlinked} unlinked (potential drift)"
-        md_output += "\n"
-
-    md_output += "\n---\n"
-
-    # --- Habits ---
-    if habits:
-        md_output += "### HABITS\n"
-        for hs in habit_streak_data:
-            logged_icon = "done" if hs['logged_today'] else "NOT DONE"
-            streak_str = f"Streak: {hs['current_streak']}d" if hs['current_streak'] > 0 else "No streak"
-            md_output += f"- [ID: {hs['habit_id']}] **{hs['title']}** ({hs['frequency']}) | Today: {logged_icon} | {streak_str} | Best: {hs['longest_streak']}d | Rate: {hs['completion_rate']}%\n"
-        md_output += "\n---\n"
+                c.execute("BEGIN")
+
+            def rows(name: str, params: Sequence[Any] = ()) -> List[Dict[str, Any]]:
+                _execute(c, name, params)
+                return [dict(r) for r in c.fetchall()]
+
+            todays = rows("todays_tasks", (today,))
+            overdue = rows("overdue_tasks_limited", (today, today, limit))
+            overdue_count = rows("overdue_count", (today,))[0]['overdue']
+            blocked = rows("list_tasks_by_status", ("BLOCKED", limit))
+            postponed = rows("rescheduled_tasks_limited", (today, today, postponed_cutoff, limit))
+            stats = rows("task_stats", (week_start,))[0]
+            # The backlog leaves out tasks already listed above, so it reads
+            # enough rows that those can't crowd out the ones it shows.
+            listed = {t['id']: t['status'] for t in todays + overdue + blocked}
+            backlog, backlog_hidden = {}, {}
+            for status in _BACKLOG_STATUSES:
+                loaded = rows("list_tasks_by_status", (status, limit + len(listed)))
+                backlog[status] = [t for t in loaded if t['id'] not in listed][:limit]
+                elsewhere = sum(1 for s in listed.values() if s == status)
+                backlog_hidden[status] = max(0, (stats[status.lower()] or 0) - elsewhere - len(backlog[status]))
+            goal_progress = _goal_progress(rows("goal_progress", (today,)))
+            goals = rows("list_goals")
+            profile = {r['key']: r['value'] for r in rows("get_profile")}
+            habit_streaks = _fetch_habit_streaks(c)
+            last = rows("last_user_message_at")
+            last_user_message_at = last[0]['created_at'] if last else None
+
+        return cls(todays, overdue, overdue_count, blocked, postponed, backlog, backlog_hidden, stats, goal_progress,
+                   goals, habit_streaks, profile, last_user_message_at, now)
+
+    # --- Derived views ---
+
+    def todays_tasks(self) -> List[Dict[str, Any]]:
+        """Same rows as get_todays_tasks() ('TODAY' is resolved to a date when tasks are written)."""
+        return self._todays
+
+    def blocked_tasks(self) -> List[Dict[str, Any]]:
+        """The most recently created blocked tasks."""
+        return self._blocked
+
+    def overdue_tasks(self) -> List[Dict[str, Any]]:
+        """The first rows of get_overdue_tasks(); overdue_count has the total."""
+        return self._overdue
+
+    def rescheduled_tasks(self) -> List[Dict[str, Any]]:
+        """The first rows of get_rescheduled_tasks(2)."""
+        return self._postponed
+
+    def backlog(self, status: str) -> List[Dict[str, Any]]:
+        """The most recently created tasks in `status` not already listed as today's, overdue or blocked."""
+        return self._backlog[status]
+
+    def backlog_more(self, status: str) -> int:
+        """Tasks in `status` (archive included) listed nowhere in the snapshot."""
+        return self._backlog_hidden[status]
+
+    def completed_this_week(self) -> int:
+        return self.stats['completed_this_week'] or 0
+
+    def goal_progress(self) -> List[Dict[str, Any]]:
+        """Same shape as get_goal_progress()."""
+        return self._goal_progress
+
+    def habit_streaks(self) -> List[Dict[str, Any]]:
+        """Same shape as get_habit_streaks() — computed in SQL at load time."""
+        return self._habit_streaks
+
+    def task_stats(self) -> Dict[str, Any]:
+        """Same shape as get_task_stats(), listing only the loaded overdue tasks."""
+        return {**_task_stats(self.stats, self._overdue), "overdue": self.overdue_count}
+
+    def hours_since_last_interaction(self) -> Optional[float]:
+        if not self.last_user_message_at:
+            return None
+        try:
+            last_dt = datetime.fromisoformat(self.last_user_message_at)
+            return round((self.now - last_dt).total_seconds() / 3600, 1)
+        except (ValueError, TypeError):
+            return None
+
+    def wake_context(self) -> Dict[str, Any]:
+        """Build a rich context payload for proactive wake-ups."""
+        todays_tasks = self.todays_tasks()
+        todays_done = [t for t in todays_tasks if t['status'] == 'DONE']
+        todays_remaining = [t for t in todays_tasks if t['status'] not in ('DONE', 'CANCELLED')]
+        overdue = self.overdue_tasks()
+        habits_not_logged = [h for h in self.habit_streaks() if not h['logged_today']]
+        postponed = self.rescheduled_tasks()
+
+        return {
+            "time": self.now.strftime("%Y-%m-%d %H:%M"),
+            "todays_scheduled": len(todays_tasks),
+            "todays_done": len(todays_done),
+            "todays_remaining": [{"id": t['id'], "title": t['title'], "priority": t['priority']} for t in todays_remaining],
+            "overdue_count": self.overdue_count,
+            "overdue_tasks": [{"id": t['id'], "title": t['title'], "due_date": t['due_date'], "days_overdue": t.get('days_overdue', 0)} for t in overdue[:5]],
+            "blocked_tasks": [{"id": t['id'], "title": t['title'], "blocker_reason": t.get('blocker_reason', '')} for t in self.blocked_tasks()],
+            "hours_since_last_interaction": self.hours_since_last_interaction(),
+            "habits_pending_today": [{"id": h['habit_id'], "title": h['title'], "current_streak": h['current_streak']} for h in habits_not_logged],
+            "postponed_tasks": [{"id": t['id'], "title": t['title'], "days_postponed": t.get('days_postponed', 0)} for t in postponed[:5]],
+            "completed_this_week": self.completed_this_week(),
+            "goal_progress": [{"title": gp['title'], "progress_pct": gp['progress_pct'], "done": gp['done'], "total": gp['total_tasks']} for gp in self.goal_progress()],
+        }
+
+    def to_markdown(self) -> str:
+        goals = self.goals
+        profile = self.profile
+        today_date = self.today_str
+
+        md_output = f"## CURRENT STATE ({today_date})\n\n"
+
+        # --- User Profile ---
+        if profile:
+            md_output += "### USER PROFILE\n"
+            for k, v in profile.items():
+                md_output += f"- **{k}**: {v}\n"
+            md_output += "\n"
+
+        # --- Goals with Progress ---
+        md_output += "### ACTIVE GOALS\n"
+        if not goals:
+            md_output += "- No active goals yet.\n"
+        else:
+            progress_map = {gp['goal_id']: gp for gp in self.goal_progress()}
+            for g in goals:
+                notes = f" | Notes: {g['notes']}" if g['notes'] else ""
+                gp = progress_map.get(g['id'])
+                if gp and gp['total_tasks'] > 0:
+                    bar_fill = round(gp['progress_pct'] / 10)
+                    bar = "=" * bar_fill + "-" * (10 - bar_fill)
+                    progress_str = f" [{bar}] {gp['progress_pct']}% ({gp['done']}/{gp['total_tasks']} tasks)"
+                    if gp['overdue'] > 0:
+                        progress_str += f" | {gp['overdue']} overdue"
+                    if gp['blocked'] > 0:
+                        progress_str += f" | {gp['blocked']} blocked"
+                else:
+                    progress_str = " (no linked tasks)"
+                md_output += f"- [ID: {g['id']}] **{g['title']}**: {g['description']}{progress_str}{notes}\n"
+
+        # --- Goal-Task Alignment ---
+        active = self.stats['active'] or 0
+        if active:
+            linked = self.stats['active_linked'] or 0
+            unlinked = active - linked
+            md_output += f"\n**Alignment**: {linked}/{active} active tasks linked to goals"
+            if unlinked > 0:
+                md_output += f" — {unlinked} unlinked (potential drift)"
+            md_output += "\n"
 
-    # --- Today's Signal ---
-    todays_tasks = [t for t in tasks if t['scheduled_date'] == today_date or t['scheduled_date'] == 'TODAY']
+        md_output += "\n---\n"
 
-    md_output += "### TODAY'S SIGNAL (Focus List)\n"
-    if not todays_tasks:
-        md_output += "*No tasks explicitly scheduled for today yet. Access the backlog to pick your battles.*\n"
-    else:
-        done_today = sum(1 for t in todays_tasks if t['status'] == 'DONE')
-        md_output += f"*Progress: {done_today}/{len(todays_tasks)} complete*\n"
-        for t in todays_tasks:
-            status_icon = "[DONE]" if t['status'] == 'DONE' else ("[BLOCKED]" if t['status'] == 'BLOCKED' else "[ ]")
-            urgency = ""
-            if t.get('due_date'):
-                urgency_tag = _urgency_tag(t['due_date'])
-                if urgency_tag:
-                    urgency = f" **{urgency_tag}**"
-            md_output += f"{status_icon} [ID: {t['id']}] **{t['title']}** (Priority: {t['priority']}){urgency}\n"
-
-    # --- Overdue ---
-    overdue = get_overdue_tasks()
-    if overdue:
-        md_output += "\n### OVERDUE\n"
-        for t in overdue:
-            md_output += f"- [ID: {t['id']}] **{t['title']}** — {t.get('days_overdue', '?')} days overdue (Due: {t['due_date']})\n"
-
-    # --- Blocked ---
-    blocked_tasks = [t for t in tasks if t['status'] == 'BLOCKED']
-    if blocked_tasks:
-        md_output += "\n### BLOCKED (needs attention)\n"
-        for t in blocked_tasks:
-            # Compute how long it's been blocked
-            blocked_days = ""
-            if t.get('updated_at'):
-                try:
-                    updated = datetime.fromisoformat(t['updated_at'])
-                    days = (datetime.now() - updated).days
-                    if days > 0:
-                        blocked_days = f" | blocked for {days}d"
-                except (ValueError, TypeError):
-                    pass
-            md_output += f"- [ID: {t['id']}] **{t['title']}** — Reason: {t.get('blocker_reason', 'Unknown')}{blocked_days}\n"
-
-    # --- Backlog ---
-    md_output += "\n### FULL BACKLOG\n"
-
-    today_ids = set(t['id'] for t in todays_tasks)
-    overdue_ids = set(t['id'] for t in overdue)
-    blocked_ids = set(t['id'] for t in blocked_tasks)
-    exclude_ids = today_ids | overdue_ids | blocked_ids
-    other_tasks = [t for t in tasks if t['id'] not in exclude_ids]
-
-    if not other_tasks:
-        md_output += "- No other tasks found.\n"
-    else:
-        in_progress = [t for t in other_tasks if t['status'] == 'IN_PROGRESS']
-        todo = [t for t in other_tasks if t['status'] == 'TODO']
-        done = [t for t in other_tasks if t['status'] == 'DONE']
-        cancelled = [t for t in other_tasks if t['status'] == 'CANCELLED']
-
-        if in_progress:
-            md_output += "**In Progress**:\n"
-            for t in in_progress:
-                urgency = ""
-                if t.get('due_date'):
-                    tag = _urgency_tag(t['due_date'])
-                    if tag:
-                        urgency = f" **{tag}**"
-                md_output += f"- [ID: {t['id']}] {t['title']} (Due: {t['due_date'] or 'None'}){urgency}\n"
-
-        if todo:
-            md_output += "**To Do**:\n"
-            for t in todo:
+        # --- Habits ---
+        if self._habit_streaks:
+            md_output += "### HABITS\n"
+            for hs in self.habit_streaks():
+                logged_icon = "done" if hs['logged_today'] else "NOT DONE"
+                streak_str = f"Streak: {hs['current_streak']}d" if hs['current_streak'] > 0 else "No streak"
+                md_output += f"- [ID: {hs['habit_id']}] **{hs['title']}** ({hs['frequency']}) | Today: {logged_icon} | {streak_str} | Best: {hs['longest_streak']}d | Rate: {hs['completion_rate']}%\n"
+            md_output += "\n---\n"
+
+        # --- Today's Signal ---
+        todays_tasks = self.todays_tasks()
+
+        md_output += "### TODAY'S SIGNAL (Focus List)\n"
+        if not todays_tasks:
+            md_output += "*No tasks explicitly scheduled for today yet. Access the backlog to pick your battles.*\n"
+        else:
+            done_today = sum(1 for t in todays_tasks if t['status'] == 'DONE')
+            md_output += f"*Progress: {done_today}/{len(todays_tasks)} complete*\n"
+            for t in todays_tasks:
+                status_icon = "[DONE]" if t['status'] == 'DONE' else ("[BLOCKED]" if t['status'] == 'BLOCKED' else "[ ]")
                 urgency = ""
                 if t.get('due_date'):
-                    tag = _urgency_tag(t['due_date'])
-                    if tag:
-                        urgency = f" **{tag}**"
-                md_output += f"- [ID: {t['id']}] {t['title']} (Due: {t['due_date'] or 'None'}, Sched: {t['scheduled_date'] or 'None'}){urgency}\n"
+                    urgency_tag = _urgency_tag(t['due_date'])
+                    if urgency_tag:
+                        urgency = f" **{urgency_tag}**"
+                md_output += f"{status_icon} [ID: {t['id']}] **{t['title']}** (Priority: {t['priority']}){urgency}\n"
+
+        # --- Overdue ---
+        overdue = self.overdue_tasks()
+        if overdue:
+            md_output += "\n### OVERDUE\n"
+            for t in overdue:
+                md_output += f"- [ID: {t['id']}] **{t['title']}** — {t.get('days_overdue', '?')} days overdue (Due: {t['due_date']})\n"
+            if self.overdue_count > len(overdue):
+                md_output += f"- ... and {self.overdue_count - len(overdue)} more overdue tasks\n"
+
+        # --- Blocked ---
+        blocked_tasks = self.blocked_tasks()
+        if blocked_tasks:
+            md_output += "\n### BLOCKED (needs attention)\n"
+            for t in blocked_tasks:
+                # Compute how long it's been blocked
+                blocked_days = ""
+                if t.get('updated_at'):
+                    try:
+                        updated = datetime.fromisoformat(t['updated_at'])
+                        days = (self.now - updated).days
+                        if days > 0:
+                            blocked_days = f" | blocked for {days}d"
+                    except (ValueError, TypeError):
+                        pass
+                md_output += f"- [ID: {t['id']}] **{t['title']}** — Reason: {t.get('blocker_reason', 'Unknown')}{blocked_days}\n"
+            blocked_total = self.stats['blocked'] or 0
+            if blocked_total > len(blocked_tasks):
+                md_output += f"- ... and {blocked_total - len(blocked_tasks)} more blocked tasks\n"
+
+        # --- Backlog ---
+        md_output += "\n### FULL BACKLOG\n"
+
+        def more(status: str, noun: str, shown: int) -> str:
+            hidden = len(self.backlog(status)) - shown + self.backlog_more(status)
+            return f"- ... and {hidden} more {noun}\n" if hidden > 0 else ""
+
+        if not any(self.backlog(status) for status in _BACKLOG_STATUSES):
+            md_output += "- No other tasks found.\n"
+        else:
+            in_progress = self.backlog('IN_PROGRESS')
+            todo = self.backlog('TODO')
+            done = self.backlog('DONE')
+            cancelled = self.backlog('CANCELLED')
+
+            if in_progress:
+                md_output += "**In Progress**:\n"
+                for t in in_progress:
+                    urgency = ""
+                    if t.get('due_date'):
+                        tag = _urgency_tag(t['due_date'])
+                        if tag:
+                            urgency = f" **{tag}**"
+                    md_output += f"- [ID: {t['id']}] {t['title']} (Due: {t['due_date'] or 'None'}){urgency}\n"
+                md_output += more('IN_PROGRESS', "tasks in progress", len(in_progress))
+
+            if todo:
+                md_output += "**To Do**:\n"
+                for t in todo:
+                    urgency = ""
+                    if t.get('due_date'):
+                        tag = _urgency_tag(t['due_date'])
+                        if tag:
+                            urgency = f" **{tag}**"
+                    md_output += f"- [ID: {t['id']}] {t['title']} (Due: {t['due_date'] or 'None'}, Sched: {t['scheduled_date'] or 'None'}){urgency}\n"
+                md_output += more('TODO', "tasks to do", len(todo))
+
+            if done:
+                md_output += "**Completed (History)**:\n"
+                for t in done[:SNAPSHOT_DONE_SHOWN]:  # Limit history noise
+                    md_output += f"- [ID: {t['id']}] {t['title']}\n"
+                md_output += more('DONE', "completed tasks", min(len(done), SNAPSHOT_DONE_SHOWN))
+
+            if cancelled:
+                md_output += "**Cancelled**:\n"
+                for t in cancelled:
+                    md_output += f"- [ID: {t['id']}] {t['title']}\n"
+                md_output += more('CANCELLED', "cancelled tasks", len(cancelled))
+
+        return md_output
 
-        if done:
-            md_output += "**Completed (History)**:\n"
-            for t in done[:20]:  # Limit history noise
-                md_output += f"- [ID: {t['id']}] {t['title']}\n"
-            if len(done) > 20:
-                md_output += f"- ... and {len(done) - 20} more completed tasks\n"
 
-        if cancelled:
-            md_output += "**Cancelled**:\n"
-            for t in cancelled:
-                md_output += f"- [ID: {t['id']}] {t['title']}\n"
+# --- WAKE CONTEXT (for proactive agent) ---
+
+def get_wake_context() -> Dict[str, Any]:
+    """Build a rich context payload for proactive wake-ups."""
+    return StateSnapshot.load().wake_context()
 
-    return md_output
 
+# --- ENRICHED CONTEXT MARKDOWN ---
+
+def get_context_markdown() -> str:
+    return StateSnapshot.load().to_markdown()
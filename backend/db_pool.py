@@ -0,0 +1,473 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+# Tunables for SQLite connections. Defaults suit a small self-hosted box;
+# override through the environment when the database outgrows them.
+SQLITE_CACHE_KIB = int(os.getenv("SQLITE_CACHE_KIB", "20000"))         # page cache per connection
+SQLITE_MMAP_BYTES = int(os.getenv("SQLITE_MMAP_BYTES", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_IDLE_READERS = int(os.getenv("SQLITE_IDLE_READERS", "4"))        # idle reader connections kept per pool
+
+
+class SQLitePool:
+    """
+    Long-lived SQLite connections for one database file.
+
+    - One writer connection, shared across threads and serialised by a lock.
+      SQLite only allows a single writer at a time anyway; holding the lock in
+      Python avoids busy-waiting inside the driver.
+    - Reader connections checked out per cursor block and returned afterwards.
+      Up to `idle_readers` stay open between uses; extra ones opened under a
+      burst of concurrent reads are closed on return, so the number of open
+      readers follows concurrency rather than the number of threads that ever
+      read. In WAL mode readers never block the writer or each other.
+
+    Pragmas are applied once when a connection is opened, not per call.
+    """
+
+    def __init__(self, path: str, idle_readers: int = SQLITE_IDLE_READERS):
+        self.path = path
+        self.idle_readers = idle_readers
+        self._writer = None
+        self._writer_lock = threading.RLock()
+        self._registry_lock = threading.Lock()
+        self._readers: List[sqlite3.Connection] = []    # every open reader, idle or checked out
+        self._idle: Deque[sqlite3.Connection] = deque()
+        self._closed = False
+
+        self._connects = 0
+        self._reads = 0
+        self._writes = 0
+        self._write_wait_total = 0.0
+        self._write_wait_max = 0.0
+
+    def _connect(self, readonly: bool) -> sqlite3.Connection:
+        # A reader is used by one thread at a time but not always the same one,
+        # and close() may run on another thread, so the same-thread check is off.
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+        conn.row_factory = sqlite3.Row
+        if not readonly:
+            # Persistent on the file; only the writer needs to set it.
+            conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_KIB}")
+        conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_BYTES}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        if readonly:
+            conn.execute("PRAGMA query_only=ON")
+        with self._registry_lock:
+            self._connects += 1
+        return conn
+
+    def acquire_reader(self) -> sqlite3.Connection:
+        """An idle reader connection, or a new one. Pair with release_reader()."""
+        if self._closed:
+            raise RuntimeError(f"SQLite pool for {self.path} is closed")
+        with self._registry_lock:
+            self._reads += 1
+            if self._idle:
+                # Most recently used first: its page cache is the warmest.
+                return self._idle.pop()
+        conn = self._connect(readonly=True)
+        with self._registry_lock:
+            self._readers.append(conn)
+        return conn
+
+    def release_reader(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            conn.rollback()
+        with self._registry_lock:
+            keep = not self._closed and len(self._idle) < self.idle_readers
+            if keep:
+                self._idle.append(conn)
+            elif conn in self._readers:
+                self._readers.remove(conn)
+        if not keep:
+            conn.close()
+
+    def acquire_writer(self) -> sqlite3.Connection:
+        """Lock and return the writer connection. Pair with release_writer()."""
+        if self._closed:
+            raise RuntimeError(f"SQLite pool for {self.path} is closed")
+        started = time.perf_counter()
+        self._writer_lock.acquire()
+        waited = time.perf_counter() - started
+        try:
+            if self._writer is None:
+                self._writer = self._connect(readonly=False)
+        except Exception:
+            self._writer_lock.release()
+            raise
+        with self._registry_lock:
+            self._writes += 1
+            self._write_wait_total += waited
+            self._write_wait_max = max(self._write_wait_max, waited)
+        return self._writer
+
+    def release_writer(self, conn: sqlite3.Connection):
+        if conn.in_transaction:
+            # Never hand the next caller a half-finished transaction.
+            conn.rollback()
+        self._writer_lock.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._registry_lock:
+            return {
+                "path": self.path,
+                "reader_connections": len(self._readers),
+                "idle_readers": len(self._idle),
+                "writer_open": self._writer is not None,
+                "connections_opened": self._connects,
+                "read_checkouts": self._reads,
+                "write_checkouts": self._writes,
+                "write_wait_ms_total": round(self._write_wait_total * 1000, 2),
+                "write_wait_ms_max": round(self._write_wait_max * 1000, 2),
+            }
+
+    def close(self):
+        """Close every connection. Checked-out readers are closed too, so this is
+        only safe when no thread is using the pool: at shutdown, or when an idle
+        pool is evicted from a SQLitePoolCache."""
+        self._closed = True
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._registry_lock:
+            readers, self._readers = self._readers, []
+            self._idle.clear()
+        for conn in readers:
+            conn.close()
+
+
+TENANT_POOL_MAX = int(os.getenv("TENANT_POOL_MAX", "64"))   # tenant databases kept open at once
+
+
+class SQLitePoolCache:
+    """
+    SQLitePools for many database files (one per tenant), least recently used
+    first out.
+
+    A pool is checked out for the length of one cursor block and checked back
+    in afterwards. Only pools nobody has checked out are evicted, so when every
+    open pool is busy the cache briefly grows past `capacity` instead of
+    closing a connection under a running query.
+    """
+
+    def __init__(self, capacity: int = TENANT_POOL_MAX):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._pools: "OrderedDict[str, SQLitePool]" = OrderedDict()
+        self._in_use: Dict[str, int] = {}
+
+        self._opens = 0
+        self._evictions = 0
+
+    def checkout(self, path: str) -> SQLitePool:
+        """The pool for `path`, opened if needed. Pair with checkin()."""
+        evicted = []
+        with self._lock:
+            pool = self._pools.get(path)
+            if pool is None:
+                pool = self._pools[path] = SQLitePool(path)
+                self._opens += 1
+            self._pools.move_to_end(path)
+            self._in_use[path] = self._in_use.get(path, 0) + 1
+            for key in list(self._pools):
+                if len(self._pools) <= self.capacity:
+                    break
+                if not self._in_use.get(key):
+                    evicted.append(self._pools.pop(key))
+                    self._evictions += 1
+        for old in evicted:
+            old.close()
+        return pool
+
+    def checkin(self, pool: SQLitePool):
+        with self._lock:
+            count = self._in_use.get(pool.path, 0) - 1
+            if count > 0:
+                self._in_use[pool.path] = count
+            else:
+                self._in_use.pop(pool.path, None)
+
+    def get(self, path: str) -> Optional[SQLitePool]:
+        """The open pool for `path`, without checking it out."""
+        with self._lock:
+            return self._pools.get(path)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "open_pools": len(self._pools),
+                "capacity": self.capacity,
+                "in_use": sum(1 for count in self._in_use.values() if count),
+                "pools_opened": self._opens,
+                "evictions": self._evictions,
+            }
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), OrderedDict()
+            self._in_use.clear()
+        for pool in pools:
+            pool.close()
+
+
+# --- POSTGRES ---
+
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))              # seconds to wait for a free slot
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800"))  # recycle connections after this many seconds
+DB_POOL_PING_AFTER_IDLE = float(os.getenv("DB_POOL_PING_AFTER_IDLE", "30"))  # ping on checkout if idle this long
+
+
+class PoolTimeoutError(RuntimeError):
+    """No connection became available within the pool's wait timeout."""
+
+
+class _Slot:
+    __slots__ = ("conn", "created_at", "last_used", "info")
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+        self.info: Dict[str, Any] = {}
+
+
+class _Waiter:
+    __slots__ = ("event", "slot", "may_open")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.slot = None
+        self.may_open = False
+
+
+class PostgresPool:
+    """
+    Thread-safe connection pool with bounded size and wait timeouts.
+
+    Unlike psycopg2's SimpleConnectionPool this is safe to share between
+    FastAPI's threadpool and the DB executor. It also:
+    - checks connections on checkout. Closed ones are replaced, and ones
+      idle longer than ping_after_idle get a SELECT 1;
+    - recycles connections older than max_lifetime when they are returned;
+    - blocks up to `timeout` seconds when all maxconn connections are
+      checked out, then raises PoolTimeoutError;
+    - keeps counters (checked out, waits, wait time, failures) for sizing
+      max connections against Cloud Run concurrency.
+    """
+
+    def __init__(self, connect: Callable[[], Any], minconn: int = DB_POOL_MIN, maxconn: int = DB_POOL_MAX,
+                 timeout: float = DB_POOL_TIMEOUT, max_lifetime: float = DB_POOL_MAX_LIFETIME,
+                 ping_after_idle: float = DB_POOL_PING_AFTER_IDLE):
+        if maxconn < 1 or minconn < 0 or minconn > maxconn:
+            raise ValueError(f"invalid pool bounds min={minconn} max={maxconn}")
+        self._connect = connect
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.ping_after_idle = ping_after_idle
+
+        self._lock = threading.Lock()
+        self._idle: List[_Slot] = []          # LIFO: the warmest connection is reused first
+        self._in_use: Dict[int, _Slot] = {}
+        self._waiters: Deque[_Waiter] = deque()
+        self._opening = 0
+        self._closed = False
+
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+        self._connect_failures = 0
+        self._healthcheck_failures = 0
+        self._recycled = 0
+
+        for _ in range(minconn):
+            self._idle.append(self._open())
+
+    def _open(self) -> _Slot:
+        try:
+            return _Slot(self._connect())
+        except Exception:
+            with self._lock:
+                self._connect_failures += 1
+            raise
+
+    def _total(self) -> int:
+        return len(self._idle) + len(self._in_use) + self._opening
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _healthy(self, slot: _Slot) -> bool:
+        if getattr(slot.conn, "closed", False):
+            return False
+        if time.monotonic() - slot.last_used < self.ping_after_idle:
+            return True
+        try:
+            cur = slot.conn.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            cur.close()
+            slot.conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _release_capacity(self):
+        """A connection went away: let the longest waiter open a replacement. Call with the lock held."""
+        if self._waiters:
+            waiter = self._waiters.popleft()
+            waiter.may_open = True
+            self._opening += 1
+            waiter.event.set()
+
+    def getconn(self):
+        started = time.perf_counter()
+        waiter = None
+        slot = None
+        must_open = False
+
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("connection pool is closed")
+            # Waiters are served first-come first-served: a newcomer never
+            # takes a connection ahead of a thread that is already queued.
+            if self._idle and not self._waiters:
+                slot = self._idle.pop()
+            elif self._total() < self.maxconn and not self._waiters:
+                self._opening += 1
+                must_open = True
+            else:
+                waiter = _Waiter()
+                self._waiters.append(waiter)
+
+        if waiter is not None:
+            waiter.event.wait(self.timeout)
+            with self._lock:
+                if not waiter.event.is_set():
+                    self._waiters.remove(waiter)
+                    self._timeouts += 1
+                    raise PoolTimeoutError(
+                        f"no database connection free after {self.timeout}s "
+                        f"({len(self._in_use)} checked out)"
+                    )
+            if self._closed and waiter.slot is None and not waiter.may_open:
+                raise RuntimeError("connection pool is closed")
+            slot, must_open = waiter.slot, waiter.may_open
+
+        if slot is not None and not self._healthy(slot):
+            self._close_quietly(slot.conn)
+            with self._lock:
+                self._healthcheck_failures += 1
+                # Keep the capacity we were handed and open a fresh connection with it.
+                self._opening += 1
+            slot, must_open = None, True
+
+        if must_open:
+            try:
+                slot = self._open()
+            except Exception:
+                with self._lock:
+                    self._opening -= 1
+                    self._release_capacity()
+                raise
+            with self._lock:
+                self._opening -= 1
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._in_use[id(slot.conn)] = slot
+            self._checkouts += 1
+            if waiter is not None:
+                self._waits += 1
+                self._wait_total += elapsed
+                self._wait_max = max(self._wait_max, elapsed)
+        return slot.conn
+
+    def putconn(self, conn, close: bool = False):
+        with self._lock:
+            slot = self._in_use.pop(id(conn), None)
+        if slot is None:
+            # Not ours (or already returned) — don't let it leak.
+            self._close_quietly(conn)
+            return
+
+        expired = time.monotonic() - slot.created_at > self.max_lifetime
+        if not close and not expired and not getattr(conn, "closed", False):
+            try:
+                # No round trip unless a transaction is actually open.
+                conn.rollback()
+            except Exception:
+                close = True
+        else:
+            close = True
+
+        with self._lock:
+            if close or self._closed:
+                if expired:
+                    self._recycled += 1
+                self._close_quietly(conn)
+                if not self._closed:
+                    self._release_capacity()
+            elif self._waiters:
+                slot.last_used = time.monotonic()
+                waiter = self._waiters.popleft()
+                waiter.slot = slot
+                waiter.event.set()
+            else:
+                slot.last_used = time.monotonic()
+                self._idle.append(slot)
+
+    def info(self, conn) -> Dict[str, Any]:
+        """Per-connection scratch space that lives as long as the connection."""
+        with self._lock:
+            slot = self._in_use.get(id(conn))
+        return slot.info if slot is not None else {}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "min": self.minconn,
+                "max": self.maxconn,
+                "open": len(self._idle) + len(self._in_use),
+                "idle": len(self._idle),
+                "checked_out": len(self._in_use),
+                "waiting": len(self._waiters),
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "wait_ms_total": round(self._wait_total * 1000, 2),
+                "wait_ms_max": round(self._wait_max * 1000, 2),
+                "timeouts": self._timeouts,
+                "connect_failures": self._connect_failures,
+                "healthcheck_failures": self._healthcheck_failures,
+                "recycled": self._recycled,
+            }
+
+    def closeall(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            waiters, self._waiters = self._waiters, deque()
+        for waiter in waiters:
+            waiter.event.set()
+        for slot in idle:
+            self._close_quietly(slot.conn)
+        # Checked-out connections are closed as they come back.
@@ -1,6 +1,8 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, UploadFile, File, HTTPException, WebSocket, WebSocketDisconnect, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
+import agent
 from agent import run_chat_agent
 from connection_manager import manager
 from groq import Groq
@@ -10,8 +12,11 @@ import os
 import shutil
 import tempfile
 import asyncio
+import hashlib
+from datetime import datetime
 from dotenv import load_dotenv
 import database
+import async_database
 from typing import Optional, List, Dict, Any
 import contextlib
 from proactive_scheduler import start_scheduler, stop_scheduler
@@ -25,23 +30,62 @@ async def lifespan(app: FastAPI):
     # Initialize Postgres DB if DATABASE_URL is set (Cloud Run)
     if database.DATABASE_URL:
         try:
-            database.init_postgres()
+            await async_database.run(database.init_postgres)
             print("Postgres DB initialized successfully")
         except Exception as e:
             print(f"Postgres init error: {e}")
     start_scheduler()
+    # Drain summary backlogs left over from before the restart.
+    for tenant in await async_database.run(database.list_tenants):
+        agent.summary_worker.request(tenant)
     yield
     # Shutdown
+    agent.summary_worker.stop()
     stop_scheduler()
+    async_database.shutdown()
+    database.close_pool()
 
 app = FastAPI(lifespan=lifespan)
 
+def request_tenant(headers, query_params) -> str:
+    """
+    The tenant a request has authenticated as: a signed bearer token in the
+    Authorization header, or ?token= for websockets (browsers cannot set their
+    headers). Unauthenticated requests get DEFAULT_TENANT. A bare X-User-Id
+    header proves nothing and is refused. Raises ValueError on bad credentials.
+    """
+    if headers.get("x-user-id"):
+        raise ValueError("X-User-Id is not accepted; authenticate with a bearer token")
+    scheme, _, token = (headers.get("authorization") or "").partition(" ")
+    if scheme.lower() != "bearer":
+        token = query_params.get("token")
+    if not token:
+        return database.DEFAULT_TENANT
+    return database.tenant_from_token(token.strip())
+
+@app.middleware("http")
+async def tenant_middleware(request: Request, call_next):
+    """Route the request's database calls to its authenticated tenant (see database.tenant_scope)."""
+    try:
+        tenant = request_tenant(request.headers, request.query_params)
+    except ValueError as e:
+        return JSONResponse({"detail": str(e)}, status_code=401)
+    with database.tenant_scope(tenant):
+        return await call_next(request)
+
+@app.middleware("http")
+async def query_stats_middleware(request: Request, call_next):
+    """Attribute the request's database work to one scope in /debug/db-stats."""
+    with database.query_scope(f"{request.method} {request.url.path}"):
+        return await call_next(request)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], # Allow all origins for dev
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Before-Id"],
 )
 
 # Initialize Groq Client for Audio
@@ -102,12 +146,16 @@ async def chat_stream(request: ChatRequest):
     return StreamingResponse(event_generator(), media_type="text/event-stream")
 
 @app.get("/chat/history")
-async def get_chat_history():
+async def get_chat_history(limit: int = 50, before_id: Optional[int] = None, since_id: Optional[int] = None):
     """
-    Returns the recent chat history for the frontend sync.
+    Returns a page of chat history for the frontend sync, oldest first.
+    Pass `since_id` (the newest id you have) to fetch only new messages, or
+    `before_id` (the oldest id you have) to scroll back.
     """
-    messages = database.get_recent_messages(limit=50, include_tool_calls=False)
-    return messages
+    if before_id is not None and since_id is not None:
+        raise HTTPException(status_code=400, detail="Pass before_id or since_id, not both")
+    limit = max(1, min(limit, 200))
+    return await async_database.get_chat_history(limit=limit, before_id=before_id, since_id=since_id)
 
 @app.post("/transcribe")
 async def transcribe_audio(file: UploadFile = File(...)):
@@ -140,7 +188,16 @@ async def transcribe_audio(file: UploadFile = File(...)):
 
 @app.websocket("/ws/transcribe")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+    # The http middleware doesn't run for websockets; authenticate here.
+    try:
+        tenant = request_tenant(websocket.headers, websocket.query_params)
+    except ValueError as e:
+        print(f"WS: Refused connection: {e}")
+        await websocket.close(code=1008)
+        return
+    # The endpoint runs in its own task, so this doesn't leak to other connections.
+    database.current_tenant.set(tenant)
+    await manager.connect(websocket, tenant)
     
     # Initialize Deepgram Flux Service
     stt_service = DeepgramFluxSTTService(
@@ -175,7 +232,7 @@ async def websocket_endpoint(websocket: WebSocket):
     print("WS: Starting Deepgram Flux Service...")
     if not await stt_service.start():
         print("WS: Failed to start STT service")
-        await manager.disconnect(websocket)
+        manager.disconnect(websocket)
         return
 
     print("WS: Connection accepted, waiting for audio...")
@@ -234,9 +291,52 @@ class TaskUpdate(BaseModel):
     notes: Optional[str] = None
     blocker_reason: Optional[str] = None
 
+TASK_PAGE_MAX = 1000
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
 @app.get("/tasks")
-def get_tasks(status: Optional[str] = None):
-    return database.list_tasks(status)
+def get_tasks(request: Request, status: Optional[str] = None, include_archived: bool = False,
+              goal_id: Optional[int] = None, scheduled_from: Optional[str] = None, scheduled_to: Optional[str] = None,
+              due_from: Optional[str] = None, due_to: Optional[str] = None, fields: Optional[str] = None,
+              limit: int = 500, before_id: Optional[int] = None):
+    """
+    Newest-first page of tasks. `fields` is a comma-separated column list;
+    dates accept YYYY-MM-DD or 'TODAY'. When more tasks exist the response
+    carries X-Next-Before-Id, to pass as `before_id` for the next page.
+    The ETag comes from the tenant's tasks change counter, so a matching
+    If-None-Match gets a 304 without reading any task rows.
+    """
+    limit = max(1, min(limit, TASK_PAGE_MAX))
+    filters = {"status": status, "goal_id": goal_id, "scheduled_from": scheduled_from, "scheduled_to": scheduled_to,
+               "due_from": due_from, "due_to": due_to}
+    field_list = [f.strip() for f in fields.split(",") if f.strip()] if fields else None
+
+    versions = database.get_table_versions()
+    key = [database.current_tenant.get(), versions.get("tasks"), versions.get("tasks_archive") if include_archived else None,
+           filters, field_list, limit, before_id, include_archived]
+    # 'TODAY' names a different date tomorrow, so the date is part of the tag.
+    if any(isinstance(v, str) and v.strip().upper() == "TODAY" for v in filters.values()):
+        key.append(datetime.now().strftime("%Y-%m-%d"))
+    etag = '"' + hashlib.sha1(json.dumps(key).encode("utf-8")).hexdigest()[:20] + '"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        tasks, next_before_id = database.get_task_page(
+            limit=limit, before_id=before_id, fields=field_list, include_archived=include_archived, **filters
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_before_id is not None:
+        headers["X-Next-Before-Id"] = str(next_before_id)
+    return JSONResponse(tasks, headers=headers)
 
 @app.post("/tasks")
 def create_task(task: TaskCreate):
@@ -251,6 +351,8 @@ def create_task(task: TaskCreate):
             notes=task.notes or ""
         )
         return {"status": "success", "task_id": task_id}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -259,7 +361,10 @@ def update_task_endpoint(task_id: int, update: TaskUpdate):
     # Only include set fields in the update
     updates = update.dict(exclude_unset=True)
     
-    success = database.update_task(task_id, updates)
+    try:
+        success = database.update_task(task_id, updates)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if not success:
         raise HTTPException(status_code=404, detail="Task not found")
     return {"status": "success"}
@@ -288,12 +393,64 @@ def get_streak():
 
 # --- Debug / Inspector Endpoints ---
 import debug
+import prompts
 from fastapi.staticfiles import StaticFiles
 
 @app.get("/debug/context")
 def get_debug_context_endpoint():
     return debug.get_debug_context()
 
+@app.get("/debug/db-pool")
+def get_db_pool_stats():
+    """Connection pool counters (open connections, checkouts, writer wait time)."""
+    return database.get_pool_stats()
+
+@app.get("/debug/db-cache")
+def get_db_cache_stats():
+    """Read cache hit rate and cached keys (profile, goals, habits)."""
+    return database.get_read_cache_stats()
+
+@app.get("/debug/prompt-cache")
+def get_prompt_cache_stats():
+    """System prompt cache hit rate and cached (tenant, mode) builds."""
+    return prompts.get_prompt_cache_stats()
+
+@app.get("/debug/context-cache")
+def get_context_cache_stats():
+    """Provider-side caches of the static prompt per model and mode, and cached input tokens so far."""
+    return agent.context_cache.get_stats()
+
+@app.get("/debug/summarizer")
+def get_summarizer_stats():
+    """Background summarizer: queued/running conversations, chunks folded, failures, current chunk size."""
+    return agent.summary_worker.get_stats()
+
+@app.get("/debug/transcript-cache")
+def get_transcript_cache_stats():
+    """Per-conversation transcript cache: hits, full reloads, rows read, cached rows per conversation."""
+    return agent.transcript_cache.get_stats()
+
+@app.get("/debug/db-stats")
+def get_db_stats(top: int = 25):
+    """Per-statement query counts and timings, recent requests/agent turns, and the slow-query log."""
+    return database.get_query_stats(top=max(1, min(top, 200)))
+
+@app.delete("/debug/db-stats")
+def reset_db_stats():
+    """Start the query counters over."""
+    database.reset_query_stats()
+    return {"status": "success"}
+
+@app.get("/debug/archive")
+def get_archive_stats():
+    """Hot vs archived row counts."""
+    return database.get_archive_stats()
+
+@app.post("/debug/archive")
+def run_archival():
+    """Run the nightly archival job now."""
+    return database.archive_cold_rows()
+
 @app.post("/debug/message/{message_id}")
 def update_message_endpoint(message_id: int, content: str):
     success = database.update_message_content(message_id, content)
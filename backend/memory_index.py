@@ -0,0 +1,318 @@
+"""
+Local vector recall over the memory search entries (messages, reflections,
+tasks) for prompt construction.
+
+Each entry is embedded as a hashed TF-IDF vector: words are hashed into
+MEMORY_VECTOR_DIM buckets, so no vocabulary has to be stored or grown.
+Document vectors hold L2-normalised sublinear term frequencies. IDF
+weights are applied to the query only, so adding documents never means
+rewriting stored vectors.
+
+The index is incremental and lives on disk, one directory per tenant
+under MEMORY_INDEX_DIR:
+    vectors.f16   float16 rows, appended
+    entries.i64   memory_entries.id of each row, appended
+    meta.json     row count, highest indexed entry id, bucket document
+                  frequencies; replaced atomically after each append
+    lock          flock()ed around loads, appends and rebuilds, so
+                  processes sharing the directory take turns
+Rows past meta.json's count, left by a crash mid-append, are truncated on
+load. A lost or corrupt directory is simply rebuilt from memory_entries.
+After taking the lock an index reloads if another process has changed
+meta.json since it last looked.
+
+NumPy is optional: without it, recall() returns nothing and the agent
+keeps sending the whole buffer. Without fcntl (Windows) only threads of
+one process are serialized, so run a single worker there.
+"""
+import json
+import math
+import os
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import database
+
+MEMORY_INDEX_DIR = os.getenv("MEMORY_INDEX_DIR", "memory_index")
+MEMORY_VECTOR_DIM = int(os.getenv("MEMORY_VECTOR_DIM", "1024"))
+# Tenants whose index stays loaded in memory.
+MEMORY_INDEX_CACHE = int(os.getenv("MEMORY_INDEX_CACHE", "16"))
+RECALL_TOP_K = int(os.getenv("RECALL_TOP_K", "6"))
+# Matches scoring below this (cosine-like, 0..1) are not worth prompt space.
+RECALL_MIN_SCORE = float(os.getenv("RECALL_MIN_SCORE", "0.12"))
+RECALL_ENABLED = HAS_NUMPY and os.getenv("RECALL_ENABLED", "true").lower() == "true"
+# How often an index compares its row count with the live entries (a COUNT
+# query) to decide whether to rebuild.
+MEMORY_INDEX_STALE_CHECK_SECONDS = float(os.getenv("MEMORY_INDEX_STALE_CHECK_SECONDS", "600"))
+# Most recently indexed rows whose id range is read again on each sync.
+# Postgres hands out ids before commit, so an entry can become visible after
+# one with a higher id; inside this window it is still picked up.
+MEMORY_INDEX_OVERLAP = int(os.getenv("MEMORY_INDEX_OVERLAP", "50"))
+
+_SYNC_BATCH = 1000
+_SCORE_CHUNK = 8192
+_WORD_RE = re.compile(r"\w+")
+
+
+def _bucket_counts(text: str) -> Dict[int, int]:
+    """Word counts of `text`, hashed into vector buckets (crc32 is stable across processes)."""
+    counts: Dict[int, int] = {}
+    for word in _WORD_RE.findall((text or "").lower()):
+        bucket = zlib.crc32(word.encode("utf-8")) % MEMORY_VECTOR_DIM
+        counts[bucket] = counts.get(bucket, 0) + 1
+    return counts
+
+
+class MemoryIndex:
+    """
+    One tenant's vector index. Thread-safe; sync() and search() serialize
+    on a lock, and loads, appends and rebuilds also hold the directory's
+    file lock.
+    """
+
+    def __init__(self, path: str, overlap: int = MEMORY_INDEX_OVERLAP):
+        self.path = path
+        self.overlap = overlap
+        self.lock = threading.Lock()
+        self._meta_stamp = None
+        self._stale_checked_at = None
+        self._reset_memory()
+        with self._locked():
+            self._load()
+
+    def _reset_memory(self):
+        # Rows [0, count) of the buffers are live; capacity doubles as they fill.
+        self.count = 0
+        self.vectors = np.zeros((0, MEMORY_VECTOR_DIM), dtype=np.float16)
+        self.entry_ids = np.zeros(0, dtype=np.int64)
+        self.doc_freq = np.zeros(MEMORY_VECTOR_DIM, dtype=np.float64)
+        self.last_entry_id = 0
+
+    def _append(self, vectors, entry_ids):
+        needed = self.count + len(entry_ids)
+        if needed > len(self.entry_ids):
+            capacity = max(needed, 2 * len(self.entry_ids), 256)
+            grown_vectors = np.zeros((capacity, MEMORY_VECTOR_DIM), dtype=np.float16)
+            grown_vectors[:self.count] = self.vectors[:self.count]
+            grown_ids = np.zeros(capacity, dtype=np.int64)
+            grown_ids[:self.count] = self.entry_ids[:self.count]
+            self.vectors, self.entry_ids = grown_vectors, grown_ids
+        self.vectors[self.count:needed] = vectors
+        self.entry_ids[self.count:needed] = entry_ids
+        self.count = needed
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    @contextmanager
+    def _locked(self):
+        """Hold the thread lock and, where fcntl exists, the directory's file lock."""
+        with self.lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(self.path, exist_ok=True)
+            with open(self._file("lock"), "a") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _stamp(self):
+        try:
+            st = os.stat(self._file("meta.json"))
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _refresh(self):
+        """Reload if another process has appended or rebuilt since we last looked. Call under _locked()."""
+        if self._stamp() != self._meta_stamp:
+            self._reset_memory()
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self._file("meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["dim"] != MEMORY_VECTOR_DIM:
+                raise ValueError(f"index built with dim {meta['dim']}")
+            count = meta["count"]
+            self._truncate(count)
+            self._append(
+                np.fromfile(self._file("vectors.f16"), dtype=np.float16).reshape(count, MEMORY_VECTOR_DIM),
+                np.fromfile(self._file("entries.i64"), dtype=np.int64),
+            )
+            self.doc_freq = np.asarray(meta["doc_freq"], dtype=np.float64)
+            self.last_entry_id = meta["last_entry_id"]
+            self._meta_stamp = self._stamp()
+        except FileNotFoundError:
+            self._reset()
+        except Exception as e:
+            print(f"Memory index at {self.path} unreadable ({e}); rebuilding.")
+            self._reset()
+
+    def _truncate(self, count: int):
+        for name, row_bytes in (("vectors.f16", MEMORY_VECTOR_DIM * 2), ("entries.i64", 8)):
+            if os.path.getsize(self._file(name)) > count * row_bytes:
+                os.truncate(self._file(name), count * row_bytes)
+
+    def _reset(self):
+        os.makedirs(self.path, exist_ok=True)
+        for name in ("vectors.f16", "entries.i64"):
+            open(self._file(name), "wb").close()
+        self._reset_memory()
+        self._write_meta()
+
+    def _write_meta(self):
+        tmp = self._file("meta.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({
+                "dim": MEMORY_VECTOR_DIM,
+                "count": self.count,
+                "last_entry_id": self.last_entry_id,
+                "doc_freq": self.doc_freq.tolist(),
+            }, f)
+        os.replace(tmp, self._file("meta.json"))
+        self._meta_stamp = self._stamp()
+
+    def _read_after(self) -> int:
+        """Id to read entries after: just below the last `overlap` indexed rows."""
+        if self.overlap <= 0 or self.count == 0:
+            return self.last_entry_id
+        return int(self.entry_ids[max(self.count - self.overlap, 0):self.count].min()) - 1
+
+    def sync(self):
+        """
+        Embed and append the entries added since the last sync, including
+        any that committed late below ids already indexed.
+        """
+        with self._locked():
+            self._refresh()
+            after = self._read_after()
+            indexed = self.entry_ids[:self.count]
+            known = set(indexed[indexed > after].tolist())
+            while True:
+                rows = database.get_memory_entries_after(after, _SYNC_BATCH)
+                if not rows:
+                    return
+                after = rows[-1]['id']
+                rows = [row for row in rows if row['id'] not in known]
+                if not rows:
+                    continue
+                vectors = np.zeros((len(rows), MEMORY_VECTOR_DIM), dtype=np.float32)
+                for i, row in enumerate(rows):
+                    for bucket, count in _bucket_counts(row['body']).items():
+                        vectors[i, bucket] = 1 + math.log(count)
+                self.doc_freq += (vectors > 0).sum(axis=0)
+                norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+                vectors = (vectors / np.maximum(norms, 1e-9)).astype(np.float16)
+                entry_ids = np.array([row['id'] for row in rows], dtype=np.int64)
+
+                with open(self._file("vectors.f16"), "ab") as f:
+                    vectors.tofile(f)
+                with open(self._file("entries.i64"), "ab") as f:
+                    entry_ids.tofile(f)
+                self._append(vectors, entry_ids)
+                self.last_entry_id = max(self.last_entry_id, int(entry_ids.max()))
+                self._write_meta()
+
+    def rebuild_if_stale(self):
+        """
+        Start over when most rows point at entries that no longer exist.
+        An edit deletes the entry and indexes the new text under a new id
+        (which the next sync embeds), so the old row stays behind, as do
+        the rows of deleted entries. Checked at most every
+        MEMORY_INDEX_STALE_CHECK_SECONDS.
+        """
+        now = time.monotonic()
+        if self._stale_checked_at is not None and now - self._stale_checked_at < MEMORY_INDEX_STALE_CHECK_SECONDS:
+            return
+        self._stale_checked_at = now
+        live = database.count_memory_entries()
+        with self._locked():
+            self._refresh()
+            if self.count <= 2 * live + _SYNC_BATCH:
+                return
+            print(f"Memory index at {self.path}: {self.count} rows for {live} entries; rebuilding.")
+            self._reset()
+
+    def search(self, text: str, k: int) -> List[int]:
+        """Entry ids of the `k` best matches for `text`, best first."""
+        counts = _bucket_counts(text)
+        with self.lock:
+            total = self.count
+            if not counts or total == 0:
+                return []
+            idf = np.log((total + 1) / (self.doc_freq + 1)) + 1
+            query = np.zeros(MEMORY_VECTOR_DIM, dtype=np.float32)
+            for bucket, count in counts.items():
+                query[bucket] = (1 + math.log(count)) * idf[bucket] ** 2
+            query /= np.linalg.norm(query)
+            # float16 rows are widened a chunk at a time so the product runs through BLAS.
+            scores = np.concatenate([
+                self.vectors[start:min(start + _SCORE_CHUNK, total)].astype(np.float32) @ query
+                for start in range(0, total, _SCORE_CHUNK)
+            ])
+            entry_ids = self.entry_ids[:total]
+        top = np.argpartition(-scores, min(k, total) - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [int(entry_ids[i]) for i in top if scores[i] >= RECALL_MIN_SCORE]
+
+
+_indexes: "OrderedDict[str, MemoryIndex]" = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def _index_for_tenant() -> MemoryIndex:
+    tenant = database.validate_tenant(database.current_tenant.get())
+    with _indexes_lock:
+        index = _indexes.get(tenant)
+        if index is not None:
+            _indexes.move_to_end(tenant)
+            return index
+        # Loaded under the lock so two threads never reset the same directory.
+        index = _indexes[tenant] = MemoryIndex(os.path.join(MEMORY_INDEX_DIR, tenant))
+        while len(_indexes) > MEMORY_INDEX_CACHE:
+            _indexes.popitem(last=False)
+    index.rebuild_if_stale()
+    return index
+
+
+def recall(text: str, k: int = RECALL_TOP_K, exclude_messages: Optional[List[int]] = None) -> List[Dict[str, Any]]:
+    """
+    The `k` memory entries most relevant to `text`, best first, leaving out
+    messages whose ids are in `exclude_messages` (already in the prompt).
+    """
+    if not RECALL_ENABLED:
+        return []
+    try:
+        index = _index_for_tenant()
+        index.sync()
+        excluded = set(exclude_messages or ())
+        # Over-fetch: some hits are excluded or point at since-deleted entries.
+        entries = database.get_memory_entries(index.search(text, k + len(excluded) + k))
+        return [
+            e for e in entries
+            if not (e['kind'] == 'message' and e['source_id'] in excluded)
+        ][:k]
+    except Exception as e:
+        print(f"Memory recall failed: {e}")
+        return []
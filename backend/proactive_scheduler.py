@@ -9,35 +9,62 @@ logger = logging.getLogger(__name__)
 # Initialize Scheduler
 scheduler = AsyncIOScheduler()
 
+async def _for_each_tenant(job, *args):
+    """Runs a job once per tenant database on this node (just once when storage isn't sharded)."""
+    import database
+    for tenant in database.list_tenants():
+        with database.tenant_scope(tenant), database.query_scope(f"{job.__name__} [{tenant}]"):
+            try:
+                await job(*args)
+            except Exception as e:
+                logger.error(f"Scheduled job {job.__name__} failed for tenant {tenant}: {e}")
+
+async def wake_tenant(tenant: str, reason: str):
+    """Self-scheduled wake-up, run for the tenant that scheduled it."""
+    from agent import wake_cooper
+    import database
+    with database.tenant_scope(tenant), database.query_scope(f"wake_cooper [{tenant}]"):
+        await wake_cooper(reason)
+
 async def trigger_morning_briefing():
     """Wakes Cooper for the Morning Briefing (8:00 AM)"""
     from agent import wake_cooper
     logger.info("⏰ Heartbeat: Triggering Morning Briefing")
-    await wake_cooper(reason="Morning Briefing")
+    await _for_each_tenant(wake_cooper, "Morning Briefing")
 
 async def trigger_eod_check():
     """Wakes Cooper for the EOD Check (6:00 PM)"""
     from agent import wake_cooper
     logger.info("⏰ Heartbeat: Triggering EOD Check")
-    await wake_cooper(reason="EOD Check")
+    await _for_each_tenant(wake_cooper, "EOD Check")
 
 async def trigger_midday_check():
     """Wakes Cooper for the Mid-Day Check-In (1:30 PM)"""
     from agent import wake_cooper
     logger.info("⏰ Heartbeat: Triggering Mid-Day Check-In")
-    await wake_cooper(reason="Mid-Day Check-In")
+    await _for_each_tenant(wake_cooper, "Mid-Day Check-In")
 
 async def trigger_night_owl_check():
     """Wakes Cooper for the Night Owl Check (10:00 PM)"""
     from agent import wake_cooper
     logger.info("⏰ Heartbeat: Triggering Night Owl Check")
-    await wake_cooper(reason="Night Owl Check")
+    await _for_each_tenant(wake_cooper, "Night Owl Check")
 
 async def trigger_weekly_planning():
     """Wakes Cooper for Weekly Planning (Sunday 7:00 PM)"""
     from agent import wake_cooper
     logger.info("⏰ Heartbeat: Triggering Weekly Planning")
-    await wake_cooper(reason="Weekly Planning")
+    await _for_each_tenant(wake_cooper, "Weekly Planning")
+
+async def run_archival():
+    """Moves summarized messages and old finished tasks to cold storage (3:30 AM)"""
+    import async_database
+
+    async def archive():
+        moved = await async_database.archive_cold_rows()
+        logger.info(f"🧊 Archive: moved {moved['messages']} messages and {moved['tasks']} tasks to cold storage")
+
+    await _for_each_tenant(archive)
 
 def start_scheduler():
     """Starts the proactive scheduler"""
@@ -86,6 +113,14 @@ def start_scheduler():
             replace_existing=True
         )
 
+        # 6. Archival: 3:30 AM (quiet hours)
+        scheduler.add_job(
+            run_archival,
+            CronTrigger(hour=3, minute=30),
+            id="archival",
+            replace_existing=True
+        )
+
         scheduler.start()
         logger.info("✅ Proactive Scheduler Started")
 
@@ -1,5 +1,8 @@
 import os
-from typing import Optional
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
 
 # Get the directory of the current file
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -18,6 +21,7 @@ SOUL_PROMPT = load_prompt('soul.md')
 ACCOUNTABILITY_PROMPT = load_prompt('accountability_partner_skill.md')
 GOAL_COACH_PROMPT = load_prompt('goal_coach_skill.md')
 TOOLS_PROMPT = load_prompt('tools.md')
+HEARTBEAT_PROMPT = load_prompt('heartbeat.md')
 
 # --- Mode-specific skill overlays ---
 # These are loaded once and added to the system prompt only when the user is
@@ -48,34 +52,13 @@ All messages include timestamps, so you have a sense of the conversation flow an
 
 import database
 
-def get_system_context(summary_text: Optional[str] = None, mode: Optional[str] = None) -> str:
-    """
-    Combines System Prompt + (optional Mode skill) + Heartbeat + State + Summary.
-
-    Args:
-        summary_text: Optional pre-fetched conversation summary, to avoid a
-            redundant DB call when the caller already has it.
-        mode: Optional skill mode — one of 'brief', 'review', 'capture',
-            'plan-goal'. When set, the matching skill prompt is overlaid on
-            top of the base prompt so the agent stays in-mode for that turn.
-    """
-    try:
-        task_context = database.get_context_markdown()
-    except Exception:
-        task_context = "No tasks or goals found."
-
-    try:
-        with open(os.path.join(PROMPTS_DIR, 'heartbeat.md'), 'r', encoding='utf-8') as f:
-            heartbeat_context = f.read()
-    except Exception:
-        heartbeat_context = ""
-
-    if summary_text is None:
-        summary_text, _ = database.get_memory_context()
+def skill_mode(mode: Optional[str]) -> Optional[str]:
+    """`mode` if it names a skill with a prompt, else None."""
+    return mode if mode and MODE_SKILLS.get(mode) else None
 
+def _static_prompt(mode: Optional[str]) -> str:
     parts = [BASE_SYSTEM_PROMPT]
-
-    if mode and mode in MODE_SKILLS and MODE_SKILLS[mode]:
+    if mode:
         # Loud header so the model treats the overlay as the active skill,
         # not just more reading material.
         parts.append(
@@ -85,12 +68,102 @@ def get_system_context(summary_text: Optional[str] = None, mode: Optional[str] =
             f"soul and the goal-coach principles still apply.\n\n"
             f"{MODE_SKILLS[mode]}"
         )
+    parts.append(HEARTBEAT_PROMPT)
+    return "\n\n".join(p for p in parts if p)
 
-    parts.append(heartbeat_context)
-    parts.append(task_context)
+STATIC_PROMPTS = {mode: _static_prompt(mode) for mode in (None, *filter(skill_mode, MODE_SKILLS))}
 
-    full_prompt = "\n\n".join(p for p in parts if p)
+def get_static_prompt(mode: Optional[str] = None) -> str:
+    """
+    The part of the system prompt that changes only with the mode: soul,
+    skills, tools, the mode overlay and heartbeat. Identical across users
+    and turns, which is what lets agent.py cache it with the provider.
+    """
+    return STATIC_PROMPTS[skill_mode(mode)]
+
+# --- Prompt cache ---
+# The state part of the prompt (everything but recalled memory) is kept per
+# tenant and reused while database.data_version(), the summary and the day
+# are unchanged, so a turn with no state change does no context DB work.
+# Writes from another process are picked up after READ_CACHE_TTL, as in the
+# read cache, or at once with READ_CACHE_NOTIFY.
+PROMPT_CACHE_ENABLED = database.READ_CACHE_ENABLED and os.getenv("PROMPT_CACHE_ENABLED", "1") != "0"
+
+_prompt_cache: Dict[str, Tuple[Tuple[Any, ...], float, str]] = {}
+_prompt_cache_lock = threading.Lock()
+_prompt_cache_stats = {"hits": 0, "misses": 0}
+
+def get_prompt_cache_stats() -> Dict[str, Any]:
+    with _prompt_cache_lock:
+        lookups = _prompt_cache_stats["hits"] + _prompt_cache_stats["misses"]
+        return {
+            **_prompt_cache_stats,
+            "hit_rate": round(_prompt_cache_stats["hits"] / lookups, 3) if lookups else None,
+            "entries": sorted(_prompt_cache),
+            "enabled": PROMPT_CACHE_ENABLED,
+        }
+
+def _build_state_context(summary_text: Optional[str]) -> str:
+    try:
+        state_context = database.get_context_markdown()
+    except Exception:
+        state_context = "No tasks or goals found."
     if summary_text:
-        full_prompt += f"\n\nPREVIOUS CONVERSATION SUMMARY:\n{summary_text}"
+        state_context += f"\n\nPREVIOUS CONVERSATION SUMMARY:\n{summary_text}"
+    return state_context
+
+def _cached_state_context(summary_text: Optional[str]) -> str:
+    if not PROMPT_CACHE_ENABLED:
+        return _build_state_context(summary_text)
+    tenant = database.current_tenant.get()
+    # Read before building: a write that lands mid-build leaves a stale version behind, not a stale prompt.
+    version = (database.data_version(), summary_text, datetime.now().date())
+    with _prompt_cache_lock:
+        entry = _prompt_cache.get(tenant)
+        if entry and entry[0] == version and time.monotonic() - entry[1] < database.READ_CACHE_TTL:
+            _prompt_cache_stats["hits"] += 1
+            return entry[2]
+        _prompt_cache_stats["misses"] += 1
+    built_at = time.monotonic()
+    state_context = _build_state_context(summary_text)
+    with _prompt_cache_lock:
+        _prompt_cache[tenant] = (version, built_at, state_context)
+    return state_context
+
+def get_state_context(summary_text: Optional[str] = None,
+                      recalled: Optional[List[Dict[str, Any]]] = None) -> str:
+    """
+    The per-turn part of the system prompt: State + Summary + Recalled memory.
+
+    Args:
+        summary_text: Optional pre-fetched conversation summary, to avoid a
+            redundant DB call when the caller already has it.
+        recalled: Optional memory entries (from memory_index.recall) relevant
+            to this turn but older than the conversation window sent with it.
+    """
+    if summary_text is None:
+        summary_text, _ = database.get_memory_context()
+
+    state_context = _cached_state_context(summary_text)
+    if recalled:
+        lines = "\n".join(
+            f"- [{(entry['created_at'] or '')[:10]}] ({entry['kind']}) {entry['body']}" for entry in recalled
+        )
+        state_context += f"\n\nRELEVANT MEMORY (older messages, reflections and tasks related to this conversation):\n{lines}"
+    return state_context
+
+def get_system_context(summary_text: Optional[str] = None, mode: Optional[str] = None,
+                       recalled: Optional[List[Dict[str, Any]]] = None) -> str:
+    """
+    Combines System Prompt + (optional Mode skill) + Heartbeat + State + Summary + Recalled memory.
 
-    return full_prompt
+    Args:
+        summary_text: Optional pre-fetched conversation summary, to avoid a
+            redundant DB call when the caller already has it.
+        mode: Optional skill mode — one of 'brief', 'review', 'capture',
+            'plan-goal'. When set, the matching skill prompt is overlaid on
+            top of the base prompt so the agent stays in-mode for that turn.
+        recalled: Optional memory entries (from memory_index.recall) relevant
+            to this turn but older than the conversation window sent with it.
+    """
+    return f"{get_static_prompt(mode)}\n\n{get_state_context(summary_text, recalled)}"
@@ -0,0 +1,185 @@
+"""
+Exercises agent.ContextCache against a local stub of the Gemini API, so the
+caching path can be checked without an API key or network access.
+
+The stub implements the three endpoints the agent uses (cachedContents
+create/update and models/*:streamGenerateContent) and records every
+request. The checks cover: a cache is created once per mode and referenced
+with the static prompt and tools left out of the request; it is extended
+before it expires; a request the API refuses over its cache is retried
+inline; and when no cache can be created calls go inline without retrying
+creation on every turn.
+
+Usage:
+    python scripts/check_context_cache.py
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(backend_dir)
+
+
+class StubGemini(BaseHTTPRequestHandler):
+    requests = []           # (method, path, body)
+    fail_create = False     # answer cache creation with 400
+    refuse_cached = False   # answer generation that names a cache with 404
+    caches = 0
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status: int, message: str):
+        self._reply(status, {"error": {"code": status, "message": message,
+                                       "status": "NOT_FOUND" if status == 404 else "INVALID_ARGUMENT"}})
+
+    def _body(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        StubGemini.requests.append((self.command, self.path, body))
+        return body
+
+    def _cache(self, name: str, ttl: str) -> dict:
+        expires = datetime.now(timezone.utc) + timedelta(seconds=float(ttl.rstrip("s")))
+        return {"name": name, "model": "models/stub",
+                "expireTime": expires.isoformat().replace("+00:00", "Z")}
+
+    def do_POST(self):
+        body = self._body()
+        if self.path.split("?")[0].endswith("/cachedContents"):
+            if StubGemini.fail_create:
+                return self._error(400, "Cached content is too small.")
+            StubGemini.caches += 1
+            return self._reply(200, self._cache(f"cachedContents/c{StubGemini.caches}", body["ttl"]))
+        if ":streamGenerateContent" in self.path:
+            if body.get("cachedContent") and StubGemini.refuse_cached:
+                return self._error(404, "CachedContent not found.")
+            chunk = {
+                "candidates": [{"content": {"role": "model", "parts": [{"text": "ok"}]}, "finishReason": "STOP"}],
+                "usageMetadata": {"promptTokenCount": 1200,
+                                  "cachedContentTokenCount": 1000 if body.get("cachedContent") else 0},
+            }
+            data = f"data: {json.dumps(chunk)}\r\n\r\n".encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        self._error(404, f"No stub for {self.path}")
+
+    def do_PATCH(self):
+        body = self._body()
+        name = self.path.split("?")[0].split("/v1beta/")[-1]
+        self._reply(200, self._cache(name, body["ttl"]))
+
+
+def _calls(method: str, kind: str = ""):
+    return [r for r in StubGemini.requests if r[0] == method and kind in r[1]]
+
+
+async def _turn(agent, mode=None) -> str:
+    state = agent.AgentState(
+        messages=[agent.types.Content(role="user", parts=[agent.types.Part(text="hello")])],
+        user_message_str="hello", mode=mode, state_context="## CURRENT STATE (stub)",
+    )
+    stream = await agent.open_model_stream(state)
+    text = ""
+    async for chunk in stream:
+        if chunk.usage_metadata and chunk.usage_metadata.cached_content_token_count:
+            agent.context_cache.stats["cached_tokens"] += chunk.usage_metadata.cached_content_token_count
+        text += chunk.text or ""
+    return text
+
+
+def check(name: str, ok: bool) -> int:
+    print(f"{'ok  ' if ok else 'FAIL'} {name}")
+    return 0 if ok else 1
+
+
+async def run_checks(agent) -> int:
+    failures = 0
+    cache = agent.context_cache
+    model = agent.MODEL_NAME
+
+    await _turn(agent)
+    await _turn(agent)
+    generate = _calls("POST", ":streamGenerateContent")
+    failures += check("cache created once for two turns", len(_calls("POST", "/cachedContents")) == 1 and cache.stats["created"] == 1)
+    failures += check("requests reference the cache",
+                      all(body.get("cachedContent") == "cachedContents/c1" for _, _, body in generate))
+    failures += check("static prompt and tools not re-sent",
+                      all("systemInstruction" not in body and "tools" not in body for _, _, body in generate))
+    failures += check("state travels as the leading turn",
+                      "CURRENT STATE" in generate[-1][2]["contents"][0]["parts"][0]["text"])
+    created = StubGemini.requests[0][2]
+    failures += check("cache holds the static prompt and tool declarations",
+                      "systemInstruction" in created
+                      and len(created["tools"][0]["functionDeclarations"]) == len(agent.TOOL_CALLABLES))
+
+    await _turn(agent, "brief")
+    failures += check("one cache per mode", cache.stats["created"] == 2)
+
+    name, _ = cache._caches[(model, None)]
+    cache._caches[(model, None)] = (name, time.monotonic() + cache.refresh_margin / 2)
+    await _turn(agent)
+    failures += check("extended before expiry",
+                      len(_calls("PATCH")) == 1 and cache.stats["refreshed"] == 1 and cache.stats["created"] == 2)
+
+    StubGemini.refuse_cached = True
+    await _turn(agent)
+    last = _calls("POST", ":streamGenerateContent")[-1][2]
+    failures += check("refused cache falls back inline",
+                      "cachedContent" not in last and "systemInstruction" in last and "tools" in last
+                      and cache.stats["invalidated"] == 1)
+    StubGemini.refuse_cached = False
+
+    StubGemini.fail_create = True
+    cache._caches.clear()
+    before = len(_calls("POST", "/cachedContents"))
+    await _turn(agent)
+    await _turn(agent)
+    last = _calls("POST", ":streamGenerateContent")[-1][2]
+    failures += check("failed create goes inline", "cachedContent" not in last and "systemInstruction" in last)
+    failures += check("failed create not retried every turn", len(_calls("POST", "/cachedContents")) == before + 1)
+    failures += check("cached tokens counted", cache.stats["cached_tokens"] > 0)
+
+    print(json.dumps(cache.get_stats(), indent=2))
+    return failures
+
+
+def main() -> int:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubGemini)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["GEMINI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}"
+    os.environ.setdefault("GOOGLE_API_KEY", "stub")
+    os.environ["CONTEXT_CACHE_ENABLED"] = "1"
+    # database.py creates nachos.db in the working directory on import.
+    os.chdir(tempfile.mkdtemp(prefix="nachos-context-cache-"))
+
+    import agent
+    try:
+        failures = asyncio.run(run_checks(agent))
+    finally:
+        server.shutdown()
+    print(f"\n{failures} check(s) failed" if failures else "\nAll context cache checks passed")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""
+Runs EXPLAIN on the statements in database.py's registry and fails if any of them
+falls back to a full table scan where an index should be used.
+
+SQLite (default): builds a throwaway database in a temp dir via the normal
+migrations and inspects EXPLAIN QUERY PLAN.
+
+Postgres: set DATABASE_URL to a migrated database. Sequential scans are
+disabled for the session so the planner reports whether an index *can*
+serve the query, regardless of how small the tables are.
+
+Usage:
+    python scripts/check_query_plans.py
+"""
+import os
+import sys
+import tempfile
+
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(backend_dir)
+
+if not os.getenv("DATABASE_URL"):
+    # database.py creates nachos.db in the working directory on import.
+    os.chdir(tempfile.mkdtemp(prefix="nachos-plans-"))
+
+import database
+
+TODAY = "2026-01-15"
+DAY = database._day_value(TODAY)
+
+# (statement name in database.SQL, params, full_scan_ok)
+# full_scan_ok marks queries that legitimately read every row of a table
+# (none at present) — everything else must use an index.
+# Every per-user statement is scoped by user_id, so even whole-user
+# aggregates such as the habit streak roll-up must range-scan an index.
+QUERIES = [
+    # Memory
+    ("get_push_tokens", (), False),
+    ("update_message_content", ("x", "x", 1, 1, 1), False),
+    ("delete_message", (1,), False),
+    ("get_summary", (), False),
+    ("messages_after", (0,), False),
+    ("get_messages_range", (0, 10), False),
+    ("chat_history_latest", ("tool", 50), False),
+    ("chat_history_before", ("tool", 100, 50), False),
+    ("chat_history_since", ("tool", 100, 50), False),
+    ("last_user_message_at", (), False),
+
+    # Tasks & goals
+    (database._update_statement("tasks", ("status", "updated_at")), ("DONE", TODAY, 1), False),
+    (database._bulk_update_tasks_statement(("status",), 2), (1, "DONE", 2, "DONE", TODAY), False),
+    ("delete_task", (1,), False),
+    ("list_tasks", (100,), False),
+    ("list_tasks_by_status", ("TODO", 100), False),
+    (database._task_page_statement("tasks", ()), (100,), False),
+    (database._task_page_statement("tasks", ("status", "before_id")), ("TODO", 100, 100), False),
+    (database._task_page_statement("tasks", ("goal_id",)), (1, 100), False),
+    (database._task_page_statement("tasks", ("scheduled_from", "scheduled_to")), (DAY, DAY, 100), False),
+    (database._task_page_statement("tasks", ("due_from", "due_to")), (DAY, DAY, 100), False),
+    (database._task_page_statement("tasks_archive", ("status",)), ("DONE", 100), False),
+    ("table_versions", (), False),
+    ("list_goals", (), False),
+    (database._update_statement("goals", ("title",)), ("x", 1), False),
+
+    # Habits
+    ("list_habits_active", (), False),
+    (database._update_statement("habits", ("title",)), ("x", 1), False),
+    ("habit_streaks", (TODAY, TODAY, TODAY), False),
+
+    # Profile & reflections
+    ("get_profile", (), False),
+    ("recent_reflections_by_type", ("daily", 5), False),
+    ("recent_reflections", (5,), False),
+
+    # Memory search
+    ("search_memory", (database._memory_search_terms("dentist appointment"), 10), False),
+    ("search_memory_kind", (database._memory_search_terms("dentist"), "task", 10), False),
+    ("unindex_memory_entry", ("message", 1), False),
+
+    # Archive
+    ("messages_to_archive", (100, 500), False),
+    ("tasks_to_archive", (TODAY, 500), False),
+    ("archived_chat_history_latest", ("tool", 50), False),
+    ("archived_chat_history_before", ("tool", 100, 50), False),
+    ("archived_chat_history_since", ("tool", 100, 50), False),
+    ("archived_messages_range", (1, 50), False),
+    ("archived_message", (1,), False),
+    ("archived_tasks_by_status", ("DONE", 100), False),
+    ("archived_task", (1,), False),
+    ("delete_archived_task", (1,), False),
+    ("archive_stats", (), False),
+
+    # Analytics
+    ("task_stats", (TODAY,), False),
+    ("todays_tasks", (DAY,), False),
+    ("overdue_tasks", (DAY, DAY), False),
+    ("overdue_tasks_limited", (DAY, DAY, 50), False),
+    ("overdue_count", (DAY,), False),
+    ("goal_progress", (DAY,), False),
+    ("goal_progress_one", (DAY, 1), False),
+    ("rescheduled_tasks", (DAY, DAY, DAY), False),
+    ("rescheduled_tasks_limited", (DAY, DAY, DAY, 50), False),
+    ("task_done_days", (), False),
+]
+
+
+def _sqlite_full_scans(c, query, params):
+    c.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    tables = {row[0] for row in c.fetchall()}
+    c.execute("EXPLAIN QUERY PLAN " + query, params)
+    details = [row[3] for row in c.fetchall()]
+    # "SCAN sub" over a subquery or CTE is not a table scan.
+    scans = [d for d in details
+             if d.startswith("SCAN ") and d.split()[1] in tables and "INDEX" not in d]
+    return scans, details
+
+
+def _postgres_full_scans(c, query, params):
+    c.execute("EXPLAIN " + query, params)
+    details = [list(row.values())[0] for row in c.fetchall()]
+    scans = [d.strip() for d in details if "Seq Scan" in d]
+    return scans, details
+
+
+def main() -> int:
+    failures = 0
+    with database.get_cursor() as c:
+        if database.DATABASE_URL:
+            c.execute("SET LOCAL enable_seqscan = off")
+            inspect = _postgres_full_scans
+        else:
+            inspect = _sqlite_full_scans
+
+        for name, params, full_scan_ok in QUERIES:
+            scans, details = inspect(c, database.SQL[name], database._bind(name, params))
+            if scans and not full_scan_ok:
+                failures += 1
+                print(f"FAIL  {name}: {'; '.join(scans)}")
+                for d in details:
+                    print(f"        {d}")
+            else:
+                print(f"ok    {name}" + (" (full scan expected)" if scans else ""))
+
+        # EXPLAIN on UPDATE/DELETE never writes, but leave nothing behind either way.
+        c.connection.rollback()
+
+    print(f"\n{len(QUERIES) - failures}/{len(QUERIES)} queries use an index where expected.")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
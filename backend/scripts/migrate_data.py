@@ -1,117 +1,235 @@
+"""
+Copies a SQLite nachos database into Postgres.
 
-import sqlite3
-import psycopg2
+Rows are streamed in fixed-size chunks (keyset on the SQLite rowid, so
+memory stays flat whatever the table size) and bulk-loaded with COPY into
+a temporary staging table, then moved across with INSERT ... ON CONFLICT
+DO NOTHING. Independent tables load in parallel on their own connections.
+
+Each chunk commits together with a checkpoint row in
+migrate_data_progress on the target, so an interrupted run picks up after
+the last committed chunk when started again. SERIAL sequences are moved
+past the copied ids at the end.
+
+The target must already have the schema: start the backend (or import
+database.py) once with DATABASE_URL pointing at it so the migrations run.
+
+Usage:
+    TARGET_DATABASE_URL=postgres://... python scripts/migrate_data.py [--source nachos.db]
+        [--chunk-size 5000] [--workers 4] [--restart]
+"""
+import argparse
+import io
 import os
+import sqlite3
 import sys
-from psycopg2.extras import execute_values
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 
-# Add parent directory to path to import database definitions if needed
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import psycopg2
+
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
-# Configuration
-SQLITE_DB = "d:/nachos/backend/nachos.db" # Assume running from repo root or absolute path
+SQLITE_DB = os.getenv("SQLITE_DB", os.path.join(backend_dir, "nachos.db"))
 TARGET_DB_URL = os.getenv("TARGET_DATABASE_URL")
 
-def migrate():
+# Tables in a group load in order (foreign keys point at earlier ones);
+# groups load in parallel with each other.
+TABLE_GROUPS = [
+    ["goals", "tasks"],
+    ["habits", "habit_logs"],
+    ["messages"],
+    ["messages_archive"],
+    ["tasks_archive"],
+    ["reflections"],
+    ["users"],
+    ["user_profile", "session_summary"],
+]
+# Loaded once everything above is in: triggers on messages, tasks and
+# reflections have already indexed the hot rows, so this adds the archived
+# ones. Its own ids are left to the target's sequence.
+FINAL_TABLES = ["memory_entries"]
+SKIP_COLUMNS = {"memory_entries": {"id"}}
+
+# Tables whose SERIAL id sequence must start past the copied ids, and the
+# archive sharing their id space.
+SEQUENCES = {
+    "goals": None,
+    "tasks": "tasks_archive",
+    "messages": "messages_archive",
+    "users": None,
+    "habits": None,
+    "habit_logs": None,
+    "reflections": None,
+    "memory_entries": None,
+}
+
+
+def _copy_value(value: Any) -> str:
+    """One field in COPY's text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, (bytes, memoryview)):
+        value = "\\x" + bytes(value).hex()
+    return (str(value).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+def _copy_buffer(rows: Sequence[Sequence[Any]]) -> io.StringIO:
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(_copy_value(v) for v in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    return buffer
+
+
+def _source_columns(s_conn: sqlite3.Connection, table: str) -> Optional[List[str]]:
+    """Stored columns of `table` in the source, or None if it doesn't exist there."""
+    rows = s_conn.execute(f"PRAGMA table_xinfo({table})").fetchall()
+    if not rows:
+        return None
+    # hidden: 0 = ordinary, 2/3 = generated (due_day, scheduled_day).
+    return [row[1] for row in rows if row[6] == 0]
+
+
+def _target_columns(p_cur, table: str) -> List[str]:
+    p_cur.execute("""
+        SELECT column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name = %s AND is_generated = 'NEVER'
+    """, (table,))
+    return [row[0] for row in p_cur.fetchall()]
+
+
+def _checkpoint(p_cur, table: str) -> Tuple[int, int, bool]:
+    p_cur.execute("SELECT last_rowid, rows_copied, finished FROM migrate_data_progress WHERE table_name = %s",
+                  (table,))
+    row = p_cur.fetchone()
+    return tuple(row) if row else (0, 0, False)
+
+
+def migrate_table(table: str, chunk_size: int) -> str:
+    """Copy one table, resuming after its checkpoint. Returns a one-line report."""
+    s_conn = sqlite3.connect(SQLITE_DB)
+    p_conn = psycopg2.connect(TARGET_DB_URL)
+    try:
+        p_cur = p_conn.cursor()
+        source = _source_columns(s_conn, table)
+        if source is None:
+            return f"{table}: not in source, skipped"
+        target = set(_target_columns(p_cur, table))
+        columns = [c for c in source if c in target and c not in SKIP_COLUMNS.get(table, ())]
+        dropped = [c for c in source if c not in columns]
+
+        last_rowid, copied, finished = _checkpoint(p_cur, table)
+        if finished:
+            return f"{table}: already copied ({copied} rows)"
+        if last_rowid:
+            print(f"{table}: resuming after rowid {last_rowid} ({copied} rows already copied)")
+
+        column_list = ", ".join(columns)
+        p_cur.execute(f"CREATE TEMP TABLE stage ON COMMIT DELETE ROWS AS SELECT {column_list} FROM {table} WITH NO DATA")
+        p_conn.commit()
+
+        started = time.time()
+        select = f"SELECT rowid, {column_list} FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?"
+        while True:
+            rows = s_conn.execute(select, (last_rowid, chunk_size)).fetchall()
+            if not rows:
+                break
+            last_rowid = rows[-1][0]
+            p_cur.copy_expert(f"COPY stage ({column_list}) FROM STDIN", _copy_buffer([row[1:] for row in rows]))
+            p_cur.execute(f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM stage ON CONFLICT DO NOTHING")
+            copied += len(rows)
+            p_cur.execute("""
+                INSERT INTO migrate_data_progress (table_name, last_rowid, rows_copied) VALUES (%s, %s, %s)
+                ON CONFLICT (table_name) DO UPDATE
+                SET last_rowid = excluded.last_rowid, rows_copied = excluded.rows_copied
+            """, (table, last_rowid, copied))
+            p_conn.commit()
+
+        p_cur.execute("""
+            INSERT INTO migrate_data_progress (table_name, last_rowid, rows_copied, finished) VALUES (%s, %s, %s, TRUE)
+            ON CONFLICT (table_name) DO UPDATE SET finished = TRUE
+        """, (table, last_rowid, copied))
+        p_conn.commit()
+        note = f", source-only columns not copied: {', '.join(dropped)}" if dropped else ""
+        return f"{table}: {copied} rows in {time.time() - started:.1f}s{note}"
+    finally:
+        s_conn.close()
+        p_conn.close()
+
+
+def migrate_group(tables: List[str], chunk_size: int) -> List[str]:
+    return [migrate_table(table, chunk_size) for table in tables]
+
+
+def reset_sequences(p_conn):
+    """Move each SERIAL sequence past the highest copied id (archived rows keep their ids too)."""
+    p_cur = p_conn.cursor()
+    for table, archive in SEQUENCES.items():
+        ids = f"SELECT id FROM {table}"
+        if archive:
+            ids += f" UNION ALL SELECT id FROM {archive}"
+        try:
+            p_cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                          f"COALESCE(MAX(id), 0) + 1, false) FROM ({ids}) AS ids")
+            p_conn.commit()
+        except Exception as e:
+            p_conn.rollback()
+            print(f"Warning resetting sequence for {table}: {e}")
+
+
+def migrate(chunk_size: int, workers: int, restart: bool):
     if not TARGET_DB_URL:
         print("Error: TARGET_DATABASE_URL environment variable is not set.")
         sys.exit(1)
-        
-    print(f"Migrating data from {SQLITE_DB} to Postgres...")
-    
     if not os.path.exists(SQLITE_DB):
         print(f"Error: Source SQLite DB not found at {SQLITE_DB}")
         sys.exit(1)
 
-    # 1. Connect to SQLite
-    sqlite_conn = sqlite3.connect(SQLITE_DB)
-    sqlite_conn.row_factory = sqlite3.Row
-    s_cur = sqlite_conn.cursor()
-    
-    # 2. Connect to Postgres
+    print(f"Migrating data from {SQLITE_DB} to Postgres (chunks of {chunk_size}, {workers} workers)...")
     try:
-        pg_conn = psycopg2.connect(TARGET_DB_URL)
-        p_cur = pg_conn.cursor()
+        p_conn = psycopg2.connect(TARGET_DB_URL)
     except Exception as e:
         print(f"Failed to connect to Postgres: {e}")
         return
 
-    # 3. Migrate Users
-    print("Migrating users...")
-    s_cur.execute("SELECT push_token, created_at, last_active FROM users")
-    users = s_cur.fetchall()
-    if users:
-        execute_values(p_cur, """
-            INSERT INTO users (push_token, created_at, last_active) VALUES %s
-            ON CONFLICT (push_token) DO NOTHING
-        """, [(u['push_token'], u['created_at'], u['last_active']) for u in users])
-    
-    # 4. Migrate Goals
-    print("Migrating goals...")
-    s_cur.execute("SELECT id, title, description, status, created_at, notes FROM goals")
-    goals = s_cur.fetchall()
-    # Note: We preserve IDs to keep FKs intact.
-    # Postgres SERIAL starts at 1, so we might need to reset sequence after insert.
-    for g in goals:
-        p_cur.execute("""
-            INSERT INTO goals (id, title, description, status, created_at, notes)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            ON CONFLICT (id) DO UPDATE SET 
-                title=EXCLUDED.title, 
-                description=EXCLUDED.description,
-                status=EXCLUDED.status,
-                notes=EXCLUDED.notes
-        """, (g['id'], g['title'], g['description'], g['status'], g['created_at'], g['notes']))
-
-    # 5. Migrate Tasks
-    print("Migrating tasks...")
-    # Get columns dynamically or hardcode known ones defined in database.py
-    # id, goal_id, title, status, priority, due_date, scheduled_date, effort, blocker_reason, notes, created_at, updated_at
-    s_cur.execute("""
-        SELECT id, goal_id, title, status, priority, due_date, scheduled_date, effort, blocker_reason, notes, created_at, updated_at 
-        FROM tasks
+    p_cur = p_conn.cursor()
+    p_cur.execute("""
+        CREATE TABLE IF NOT EXISTS migrate_data_progress (
+            table_name TEXT PRIMARY KEY,
+            last_rowid BIGINT NOT NULL,
+            rows_copied BIGINT NOT NULL,
+            finished BOOLEAN NOT NULL DEFAULT FALSE
+        )
     """)
-    tasks = s_cur.fetchall()
-    for t in tasks:
-        p_cur.execute("""
-            INSERT INTO tasks (id, goal_id, title, status, priority, due_date, scheduled_date, effort, blocker_reason, notes, created_at, updated_at)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (id) DO UPDATE SET
-                title=EXCLUDED.title,
-                status=EXCLUDED.status,
-                updated_at=EXCLUDED.updated_at
-        """, (t['id'], t['goal_id'], t['title'], t['status'], t['priority'], t['due_date'], t['scheduled_date'], t['effort'], t['blocker_reason'], t['notes'], t['created_at'], t['updated_at']))
-
-    # 6. Migrate Messages (Optional - might be large)
-    print("Migrating messages (this might take a while)...")
-    s_cur.execute("SELECT id, role, content, tool_calls, tool_call_id, created_at FROM messages")
-    messages = s_cur.fetchall()
-    if messages:
-        # Batch insert for speed
-        msg_data = [(m['id'], m['role'], m['content'], m['tool_calls'], m['tool_call_id'], m['created_at']) for m in messages]
-        execute_values(p_cur, """
-            INSERT INTO messages (id, role, content, tool_calls, tool_call_id, created_at)
-            VALUES %s
-            ON CONFLICT (id) DO NOTHING
-        """, msg_data)
-
-    # 7. Update Sequences (Essential for Postgres so next INSERT doesn't collide with migrated IDs)
+    if restart:
+        # Already-copied rows stay; ON CONFLICT DO NOTHING makes the re-run harmless.
+        p_cur.execute("DELETE FROM migrate_data_progress")
+    p_conn.commit()
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for report in pool.map(lambda group: migrate_group(group, chunk_size), TABLE_GROUPS):
+            for line in report:
+                print(line)
+    for line in migrate_group(FINAL_TABLES, chunk_size):
+        print(line)
+
     print("Resetting sequences...")
-    for table in ['goals', 'tasks', 'messages', 'users']:
-        try:
-             # This SQL works for Postgres > 10 identity columns or serial
-             # Simplest generic way for SERIAL:
-             p_cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE(MAX(id), 1) + 1, false) FROM {table}")
-        except Exception as e:
-            print(f"Warning resetting sequence for {table}: {e}")
+    reset_sequences(p_conn)
+    p_conn.close()
+    print(f"Migration Complete in {time.time() - started:.1f}s! 🌮")
 
-    pg_conn.commit()
-    print("Migration Complete! 🌮")
-    
-    s_cur.close()
-    p_cur.close()
-    sqlite_conn.close()
-    pg_conn.close()
 
 if __name__ == "__main__":
-    migrate()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--source", default=SQLITE_DB, help="SQLite database to copy (default: %(default)s)")
+    parser.add_argument("--chunk-size", type=int, default=5000, help="rows per COPY (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=4, help="tables loaded in parallel (default: %(default)s)")
+    parser.add_argument("--restart", action="store_true", help="ignore checkpoints from an earlier run")
+    args = parser.parse_args()
+    SQLITE_DB = args.source
+    migrate(args.chunk_size, args.workers, args.restart)
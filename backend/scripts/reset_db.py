@@ -25,9 +25,7 @@ def reset_db():
     
     print("Resetting 'session_summary'...")
     c.execute("DELETE FROM session_summary")
-    c.execute("DELETE FROM sqlite_sequence WHERE name='session_summary'")
-    # Re-initialize summary row
-    c.execute("INSERT INTO session_summary (id, content, last_summarized_message_id) VALUES (1, '', 0)")
+    # Rows are per user and created by the first summary.
     
     conn.commit()
     conn.close()
@@ -0,0 +1,36 @@
+"""
+Prints the bearer token a client sends to act as a tenant:
+
+    Authorization: Bearer <token>     (HTTP)
+    /ws/transcribe?token=<token>      (websocket)
+
+TENANT_AUTH_SECRET must match the server's.
+
+Usage:
+    python scripts/tenant_token.py <user_id>
+"""
+import os
+import sys
+from dotenv import load_dotenv
+
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(backend_dir)
+load_dotenv(os.path.join(backend_dir, ".env"))
+
+import database
+
+
+def main() -> int:
+    if len(sys.argv) != 2:
+        print(__doc__)
+        return 2
+    try:
+        print(database.tenant_token(sys.argv[1]))
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
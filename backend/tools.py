@@ -179,7 +179,7 @@ def bulk_update_tasks(updates: List[Dict[str, Any]]) -> str:
         ]
         
     Returns:
-        JSON string confirming the number of tasks updated.
+        JSON string with the number of tasks updated and any ids that were not found.
     """
     try:
         # If the model passes a string instead of a list (common edge case), try to parse it
@@ -189,9 +189,14 @@ def bulk_update_tasks(updates: List[Dict[str, Any]]) -> str:
             except:
                 return json.dumps({"status": "error", "message": "Invalid format for updates. Must be a List of Dictionaries or a JSON string."})
         
-        count = database.bulk_update_tasks(updates)
-
-        return json.dumps({"status": "success", "message": f"Successfully updated {count} tasks."})
+        result = database.bulk_update_tasks(updates)
+
+        message = f"Successfully updated {len(result['updated'])} tasks."
+        if result['missing']:
+            message += f" No task found for ids: {result['missing']}."
+        if result['skipped']:
+            message += f" Nothing to update for ids: {result['skipped']}."
+        return json.dumps({"status": "success", "message": message, **result})
     except Exception as e:
         return json.dumps({"status": "error", "message": str(e)})
 
@@ -402,6 +407,29 @@ def get_recent_reflections(limit: int = 5, reflection_type: Optional[str] = None
     except Exception as e:
         return json.dumps({"status": "error", "message": str(e)})
 
+def search_memory(query: str, kind: Optional[str] = None, limit: int = 10) -> str:
+    """
+    Searches everything the user has said, past reflections, and tasks (including
+    archived ones) by keyword. Use when the user refers to something from an older
+    conversation ("remember when I told you about...") or before asking them
+    something they may already have told you.
+
+    Args:
+        query: Keywords to look for (e.g. "sister visit", "tax documents").
+        kind: Optional filter: "message", "reflection", or "task".
+        limit: Maximum number of matches. Default 10.
+
+    Returns:
+        JSON string with the best matches first: kind, source_id, created_at and a snippet.
+    """
+    try:
+        if kind and kind not in database.MEMORY_SEARCH_KINDS:
+            return json.dumps({"status": "error", "message": f"kind must be one of {', '.join(database.MEMORY_SEARCH_KINDS)}"})
+        results = database.search_memory(query, max(1, min(limit, 50)), kind)
+        return json.dumps(results)
+    except Exception as e:
+        return json.dumps({"status": "error", "message": str(e)})
+
 
 def schedule_wake_up(minutes: int, reason: str) -> str:
     """
@@ -417,17 +445,16 @@ def schedule_wake_up(minutes: int, reason: str) -> str:
     """
     try:
         # Import lazily to avoid circular imports if scheduler imports tools
-        from proactive_scheduler import scheduler
-        from agent import wake_cooper
+        from proactive_scheduler import scheduler, wake_tenant
         from apscheduler.triggers.date import DateTrigger
         from datetime import datetime, timedelta
         
         run_date = datetime.now() + timedelta(minutes=minutes)
         
         scheduler.add_job(
-            wake_cooper, 
+            wake_tenant, 
             DateTrigger(run_date=run_date), 
-            args=[reason],
+            args=[database.current_tenant.get(), reason],
             name=f"Self-Scheduled: {reason}"
         )
         
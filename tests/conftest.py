@@ -0,0 +1,47 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend")
+sys.path.insert(0, BACKEND_DIR)
+
+# Modules that read their settings from the environment at import time.
+_FRESH_MODULES = ("database", "db_pool", "memory_index", "async_database", "prompts", "tools", "agent")
+
+
+def _forget_modules():
+    for name in _FRESH_MODULES:
+        sys.modules.pop(name, None)
+
+
+@pytest.fixture
+def load_database(tmp_path, monkeypatch):
+    """
+    Import a fresh copy of backend/database.py working in tmp_path (it creates
+    nachos.db in the working directory on import). Keyword arguments become
+    environment variables for that import, e.g. load_database(TENANT_DB_DIR="t").
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+    loaded = []
+
+    def load(**env):
+        for key, value in env.items():
+            monkeypatch.setenv(key, str(value))
+        _forget_modules()
+        module = importlib.import_module("database")
+        loaded.append(module)
+        return module
+
+    yield load
+    for module in loaded:
+        module.close_pool()
+    _forget_modules()
+
+
+@pytest.fixture
+def db(load_database):
+    """backend/database.py on a fresh single-file SQLite database."""
+    return load_database()
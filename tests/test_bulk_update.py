@@ -0,0 +1,80 @@
+import os
+import re
+
+import pytest
+
+
+def _archive(db, *task_ids):
+    for task_id in task_ids:
+        db.update_task(task_id, {"status": "DONE"})
+    with db.get_cursor() as c:
+        c.execute("UPDATE tasks SET updated_at = '2000-01-01T00:00:00'")
+    assert db.archive_cold_rows(task_age_days=1)["tasks"] == len(task_ids)
+
+
+def _check_bulk_update(db):
+    first, second, third = (db.create_task(title) for title in ("first", "second", "third"))
+    result = db.bulk_update_tasks([
+        {"id": first, "status": "IN_PROGRESS"},
+        {"id": second, "priority": "HIGH", "scheduled_date": "2026-02-02"},
+        {"id": third, "not_a_column": 1},
+        {"id": third + 1000, "status": "DONE"},
+        {"id": "nope", "status": "DONE"},
+    ])
+    assert result == {"updated": [first, second], "missing": ["nope", third + 1000], "skipped": [third]}
+    tasks = {task['id']: task for task in db.list_tasks()}
+    assert tasks[first]['status'] == "IN_PROGRESS"
+    assert tasks[second]['priority'] == "HIGH"
+    assert str(tasks[second]['scheduled_date']) == "2026-02-02"
+
+
+def test_bulk_update_result_shape(db):
+    _check_bulk_update(db)
+
+
+def test_update_task_restores_archived_task(db):
+    task_id = db.create_task("finished long ago")
+    _archive(db, task_id)
+    assert db.list_tasks() == []
+
+    assert db.update_task(task_id, {"status": "TODO"})
+    [task] = db.list_tasks()
+    assert (task['id'], task['title'], task['status']) == (task_id, "finished long ago", "TODO")
+    assert db.get_archive_stats()["archived_tasks"] == 0
+    assert [hit['source_id'] for hit in db.search_memory("finished")] == [task_id]
+
+
+def test_bulk_update_restores_archived_tasks(db):
+    archived, hot = db.create_task("archived"), db.create_task("hot")
+    _archive(db, archived)
+    result = db.bulk_update_tasks([{"id": archived, "status": "TODO"}, {"id": hot, "status": "TODO"}])
+    assert result == {"updated": [archived, hot], "missing": [], "skipped": []}
+    assert sorted(task['id'] for task in db.list_tasks(status="TODO")) == [archived, hot]
+
+
+def test_bulk_update_on_postgres(load_database):
+    """Runs the prepared bulk UPDATE against a real server when TEST_DATABASE_URL names one."""
+    pytest.importorskip("psycopg2")
+    url = os.getenv("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("set TEST_DATABASE_URL to run against Postgres")
+    db = load_database(DATABASE_URL=url)
+    with db.tenant_scope(f"bulk-test-{os.getpid()}"):
+        _check_bulk_update(db)
+
+
+# Postgres column types of `tasks` after migration 003.
+_PG_TASK_TYPES = {
+    "id": "INTEGER", "title": "TEXT", "status": "TEXT", "priority": "TEXT", "due_date": "DATE",
+    "scheduled_date": "DATE", "effort": "TEXT", "blocker_reason": "TEXT", "notes": "TEXT",
+    "updated_at": "TIMESTAMP",
+}
+
+
+def test_postgres_bulk_update_casts_every_parameter(db):
+    columns = tuple(sorted(db.ALLOWED_TASK_COLUMNS))
+    sql = db._bulk_update_tasks_sql(columns, 2, postgres=True)
+    assert "?" not in re.sub(r"CAST\(\? AS \w+\)", "", sql)
+    casts = re.findall(r"CAST\(\? AS (\w+)\)", sql)
+    expected = [_PG_TASK_TYPES[col] for col in ("id",) + columns] * 2 + [_PG_TASK_TYPES["updated_at"]]
+    assert casts == expected
@@ -0,0 +1,36 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("httpx")
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, message):
+        self.sent.append(message)
+
+
+def test_message_reaches_only_its_tenant(db):
+    import connection_manager
+
+    manager = connection_manager.ConnectionManager()
+    alice, bob = FakeSocket(), FakeSocket()
+
+    async def scenario():
+        await manager.connect(alice, "alice")
+        await manager.connect(bob, "bob")
+        await manager.send_to_tenant("alice", "hi alice")
+
+    asyncio.run(scenario())
+    assert [m["text"] for m in alice.sent] == ["hi alice"]
+    assert bob.sent == []
+
+    manager.disconnect(alice)
+    assert "alice" not in manager.active_connections
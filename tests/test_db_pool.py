@@ -0,0 +1,55 @@
+import threading
+
+import db_pool
+
+
+def _read_in_threads(pool, count):
+    def read():
+        conn = pool.acquire_reader()
+        try:
+            conn.execute("SELECT 1").fetchone()
+        finally:
+            pool.release_reader(conn)
+
+    threads = [threading.Thread(target=read) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_readers_do_not_grow_with_threads(tmp_path):
+    pool = db_pool.SQLitePool(str(tmp_path / "pool.db"), idle_readers=2)
+    try:
+        for _ in range(5):
+            _read_in_threads(pool, 10)
+        stats = pool.stats()
+        assert stats["read_checkouts"] == 50
+        assert stats["reader_connections"] <= 2
+        assert stats["idle_readers"] == stats["reader_connections"]
+    finally:
+        pool.close()
+
+
+def test_concurrent_readers_get_separate_connections(tmp_path):
+    pool = db_pool.SQLitePool(str(tmp_path / "pool.db"), idle_readers=1)
+    try:
+        first, second = pool.acquire_reader(), pool.acquire_reader()
+        assert first is not second
+        assert pool.stats()["reader_connections"] == 2
+        pool.release_reader(first)
+        pool.release_reader(second)
+        assert pool.stats()["reader_connections"] == 1
+        assert pool.acquire_reader() is first
+    finally:
+        pool.close()
+
+
+def test_readonly_cursors_return_their_reader(db):
+    db.create_task("a task")
+    for _ in range(3):
+        thread = threading.Thread(target=db.list_tasks)
+        thread.start()
+        thread.join()
+    stats = db.get_pool_stats()
+    assert stats["reader_connections"] == stats["idle_readers"] == 1
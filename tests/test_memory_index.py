@@ -0,0 +1,91 @@
+import importlib
+
+import pytest
+
+pytest.importorskip("numpy")
+
+
+@pytest.fixture
+def memory_index(db, tmp_path, monkeypatch):
+    monkeypatch.setenv("MEMORY_INDEX_DIR", str(tmp_path / "index"))
+    return importlib.import_module("memory_index")
+
+
+def _entry_id(db, kind, source_id):
+    with db.get_cursor(readonly=True) as c:
+        c.execute("SELECT id FROM memory_entries WHERE kind = ? AND source_id = ?", (kind, source_id))
+        return c.fetchone()['id']
+
+
+def test_edits_are_indexed_under_a_new_id(db):
+    message_id = db.add_message("user", "walk the dog")
+    before = _entry_id(db, "message", message_id)
+    db.update_message_content(message_id, "feed the cat")
+    assert _entry_id(db, "message", message_id) > before
+
+
+def test_archived_edits_are_indexed_under_a_new_id(db):
+    message_id = db.add_message("user", "walk the dog")
+    db.add_message("assistant", "ok")
+    db.update_summary("summary", message_id)
+    assert db.archive_cold_rows(keep_recent_messages=0)["messages"] >= 1
+    before = _entry_id(db, "message", message_id)
+    assert db.update_message_content(message_id, "feed the cat")
+    assert _entry_id(db, "message", message_id) > before
+    assert [r['source_id'] for r in db.search_memory("cat")] == [message_id]
+
+
+def test_sync_embeds_edited_text(db, memory_index):
+    message_id = db.add_message("user", "walk the dog")
+    index = memory_index._index_for_tenant()
+    index.sync()
+    db.update_message_content(message_id, "feed the cat")
+    index.sync()
+    assert db.get_memory_entries(index.search("cat", 1))[0]['source_id'] == message_id
+
+
+def test_indexes_sharing_a_directory_pick_up_each_others_appends(db, memory_index, tmp_path):
+    path = str(tmp_path / "shared")
+    first = memory_index.MemoryIndex(path)
+    second = memory_index.MemoryIndex(path)
+    db.add_message("user", "one")
+    first.sync()
+    db.add_message("user", "two")
+    second.sync()
+    db.add_message("user", "three")
+    first.sync()
+
+    fresh = memory_index.MemoryIndex(path)
+    ids = list(fresh.entry_ids[:fresh.count])
+    assert ids == sorted(set(ids))
+    assert fresh.count == db.count_memory_entries() == 3
+
+
+def test_staleness_is_checked_only_occasionally(db, memory_index, monkeypatch):
+    index = memory_index._index_for_tenant()
+    calls = []
+    monkeypatch.setattr(db, "count_memory_entries", lambda: calls.append(1) or 0)
+    for _ in range(5):
+        index.rebuild_if_stale()
+    assert len(calls) <= 1
+
+
+def test_entry_committed_out_of_id_order_is_not_skipped(db, memory_index, tmp_path):
+    index = memory_index.MemoryIndex(str(tmp_path / "late"), overlap=3)
+    for i in range(5):
+        db.add_message("user", f"message {i}")
+    with db.get_cursor(readonly=True) as c:
+        c.execute("SELECT * FROM memory_entries ORDER BY id")
+        entries = [dict(r) for r in c.fetchall()]
+    late = entries[3]
+    # A transaction that took an id earlier commits after a later one.
+    with db.get_cursor() as c:
+        c.execute("DELETE FROM memory_entries WHERE id = ?", (late['id'],))
+    index.sync()
+    with db.get_cursor() as c:
+        c.execute("INSERT INTO memory_entries (id, user_id, kind, source_id, body, created_at) "
+                  "VALUES (?, ?, ?, ?, ?, ?)",
+                  (late['id'], late['user_id'], late['kind'], late['source_id'], late['body'], late['created_at']))
+    index.sync()
+    index.sync()
+    assert sorted(index.entry_ids[:index.count].tolist()) == [e['id'] for e in entries]
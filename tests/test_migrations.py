@@ -0,0 +1,83 @@
+import sqlite3
+from contextlib import contextmanager
+
+import pytest
+
+
+@pytest.fixture
+def sharded(load_database, tmp_path):
+    """database.py with one file per tenant, so each tenant migrates when first opened."""
+    return load_database(TENANT_DB_DIR=tmp_path / "tenants")
+
+
+@contextmanager
+def open_at(db, monkeypatch, tenant, version):
+    """A write cursor on `tenant`'s new database, migrated only up to `version`."""
+    full = db.MIGRATIONS
+    monkeypatch.setattr(db, "MIGRATIONS", [m for m in full if m[0] <= version])
+    monkeypatch.setattr(db, "SCHEMA_VERSION", version)
+    with db.tenant_scope(tenant), db.get_cursor() as c:
+        yield c
+    monkeypatch.setattr(db, "MIGRATIONS", full)
+    monkeypatch.setattr(db, "SCHEMA_VERSION", full[-1][0])
+    # The next use of the tenant migrates the rest of the way.
+    db._migrated_tenants.discard(tenant)
+
+
+def test_fresh_database_is_at_latest_version(db):
+    with db.get_cursor(readonly=True) as c:
+        assert db._current_schema_version(c) == db.SCHEMA_VERSION
+
+
+def test_upgrade_from_single_tenant_schema(sharded, monkeypatch):
+    db = sharded
+    with open_at(db, monkeypatch, "alice", 6) as c:
+        c.execute("INSERT INTO goals (title, status, created_at) VALUES ('Ship it', 'ACTIVE', '2026-01-01')")
+        for title in ("Write docs", "Fix bug", "Gone"):
+            c.execute("INSERT INTO tasks (title, goal_id, status, created_at, updated_at) "
+                      "VALUES (?, 1, 'TODO', '2026-01-02T09:00:00', '2026-01-02T09:00:00')", (title,))
+        # A deleted row leaves the AUTOINCREMENT counter past the highest live id.
+        c.execute("DELETE FROM tasks WHERE title = 'Gone'")
+        c.execute("INSERT INTO messages (role, content, created_at, visible) "
+                  "VALUES ('user', 'remember the milk', '2026-01-02T09:00:00', 1)")
+
+    with db.tenant_scope("alice"):
+        tasks = db.list_tasks()
+        assert sorted(t['title'] for t in tasks) == ["Fix bug", "Write docs"]
+        # Three inserts and a delete under the old shared counter; it carries over.
+        assert db.get_table_versions()["tasks"] == 4
+        assert db.create_task("After upgrade") == 4
+        assert [r['kind'] for r in db.search_memory("milk")] == ["message"]
+        assert [r['kind'] for r in db.search_memory("upgrade")] == ["task"]
+        with db.get_cursor(readonly=True) as c:
+            assert db._current_schema_version(c) == db.SCHEMA_VERSION
+            c.execute("SELECT DISTINCT user_id FROM task_history")
+            assert [r['user_id'] for r in c.fetchall()] == ["alice"]
+
+
+def test_tenant_without_rows_keeps_its_change_counter(sharded, monkeypatch):
+    db = sharded
+    with open_at(db, monkeypatch, "bob", 10) as c:
+        c.execute("INSERT INTO tasks (user_id, title, status, created_at, updated_at) "
+                  "VALUES ('bob', 'Only task', 'TODO', '2026-01-02T09:00:00', '2026-01-02T09:00:00')")
+        c.execute("DELETE FROM tasks")
+
+    with db.tenant_scope("bob"):
+        # No tasks left to find bob by, but his clients hold ETags at version 2.
+        assert db.get_table_versions()["tasks"] == 2
+        db.create_task("After upgrade")
+        assert db.get_table_versions()["tasks"] == 3
+
+
+def test_inserts_must_name_their_user(db):
+    conn = sqlite3.connect(db.DB_NAME)
+    try:
+        for statement in (
+            "INSERT INTO tasks (title) VALUES ('x')",
+            "INSERT INTO messages (role, content) VALUES ('user', 'x')",
+            "INSERT INTO goals (title) VALUES ('x')",
+        ):
+            with pytest.raises(sqlite3.IntegrityError, match="user_id"):
+                conn.execute(statement)
+    finally:
+        conn.close()
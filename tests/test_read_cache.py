@@ -0,0 +1,46 @@
+def test_cached_reads_see_committed_writes(db):
+    assert db.list_goals() == []
+    goal_id = db.create_goal("Ship it")
+    assert [g['title'] for g in db.list_goals()] == ["Ship it"]
+    db.update_goal(goal_id, {"title": "Ship it twice"})
+    assert [g['title'] for g in db.list_goals()] == ["Ship it twice"]
+
+    db.set_profile("timezone", "UTC")
+    assert db.get_profile().get("timezone") == "UTC"
+    db.set_profile("timezone", "Europe/Berlin")
+    assert db.get_profile().get("timezone") == "Europe/Berlin"
+
+
+def test_repeat_reads_are_served_from_the_cache(db):
+    db.create_goal("Ship it")
+    db.list_goals()
+    hits = db.get_read_cache_stats()["hits"]
+    db.list_goals()
+    assert db.get_read_cache_stats()["hits"] == hits + 1
+
+
+def test_callers_cannot_corrupt_the_cache(db):
+    db.create_goal("Ship it")
+    db.list_goals()[0]['title'] = "mutated"
+    assert db.list_goals()[0]['title'] == "Ship it"
+
+
+def test_load_racing_a_write_is_not_stored(db):
+    db.create_goal("before")
+
+    def load():
+        rows = db._load_goals()
+        # A write commits while the stale rows are still in flight.
+        db.create_goal("after")
+        return rows
+
+    assert [g['title'] for g in db._cached("goals", load)] == ["before"]
+    assert sorted(g['title'] for g in db.list_goals()) == ["after", "before"]
+
+
+def test_cache_is_per_tenant(db):
+    with db.tenant_scope("alice"):
+        db.create_goal("alice's goal")
+        assert len(db.list_goals()) == 1
+    with db.tenant_scope("bob"):
+        assert db.list_goals() == []
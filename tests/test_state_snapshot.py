@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+
+
+def _day(offset: int) -> str:
+    return (datetime.now().date() + timedelta(days=offset)).strftime("%Y-%m-%d")
+
+
+def test_snapshot_reads_a_bounded_number_of_rows(load_database):
+    db = load_database(SNAPSHOT_LIST_LIMIT=3)
+    for i in range(40):
+        db.create_task(f"todo {i}")
+    for i in range(5):
+        db.create_task(f"late {i}", due_date=_day(-1 - i))
+    db.create_task("today", scheduled_date=_day(0))
+
+    with db.query_scope("snapshot") as stats:
+        snapshot = db.StateSnapshot.load()
+    assert stats.rows < 40
+
+    markdown = snapshot.to_markdown()
+    assert "[ID: 46] **today**" in markdown
+    assert "... and 2 more overdue tasks" in markdown
+    assert "... and 39 more tasks to do" in markdown
+
+    context = snapshot.wake_context()
+    assert context["overdue_count"] == len(db.get_overdue_tasks()) == 5
+    assert context["todays_scheduled"] == 1
+
+
+def test_snapshot_matches_the_standalone_queries(db):
+    goal = db.create_goal("Launch")
+    done = db.create_task("shipped", goal_id=goal)
+    db.update_task(done, {"status": "DONE"})
+    db.create_task("late", goal_id=goal, due_date=_day(-2))
+    db.create_task("postponed", scheduled_date=_day(-3))
+    blocked = db.create_task("stuck")
+    db.update_task(blocked, {"status": "BLOCKED", "blocker_reason": "waiting"})
+    db.set_profile("timezone", "UTC")
+
+    snapshot = db.StateSnapshot.load()
+    assert snapshot.goal_progress() == db.get_goal_progress()
+    assert snapshot.overdue_tasks() == db.get_overdue_tasks()
+    assert snapshot.rescheduled_tasks() == db.get_rescheduled_tasks()
+    assert snapshot.task_stats() == db.get_task_stats()
+    assert [t['id'] for t in snapshot.blocked_tasks()] == [blocked]
+    assert snapshot.profile == db.get_profile()
+    assert snapshot.goals == db.list_goals()
@@ -0,0 +1,25 @@
+def test_summary_only_moves_forward(db):
+    assert db.update_summary("up to 10", 10)
+    assert not db.update_summary("stale, up to 5", 5)
+    assert not db.update_summary("same chunk again", 10)
+    assert db.get_memory_context_after(0)[:2] == ("up to 10", 10)
+
+    assert db.update_summary("up to 20", 20)
+    assert db.get_memory_context_after(0)[:2] == ("up to 20", 20)
+
+
+def test_summaries_are_per_tenant(db):
+    with db.tenant_scope("alice"):
+        assert db.update_summary("alice, up to 50", 50)
+    with db.tenant_scope("bob"):
+        # Alice's progress doesn't hold bob's summary back.
+        assert db.update_summary("bob, up to 3", 3)
+        assert db.get_memory_context_after(0)[:2] == ("bob, up to 3", 3)
+
+
+def test_unsummarized_messages_follow_the_summary(db):
+    ids = [db.add_message("user", f"message {n}") for n in range(4)]
+    db.update_summary("first two", ids[1])
+    summary, last_id, messages = db.get_memory_context_after(0)
+    assert (summary, last_id) == ("first two", ids[1])
+    assert [m['id'] for m in messages] == ids[2:]
@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+
+def test_tenants_see_only_their_own_rows(db):
+    with db.tenant_scope("alice"):
+        db.create_task("alice's task")
+        db.add_message("user", "alice's message")
+    with db.tenant_scope("bob"):
+        assert db.list_tasks() == []
+        assert db.search_memory("message") == []
+        db.create_task("bob's task")
+    with db.tenant_scope("alice"):
+        assert [t['title'] for t in db.list_tasks()] == ["alice's task"]
+
+
+def test_change_counters_are_per_tenant(db):
+    with db.tenant_scope("alice"):
+        db.create_task("first")
+        before = db.get_table_versions()
+    with db.tenant_scope("bob"):
+        bob_before = db.get_table_versions()
+        task_id = db.create_task("bob's task")
+        db.update_task(task_id, {"status": "DONE"})
+        assert db.get_table_versions()["tasks"] > bob_before.get("tasks", 0)
+    with db.tenant_scope("alice"):
+        assert db.get_table_versions() == before
+        db.create_task("second")
+        assert db.get_table_versions()["tasks"] == before["tasks"] + 1
+
+
+def test_data_version_is_per_tenant(db):
+    with db.tenant_scope("alice"):
+        alice = db.data_version()
+    with db.tenant_scope("bob"):
+        db.create_task("bob's task")
+    with db.tenant_scope("alice"):
+        assert db.data_version() == alice
+        db.create_task("alice's task")
+        assert db.data_version() > alice
+
+
+def test_sharded_tenants_get_their_own_files(load_database, tmp_path):
+    db = load_database(TENANT_DB_DIR=tmp_path / "tenants")
+    for tenant in ("alice", "bob"):
+        with db.tenant_scope(tenant):
+            db.create_task(f"{tenant}'s task")
+    assert db.list_tenants() == ["alice", "bob"]
+    assert {"alice.db", "bob.db"} <= set(os.listdir(tmp_path / "tenants"))
+    with db.tenant_scope("bob"):
+        assert [t['title'] for t in db.list_tasks()] == ["bob's task"]
+
+
+def test_invalid_tenant_rejected(db):
+    with pytest.raises(ValueError):
+        with db.tenant_scope("../etc/passwd"):
+            pass
@@ -0,0 +1,31 @@
+import pytest
+
+
+def test_token_round_trip(load_database):
+    db = load_database(TENANT_AUTH_SECRET="s3cret")
+    token = db.tenant_token("alice")
+    assert token.startswith("alice.")
+    assert db.tenant_from_token(token) == "alice"
+
+
+@pytest.mark.parametrize("token", ["alice", "alice.", "alice.deadbeef", "../x.abc", ""])
+def test_forged_tokens_rejected(load_database, token):
+    db = load_database(TENANT_AUTH_SECRET="s3cret")
+    with pytest.raises(ValueError):
+        db.tenant_from_token(token)
+
+
+def test_token_for_another_tenant_rejected(load_database):
+    db = load_database(TENANT_AUTH_SECRET="s3cret")
+    _, signature = db.tenant_token("alice").split(".")
+    with pytest.raises(ValueError):
+        db.tenant_from_token(f"bob.{signature}")
+
+
+def test_no_secret_means_no_tenant_can_be_claimed(load_database, monkeypatch):
+    monkeypatch.delenv("TENANT_AUTH_SECRET", raising=False)
+    db = load_database()
+    with pytest.raises(ValueError):
+        db.tenant_token("alice")
+    with pytest.raises(ValueError):
+        db.tenant_from_token("alice.deadbeef")
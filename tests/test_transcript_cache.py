@@ -0,0 +1,60 @@
+import importlib
+
+import pytest
+
+pytest.importorskip("google.genai")
+pytest.importorskip("langgraph")
+
+
+@pytest.fixture
+def agent(db, monkeypatch):
+    monkeypatch.setenv("GOOGLE_API_KEY", "test")
+    return importlib.import_module("agent")
+
+
+def _ids(transcript):
+    return [r['id'] for r in transcript.rows]
+
+
+def _stored_ids(db):
+    return [r['id'] for r in db.get_memory_context()[1]]
+
+
+def test_appends_are_read_incrementally(agent, db):
+    cache = agent.TranscriptCache(overlap=2)
+    for i in range(6):
+        db.add_message("user", f"message {i}")
+        assert _ids(cache.load()) == _stored_ids(db)
+    assert cache.get_stats()["misses"] == 1
+
+
+def test_edit_discards_the_cached_transcript(agent, db):
+    cache = agent.TranscriptCache(overlap=2)
+    message_id = db.add_message("user", "before")
+    cache.load()
+    db.update_message_content(message_id, "after")
+    assert cache.load().rows[-1]['content'] == "after"
+
+
+def test_message_committed_out_of_id_order_is_not_skipped(agent, db):
+    cache = agent.TranscriptCache(overlap=3)
+    ids = [db.add_message("user", f"message {i}") for i in range(5)]
+    # A transaction that took an id earlier commits after a later one.
+    with db.get_cursor() as c:
+        c.execute("DELETE FROM messages WHERE id = ?", (ids[3],))
+    cache.load()
+    with db.get_cursor() as c:
+        c.execute("INSERT INTO messages (id, user_id, role, content, visible, token_count) "
+                  "VALUES (?, ?, 'user', 'late', 1, 2)", (ids[3], db.current_tenant.get()))
+    assert _ids(cache.load()) == ids
+    assert cache.get_stats()["rebuilds"] == 1
+
+
+def test_summary_drops_covered_rows(agent, db):
+    cache = agent.TranscriptCache(overlap=2)
+    ids = [db.add_message("user", f"message {i}") for i in range(6)]
+    cache.load()
+    assert db.update_summary("summary", ids[2])
+    transcript = cache.load()
+    assert transcript.summary == "summary"
+    assert _ids(transcript) == ids[3:]
@@ -1,5 +1,6 @@
 import sys
 import os
+import json
 
 # Add parent dir to path to import backend modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -11,31 +12,36 @@ from backend.tools import bulk_update_tasks
 def verify_bulk_update():
     print("--- Starting Bulk Update Verification ---")
     
-    # 1. Setup: Create 3 dummy tasks
-    print("Creating 3 dummy tasks...")
+    # 1. Setup: Create 4 dummy tasks
+    print("Creating 4 dummy tasks...")
     id1 = db.create_task(title="Mock Task A")
     id2 = db.create_task(title="Mock Task B")
     id3 = db.create_task(title="Mock Task C")
+    id4 = db.create_task(title="Mock Task D")
     
-    print(f"Created IDs: {id1}, {id2}, {id3}")
+    print(f"Created IDs: {id1}, {id2}, {id3}, {id4}")
     
     # 2. Execute: Bulk Update
     # Task A -> DONE
     # Task B -> High Priority
     # Task C -> Scheduled for Tomorrow
     
+    # Plus an id that doesn't exist and an entry with nothing to update.
+    missing_id = id4 + 1000
+    
     updates = [
         {"id": id1, "status": "DONE"},
         {"id": id2, "priority": "HIGH"},
-        {"id": id3, "scheduled_date": "2026-02-02"}
+        {"id": id3, "scheduled_date": "2026-02-02"},
+        {"id": missing_id, "status": "DONE"},
+        {"id": id4, "unknown_field": "ignored"}
     ]
     
     print(f"Executing bulk_update_tasks with payload: {updates}")
     
     try:
-        # We invoke the tool wrapper directly to test JSON parsing too if we passed string, 
-        # but here we pass list object as the LLM would via binding.
-        result_json = bulk_update_tasks.invoke({"updates": updates})
+        # Tools are plain functions; pass the list object as the model's function call would.
+        result_json = bulk_update_tasks(updates)
         print(f"Tool Result: {result_json}")
     except Exception as e:
         print(f"FAILED: Tool invocation error: {e}")
@@ -50,6 +56,16 @@ def verify_bulk_update():
     
     errors = []
     
+    result = json.loads(result_json)
+    if result.get('status') != 'success':
+        errors.append(f"Tool returned {result.get('status')}: {result.get('message')}")
+    if sorted(result.get('updated', [])) != sorted([id1, id2, id3]):
+        errors.append(f"updated is {result.get('updated')}, expected {[id1, id2, id3]}")
+    if result.get('missing') != [missing_id]:
+        errors.append(f"missing is {result.get('missing')}, expected {[missing_id]}")
+    if result.get('skipped') != [id4]:
+        errors.append(f"skipped is {result.get('skipped')}, expected {[id4]}")
+    
     if task_a['status'] != 'DONE':
         errors.append(f"Task A (ID {id1}) status is {task_a['status']}, expected DONE")
     